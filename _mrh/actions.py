@@ -1,34 +1,269 @@
+import re
 import subprocess
+import time
 from pathlib import Path
 
-from .commands import COMMANDS
+from .commands import COMMANDS, CONCURRENCY_CLASSES
 from .logger import get_logger
-from .terminal import fname, run_cmd
+from .terminal import TIMEOUT_RETURNCODE, OutputSink, async_run_cmd, fname, run_cmd
 
 _log = get_logger(__name__)
 
-__all__ = ["Action"]
+__all__ = ["Action", "Result", "Workflow"]
+
+
+class Result(subprocess.CompletedProcess):
+    """A finished command with the repository it ran in and when it ran"""
+
+    def __init__(
+        self,
+        repo: Path,
+        process: subprocess.CompletedProcess,
+        started: float,
+        finished: float,
+        outputs: tuple[OutputSink, OutputSink] | None = None,
+    ) -> None:
+        super().__init__(
+            process.args, process.returncode, process.stdout, process.stderr
+        )
+        self.repo = repo
+        self.started = started  # time.time() timestamps
+        self.finished = finished
+        self.submitted = started  # when the engine queued it, set by the engine
+        self.cached = False  # reported from the result cache, did not run
+        # Total size of the output and the log files it was written to. When
+        # the output is bounded, stdout/stderr only hold its tail
+        out, err = outputs or (None, None)
+        self.stdout_size = out.size if out else len(process.stdout)
+        self.stderr_size = err.size if err else len(process.stderr)
+        self.stdout_path = out.path if out else None
+        self.stderr_path = err.path if err else None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+    def to_dict(self) -> dict:
+        return {
+            "repo": str(self.repo),
+            "returncode": self.returncode,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": self.duration,
+            "cached": self.cached,
+            "stdout_size": self.stdout_size,
+            "stderr_size": self.stderr_size,
+            "stdout_path": str(self.stdout_path) if self.stdout_path else None,
+            "stderr_path": str(self.stderr_path) if self.stderr_path else None,
+        }
+
+
+# Errors of network commands that are worth retrying
+TRANSIENT_ERRORS = re.compile(
+    rb"could not resolve host|connection (timed out|reset|refused)|timed out"
+    rb"|early eof|remote end hung up|rpc failed|temporary failure"
+    rb"|unable to access|could not read from remote",
+    re.IGNORECASE,
+)
 
 
 class Action:
+    timeout: float | None = None  # seconds, kill the command after it
+    retries: int = 0  # retries of network commands that failed transiently
+    backoff: float = 1.0  # seconds before the first retry, doubled every retry
+    max_output: int | None = None  # bytes of stdout/stderr to keep in memory
+    log_dir: Path | None = None  # write the full output of each repository here
+
     def __init__(self, command: str, subcommand: str, **kwargs) -> None:
         self._command = command
         self._subcommand = subcommand
         self._kwargs = kwargs
 
+    @property
+    def command(self) -> str:
+        return self._command
+
+    @property
+    def subcommand(self) -> str:
+        return self._subcommand
+
     @property
     def cmd_str(self) -> str:
         return COMMANDS[self._command][self._subcommand].format(**self._kwargs)
 
-    def __call__(self, repo: Path) -> subprocess.CompletedProcess:
+    @property
+    def key(self) -> str:
+        """Identifies the action across runs, e.g. "git fetch". Free commands
+        are identified by the command itself"""
+        if self._command == "cmd":
+            return self.cmd_str
+        return f"{self._command} {self._subcommand}"
+
+    def __call__(self, repo: Path) -> Result:
         return self.run(repo)
 
-    def run(self, repo: Path) -> subprocess.CompletedProcess:
-        _log.info(f"Running on {fname(repo.name)}")
-        return run_cmd(repo, self.cmd_str)
+    @property
+    def concurrency_class(self) -> str:
+        return CONCURRENCY_CLASSES[self._command][self._subcommand]
+
+    @property
+    def retryable(self) -> bool:
+        return self.concurrency_class == "network"
+
+    def should_retry(
+        self, repo: Path, process: subprocess.CompletedProcess, attempt: int
+    ) -> bool:
+        """Whether a failed network command looks like a transient failure
+        that is worth running again"""
+        if process.returncode == 0 or attempt >= self.retries or not self.retryable:
+            return False
+        if process.returncode != TIMEOUT_RETURNCODE and not TRANSIENT_ERRORS.search(
+            process.stderr
+        ):
+            return False
+        _log.warning(
+            f"{fname(repo.name)} failed, retrying in {self.delay(attempt)}s "
+            f"({attempt + 1}/{self.retries})",
+            extra={"repo": str(repo)},
+        )
+        return True
+
+    def delay(self, attempt: int) -> float:
+        return self.backoff * 2**attempt
+
+    def outputs(self, repo: Path) -> tuple[OutputSink, OutputSink]:
+        """Where the stdout and stderr of the command in `repo` go"""
+        if self.log_dir is None:
+            return OutputSink(self.max_output), OutputSink(self.max_output)
+        try:
+            name = "__".join(repo.relative_to(Path.cwd()).parts)
+        except ValueError:
+            name = repo.name
+        return (
+            OutputSink(self.max_output, self.log_dir / f"{name}.stdout.log"),
+            OutputSink(self.max_output, self.log_dir / f"{name}.stderr.log"),
+        )
+
+    def run(self, repo: Path, stream: bool = False) -> Result:
+        _log.info(f"Running on {fname(repo.name)}", extra={"repo": str(repo)})
+        started = time.time()
+        attempt = 0
+        while True:
+            outputs = self.outputs(repo)
+            process = run_cmd(repo, self.cmd_str, self.timeout, *outputs, stream)
+            if not self.should_retry(repo, process, attempt):
+                return Result(repo, process, started, time.time(), outputs)
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    async def arun(self, repo: Path, stream: bool = False) -> Result:
+        import asyncio
+
+        _log.info(f"Running on {fname(repo.name)}", extra={"repo": str(repo)})
+        started = time.time()
+        attempt = 0
+        while True:
+            outputs = self.outputs(repo)
+            process = await async_run_cmd(
+                repo, self.cmd_str, stream, self.timeout, *outputs
+            )
+            if not self.should_retry(repo, process, attempt):
+                return Result(repo, process, started, time.time(), outputs)
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+    def to_dict(self) -> dict:
+        """Everything needed to run the action in another process or host"""
+        return {
+            "command": self._command,
+            "subcommand": self._subcommand,
+            "kwargs": self._kwargs,
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "backoff": self.backoff,
+            "max_output": self.max_output,
+            "log_dir": str(self.log_dir) if self.log_dir is not None else None,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "Action":
+        action: Action
+        if "steps" in data:
+            steps = [Action.from_dict(step) for step in data["steps"]]
+            action = Workflow(data["subcommand"], steps, data["name"])
+        else:
+            action = Action(data["command"], data["subcommand"], **data["kwargs"])
+        action.timeout = data["timeout"]
+        action.retries = data["retries"]
+        action.backoff = data["backoff"]
+        action.max_output = data["max_output"]
+        action.log_dir = Path(data["log_dir"]) if data["log_dir"] else None
+        return action
 
     def __str__(self) -> str:
         return self.cmd_str
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self._command}, {self._subcommand})"
+
+
+class Workflow(Action):
+    """Several actions run one after the other in each repository. A
+    repository stops at its first failing step and does not wait for the
+    other repositories between steps"""
+
+    def __init__(self, subcommand: str, steps: list[Action], name: str = "") -> None:
+        super().__init__("workflow", subcommand)
+        self.steps = steps
+        self.name = name
+
+    @property
+    def cmd_str(self) -> str:
+        return " && ".join(step.cmd_str for step in self.steps)
+
+    @property
+    def key(self) -> str:
+        return f"workflow {self.name}" if self.name else self.cmd_str
+
+    @property
+    def concurrency_class(self) -> str:
+        # The most demanding class of its steps
+        classes = {step.concurrency_class for step in self.steps}
+        return next(c for c in ("cpu", "io", "network") if c in classes)
+
+    def to_dict(self) -> dict:
+        steps = [step.to_dict() for step in self.steps]
+        return {**super().to_dict(), "steps": steps, "name": self.name}
+
+    def _result(self, repo: Path, started: float, results: list[Result]) -> Result:
+        process = subprocess.CompletedProcess(
+            [r.args for r in results],
+            results[-1].returncode,
+            b"".join(r.stdout for r in results),
+            b"".join(r.stderr for r in results),
+        )
+        result = Result(repo, process, started, time.time())
+        result.stdout_size = sum(r.stdout_size for r in results)
+        result.stderr_size = sum(r.stderr_size for r in results)
+        # Logs of the last step that ran, the failing one if any
+        result.stdout_path = results[-1].stdout_path
+        result.stderr_path = results[-1].stderr_path
+        return result
+
+    def run(self, repo: Path, stream: bool = False) -> Result:
+        started = time.time()
+        results: list[Result] = []
+        for step in self.steps:
+            results.append(step.run(repo, stream))
+            if results[-1].returncode:
+                break
+        return self._result(repo, started, results)
+
+    async def arun(self, repo: Path, stream: bool = False) -> Result:
+        started = time.time()
+        results: list[Result] = []
+        for step in self.steps:
+            results.append(await step.arun(repo, stream))
+            if results[-1].returncode:
+                break
+        return self._result(repo, started, results)
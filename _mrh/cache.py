@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+
+from .actions import Action, Result
+from .gitrefs import Refs
+from .logger import get_logger
+from .terminal import cmd_header
+
+__all__ = ["ResultCache", "default_cache_dir"]
+
+_log = get_logger(__name__)
+
+CACHED_OUTPUT = 4096  # bytes of stdout/stderr kept in an entry (the tail)
+
+
+def default_cache_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "mrh"
+
+
+def git(repo: Path, *args: str) -> bytes | None:
+    proc = subprocess.run(["git", *args], cwd=repo, capture_output=True)
+    return proc.stdout if proc.returncode == 0 else None
+
+
+def content_fingerprint(repo: Path) -> str | None:
+    """Identifies the content of the working tree: the tree of HEAD and, when
+    there are changes, a hash of the changes to tracked files and of the
+    untracked (not ignored) files. None if it can not be computed"""
+    _, sha = Refs(repo).head()
+    if sha is None:
+        return None
+    tree = git(repo, "rev-parse", f"{sha}^{{tree}}")
+    status = git(repo, "status", "--porcelain", "-z", "--untracked-files=all")
+    if tree is None or status is None:
+        return None
+    if not status:
+        return tree.decode().strip()
+
+    changes = hashlib.sha256(status)
+    changes.update(git(repo, "diff", "HEAD", "--binary") or b"")
+    for entry in status.split(b"\0"):
+        if entry.startswith(b"?? "):
+            path = repo / os.fsdecode(entry[3:])
+            changes.update(entry)
+            try:
+                changes.update(path.read_bytes())
+            except OSError:
+                pass
+    return f"{tree.decode().strip()}+{changes.hexdigest()}"
+
+
+def tail(data: bytes) -> str:
+    return base64.b64encode(data[-CACHED_OUTPUT:]).decode()
+
+
+class ResultCache:
+    """Successful results of `cmd free` commands, keyed by the command, the
+    repository and its content, in `<directory>/results/<key[:2]>/<key>.json`.
+    Entries older than `max_age` days are evicted, then the least recently
+    used ones until the cache is smaller than `max_size` bytes. Without
+    `reuse` the results are only stored, e.g. with --force"""
+
+    def __init__(
+        self, directory: Path, max_size: int, max_age: float, reuse: bool = True
+    ) -> None:
+        self.directory = directory / "results"
+        self.max_size = max_size
+        self.max_age = max_age
+        self.reuse = reuse
+        self.keys: dict[Path, str] = {}  # computed before the command runs
+
+    def key(self, action: Action, repo: Path) -> str | None:
+        if (fingerprint := content_fingerprint(repo)) is None:
+            return None
+        # The path too: commands run in, and may print, their repository
+        data = f"{action.cmd_str}\0{repo.resolve()}\0{fingerprint}"
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, action: Action, repo: Path) -> Result | None:
+        if (key := self.key(action, repo)) is None:
+            return None
+        self.keys[repo] = key
+        if not self.reuse:
+            return None
+        try:
+            entry = json.loads(self.path(key).read_text())
+            os.utime(self.path(key))  # Recently used
+        except (OSError, ValueError):
+            return None
+        header = cmd_header(repo, action.cmd_str).encode()
+        process = subprocess.CompletedProcess(
+            action.cmd_str,
+            entry["returncode"],
+            header + base64.b64decode(entry["stdout"]),
+            base64.b64decode(entry["stderr"]),
+        )
+        now = time.time()
+        result = Result(repo, process, now, now)
+        result.stdout_size = len(header) + entry["stdout_size"]
+        result.stderr_size = entry["stderr_size"]
+        result.cached = True
+        return result
+
+    def lookup(
+        self, action: Action, repositories: list[Path], pool_size: int
+    ) -> dict[Path, Result]:
+        """Cached results of the repositories whose content did not change
+        since the command last succeeded in them"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(pool_size) as executor:
+            results = executor.map(lambda repo: self.get(action, repo), repositories)
+            hits = {repo: r for repo, r in zip(repositories, results) if r}
+        _log.info(f"{len(hits)} of {len(repositories)} results from the cache")
+        return hits
+
+    def store(self, action: Action, results: list[Result]):
+        for r in results:
+            if r.returncode != 0 or r.cached or (key := self.keys.get(r.repo)) is None:
+                continue
+            header = cmd_header(r.repo, action.cmd_str).encode()
+            stdout = r.stdout.removeprefix(header)
+            entry = {
+                "cmd": action.cmd_str,
+                "returncode": r.returncode,
+                "stdout": tail(stdout),
+                "stderr": tail(r.stderr),
+                "stdout_size": max(r.stdout_size - len(header), 0),
+                "stderr_size": r.stderr_size,
+                "duration": r.duration,
+            }
+            path = self.path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(entry))
+                os.replace(tmp, path)
+            except OSError as e:
+                _log.warning(f"Cannot write the result cache {str(path)!r}: {e}")
+        self.prune()
+
+    def prune(self):
+        entries = []
+        oldest = time.time() - self.max_age * 86400
+        for path in self.directory.glob("*/*.json"):
+            try:
+                st = path.stat()
+                if st.st_mtime < oldest:
+                    path.unlink()
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+            except OSError:
+                continue
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
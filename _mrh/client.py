@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+from typing import Callable
+
+from . import profiling
+
+__all__ = [
+    "forward",
+    "main",
+    "recv_frame",
+    "send_frame",
+    "socket_path",
+    "trusted_peer",
+]
+
+# Messages between the client and the daemon: channel (b"1" stdout, b"2"
+# stderr, b"x" exit code, b"j" json) and payload length, then the payload
+FRAME = struct.Struct(">cI")
+PEERCRED = struct.Struct("3i")  # pid, uid and gid of the other end of a socket
+
+# Commands that have to run in the current process
+LOCAL_ARGS = {"daemon", "COMPLETION", "-h", "--help", "--startup-profile", "--trace"}
+
+
+def is_private(path: str, kind: Callable[[int], bool]) -> bool:
+    """Whether `path` is of this kind (e.g. a folder), owned by this user and
+    can not be used by the other users"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return kind(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def socket_dir() -> str | None:
+    """Folder of the sockets of the daemons of this user, only readable by
+    them. None if it can not be trusted, e.g. another user created it first"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        path = os.path.join(runtime_dir, "mrh")
+    else:
+        path = f"/tmp/mrh-{os.getuid()}"
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    return path if is_private(path, stat.S_ISDIR) else None
+
+
+def socket_path(directory: str) -> str | None:
+    """Unix socket of the daemon serving `directory`"""
+    if (folder := socket_dir()) is None:
+        return None
+    digest = hashlib.sha1(directory.encode()).hexdigest()[:16]
+    return os.path.join(folder, f"{digest}.sock")
+
+
+def trusted_peer(sock: socket.socket) -> bool:
+    """Whether the other end of the socket runs as this user. Where the
+    credentials are not available, the private socket folder is enough"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size)
+    _, uid, _ = PEERCRED.unpack(creds)
+    return uid == os.getuid()
+
+
+def send_frame(sock: socket.socket, channel: bytes, data: bytes):
+    sock.sendall(FRAME.pack(channel, len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the mrh daemon")
+        data += chunk
+    return data
+
+
+def recv_frame(sock: socket.socket) -> tuple[bytes, bytes]:
+    channel, size = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+    return channel, _recv_exactly(sock, size)
+
+
+def connect(directory: str) -> socket.socket | None:
+    """Connection to the daemon serving `directory`, None if there is none
+    or if it is not one of this user"""
+    path = socket_path(directory)
+    if path is None or not is_private(path, stat.S_ISSOCK):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        if trusted_peer(sock):
+            return sock
+    except OSError:
+        pass
+    sock.close()
+    return None
+
+
+def forward(argv: list[str]) -> int | None:
+    """Run the command in the daemon serving the current directory, if there
+    is one. Returns its exit code, None when it has to run locally"""
+    if os.environ.get("MRH_NO_DAEMON") or not argv or LOCAL_ARGS & set(argv):
+        return None
+    cwd = os.path.realpath(os.getcwd())
+    if (sock := connect(cwd)) is None:
+        return None
+
+    with sock:
+        send_frame(sock, b"j", json.dumps({"argv": argv, "cwd": cwd}).encode())
+        outputs = {b"1": sys.stdout.buffer, b"2": sys.stderr.buffer}
+        while True:
+            try:
+                channel, data = recv_frame(sock)
+            except ConnectionError as e:
+                print(e, file=sys.stderr)
+                return 1
+            except KeyboardInterrupt:
+                return 130  # Closing the connection interrupts the command
+            if channel == b"x":
+                return int(data)
+            outputs[channel].write(data)
+            outputs[channel].flush()
+
+
+def main():
+    if (returncode := forward(sys.argv[1:])) is not None:
+        sys.exit(returncode)
+
+    with profiling.phase("import"):
+        from .runner import main as run_main
+    run_main()
@@ -6,6 +6,8 @@ COMMANDS = dict(
         commit='git commit -m "{message}"',
         push="git push",
         checkout="git checkout {branch}",
+        status="git status --short --branch",  # run natively by `status.py`
+        grep='git grep -n "{pattern}"',  # run natively by `grep.py`
         # stash="git stash",
         # unstash="git stash pop",
     ),
@@ -21,4 +23,50 @@ COMMANDS = dict(
         free="{free_command}",
         # test="{test_command}",
     ),
+    # Workflows run other commands, see `actions.Workflow`
+    workflow=dict(
+        run="{workflow}",
+        steps="{steps}",
+    ),
+    # Not run in the repositories, see `daemon.py`
+    daemon=dict(
+        start="start",
+        stop="stop",
+        status="status",
+    ),
+)
+
+# How each command uses the machine. Used by the adaptive scheduler to decide
+# how many of them can run at the same time (see `scheduler.CLASS_LIMITS`)
+CONCURRENCY_CLASSES = dict(
+    git=dict(
+        fetch="network",
+        pull="network",
+        add="io",
+        commit="io",
+        push="network",
+        checkout="io",
+        status="io",
+        grep="io",
+    ),
+    pipenv=dict(
+        location="io",
+        lock="cpu",
+        remove="io",
+        sync="cpu",
+        update="cpu",
+        install="cpu",
+    ),
+    cmd=dict(
+        free="cpu",
+    ),
+    workflow=dict(
+        run="cpu",  # Replaced by the class of the steps
+        steps="cpu",
+    ),
+    daemon=dict(
+        start="io",
+        stop="io",
+        status="io",
+    ),
 )
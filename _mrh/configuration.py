@@ -1,5 +1,5 @@
 import json
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 
 from .logger import get_logger
@@ -12,18 +12,97 @@ _log = get_logger(__name__)
 @dataclass
 class Configuration:
     filter: list[str] = field(default_factory=lambda: ["*"])  # all directories
+    # Only repositories that match all these predicates
+    dirty: bool = False  # with uncommitted changes
+    ahead: bool = False  # with commits to push
+    on_branch: str | None = None  # on a branch matching this pattern, e.g. "feat/*"
+    changed_since: str | None = None  # a date, a time ago (e.g. "2d") or a ref
     verbose: bool = False
     no_notify: bool = False
     pool_size: int = 10
+    engine: str = "process"  # one of `engines.ENGINES`
+    # Workers of the remote engine, e.g. [{"host": "build1", "root": "/srv/ws"}]
+    workers: list[dict] = field(default_factory=list)
+    stream: bool = False
+    # "text", "compact" (identical outputs shown once) or "jsonl" (one json
+    # record per repository)
+    format: str = "text"
+    max_depth: int = 1  # how deep to look for repositories
+    index: bool = True  # cache the discovered repositories
+    smart: bool = False  # skip git pull/push in repositories with nothing to do
+    force: bool = False  # never skip repositories, e.g. up-to-date pipenv locks
+    concurrency: str = "fixed"  # "fixed" (pool_size) or "adaptive"
+    # Override `scheduler.CLASS_LIMITS`, e.g. {"network": 32}
+    concurrency_limits: dict[str, int] = field(default_factory=dict)
+    history: bool = True  # record durations to run the slowest repositories first
+    journal: bool = True  # record each run for --resume and --retry-failed
+    cache: bool = False  # reuse the results of `cmd free` in unchanged repositories
+    cache_dir: str | None = None  # defaults to $XDG_CACHE_HOME/mrh or ~/.cache/mrh
+    cache_max_size: int = 100 * 1024 * 1024  # bytes
+    cache_max_age: float = 30  # days
+    timeout: float | None = None  # seconds before a command is killed
+    # Timeout of specific actions, e.g. {"git fetch": 60, "make test": 600}
+    timeouts: dict[str, float] = field(default_factory=dict)
+    retries: int = 2  # retries of git fetch/pull/push after a transient failure
+    retry_backoff: float = 1.0  # seconds before the first retry, then doubled
+    max_output: int | None = None  # bytes of stdout/stderr kept in memory per repo
+    log_dir: str | None = None  # write the full output of each repository here
+    log_level: str | None = None  # defaults to $LOGGER_LEVEL or INFO
+    log_levels: dict[str, str] = field(default_factory=dict)  # {"engines": "DEBUG"}
+    console_log_rate: int = 20  # log lines per second, warnings and errors always
+    ordered: bool = False  # run each repository after the ones it depends on
+    # Dependencies of the repositories, by name, e.g. {"api": ["core"]}
+    dependencies: dict[str, list[str]] = field(default_factory=dict)
+    pipfile_dependencies: bool = True  # also the Pipfile path and git packages
+    # Named lists of steps for `mrh workflow run`, e.g. {"sync": ["git pull"]}
+    workflows: dict[str, list[str]] = field(default_factory=dict)
 
     def to_dict(self) -> dict:
         return {
             "filter": self.filter,
+            "dirty": self.dirty,
+            "ahead": self.ahead,
+            "on_branch": self.on_branch,
+            "changed_since": self.changed_since,
             "verbose": self.verbose,
             "no_notify": self.no_notify,
             "pool_size": self.pool_size,
+            "engine": self.engine,
+            "workers": self.workers,
+            "stream": self.stream,
+            "format": self.format,
+            "max_depth": self.max_depth,
+            "index": self.index,
+            "smart": self.smart,
+            "force": self.force,
+            "concurrency": self.concurrency,
+            "concurrency_limits": self.concurrency_limits,
+            "history": self.history,
+            "journal": self.journal,
+            "cache": self.cache,
+            "cache_dir": self.cache_dir,
+            "cache_max_size": self.cache_max_size,
+            "cache_max_age": self.cache_max_age,
+            "timeout": self.timeout,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "retry_backoff": self.retry_backoff,
+            "max_output": self.max_output,
+            "log_dir": self.log_dir,
+            "log_level": self.log_level,
+            "log_levels": self.log_levels,
+            "console_log_rate": self.console_log_rate,
+            "ordered": self.ordered,
+            "dependencies": self.dependencies,
+            "pipfile_dependencies": self.pipfile_dependencies,
+            "workflows": self.workflows,
         }
 
+    def override(self, **kwargs) -> "Configuration":
+        """Returns a copy with the given options replaced. `None` values are
+        ignored so unset command line arguments keep the configured value"""
+        return replace(self, **{k: v for k, v in kwargs.items() if v is not None})
+
     def to_json(self) -> str:
         return json.dumps(self.to_dict(), indent=4)
 
@@ -38,13 +117,18 @@ class ConfigurationReader:
     """Reads a config file and returns a Configuration object."""
 
     __config: Configuration | None = None
+    __mtime: int | None = None
 
     def __init__(self, path: Path) -> None:
         self.path = path
 
     def read(self) -> Configuration:
-        if self.__config is not None:
-            # Already read the cfg file
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.__config is not None and mtime == self.__mtime:
+            # Already read the cfg file and it did not change since
             return self.__config
 
         if not self.path.is_file():
@@ -59,6 +143,7 @@ class ConfigurationReader:
                 config = Configuration(**json.load(f))
 
         self.__config = config
+        self.__mtime = mtime
         return config
 
 
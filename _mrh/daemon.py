@@ -0,0 +1,313 @@
+import fcntl
+import json
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from . import profiling
+from .client import connect, recv_frame, send_frame, socket_path, trusted_peer
+from .configuration import DEFAULT_CONFIGURATION_READER
+from .discovery import WATCHED, RepositoryIndex
+from .engines import start_warm_pool, stop_warm_pool
+from .logger import get_logger
+from .parser import get_parser
+from .runner import main as run_main
+from .terminal import fcode
+from .watch import IndexWatcher
+
+__all__ = ["control", "serve"]
+
+_log = get_logger(__name__)
+
+WATCH_INTERVAL = 0.5  # seconds between checks of the directories, without inotify
+START_TIMEOUT = 10  # seconds to wait for a new daemon to accept commands
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+
+
+def log_path(directory: Path) -> Path:
+    path = socket_path(str(directory))
+    if path is None:
+        raise RuntimeError(f"No private folder for the sockets of {directory}")
+    return Path(path).with_suffix(".log")
+
+
+def request(directory: Path, message: dict) -> dict | None:
+    """Send a control message to the daemon serving `directory`. Returns its
+    answer, None if there is no daemon"""
+    if (sock := connect(str(directory))) is None:
+        return None
+    with sock:
+        send_frame(sock, b"j", json.dumps({"control": message}).encode())
+        try:
+            return json.loads(recv_frame(sock)[1])
+        except ConnectionError:
+            return None
+
+
+def start(directory: Path) -> int:
+    if (status := request(directory, {"command": "status"})) is not None:
+        _log.info(f"The daemon of {directory} is already running (pid {status['pid']})")
+        return 0
+    if socket_path(str(directory)) is None:
+        _log.error(
+            "The daemon needs a folder only you can use, check $XDG_RUNTIME_DIR/mrh "
+            f"or /tmp/mrh-{os.getuid()}"
+        )
+        return 1
+
+    with open(log_path(directory), "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-c", "from _mrh.daemon import serve; serve()"],
+            cwd=directory,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,  # Not killed with the terminal
+            env={**os.environ, "PYTHONPATH": str(PACKAGE_ROOT)},
+        )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline and process.poll() is None:
+        if request(directory, {"command": "status"}) is not None:
+            _log.info(
+                f"Started the daemon of {directory} (pid {process.pid}). "
+                f"Logs in {log_path(directory)}"
+            )
+            return 0
+        time.sleep(0.05)
+    _log.error(f"The daemon did not start, see {log_path(directory)}")
+    return 1
+
+
+def stop(directory: Path) -> int:
+    if request(directory, {"command": "stop"}) is None:
+        _log.info(f"No daemon is running for {directory}")
+        return 0
+    _log.info(f"Stopped the daemon of {directory}")
+    return 0
+
+
+def status(directory: Path) -> int:
+    if (info := request(directory, {"command": "status"})) is None:
+        _log.info(f"No daemon is running for {directory}")
+        return 1
+    for key, value in info.items():
+        print(f"{key:<14} {value}")
+    return 0
+
+
+def control(subcommand: str, directory: Path) -> int:
+    """mrh daemon start/stop/status"""
+    return {"start": start, "stop": stop, "status": status}[subcommand](directory)
+
+
+def bytes_pending(fd: int) -> int:
+    return struct.unpack("i", fcntl.ioctl(fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+
+class Daemon:
+    """Runs the commands of the `mrh` clients of a folder, one at a time, with
+    the parser, config, repository index and worker pool already loaded.
+
+    The stdout and stderr of the daemon are pipes, so whatever the daemon and
+    its workers write while a command runs is sent to the client of that
+    command. Closing the client (e.g. Ctrl-C) interrupts the command"""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.started = time.time()
+        self.served = 0
+        self.client: socket.socket | None = None
+        self.active = False  # a command is running
+        self.lock = threading.Lock()  # held while output is sent to the client
+        self.outputs: dict[int, bytes] = {}  # read end of the pipes -> channel
+        self.log = sys.stdout
+        self.watcher: IndexWatcher | None = None
+
+    def redirect_outputs(self):
+        self.log = os.fdopen(os.dup(1), "w", buffering=1)
+        for fd, channel in ((1, b"1"), (2, b"2")):
+            read_fd, write_fd = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            self.outputs[read_fd] = channel
+        sys.stdout.reconfigure(line_buffering=True)
+
+    def pump(self):
+        while True:
+            ready, _, _ = select.select(list(self.outputs), [], [])
+            with self.lock:
+                for fd in ready:
+                    data = os.read(fd, 65536)
+                    if self.client is None:
+                        self.log.write(data.decode(errors="replace"))
+                        continue
+                    try:
+                        send_frame(self.client, self.outputs[fd], data)
+                    except OSError:
+                        pass  # The client is gone, the command is interrupted
+
+    def drain(self):
+        """Wait until everything written by the command was sent"""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        while True:
+            with self.lock:
+                if not any(bytes_pending(fd) for fd in self.outputs):
+                    return
+            time.sleep(0.001)
+
+    def rescanned(self, index: RepositoryIndex):
+        print(f"Rescanned {index.directory}", file=self.log)
+
+    def poll(self):
+        """Rescan the watched workspaces when one of their folders changes,
+        where inotify is not available"""
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            for index in list(WATCHED.values()):
+                if index.refresh():
+                    self.rescanned(index)
+
+    def warm_up(self):
+        cfg = DEFAULT_CONFIGURATION_READER.read()
+        key = (self.directory, cfg.max_depth)
+        if key not in WATCHED:
+            WATCHED[key] = RepositoryIndex(self.directory, cfg.max_depth, cfg.index)
+            if self.watcher is not None:
+                self.watcher.add(WATCHED[key])
+        WATCHED[key].refresh()
+        start_warm_pool(cfg.pool_size)  # Again if a command was interrupted
+        get_parser()
+
+    def interrupt(self, *_):
+        if self.active:
+            raise KeyboardInterrupt
+
+    def wait_disconnect(self, conn: socket.socket):
+        try:
+            conn.recv(1)
+        except OSError:
+            pass
+        if self.active:
+            os.kill(os.getpid(), signal.SIGINT)
+
+    def run(self, argv: list[str]) -> int:
+        sys.argv = ["mrh", *argv]
+        profiling.PHASES.clear()
+        profiling.SPANS.clear()
+        # The watcher may not have read the events yet, e.g. `git clone ... &&
+        # mrh git status`
+        for index in list(WATCHED.values()):
+            index.refresh()
+        try:
+            run_main()
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except KeyboardInterrupt:
+            return 130
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+    def handle(self, conn: socket.socket) -> bool:
+        """Answer a client. Returns False when the daemon has to stop"""
+        message = json.loads(recv_frame(conn)[1])
+        if "control" in message:
+            command = message["control"]["command"]
+            info = {
+                "pid": os.getpid(),
+                "directory": str(self.directory),
+                "uptime": f"{time.time() - self.started:.0f}s",
+                "commands": self.served,
+                "repositories": sum(len(i.repositories) for i in WATCHED.values()),
+                "log": str(log_path(self.directory)),
+            }
+            send_frame(conn, b"j", json.dumps(info).encode())
+            return command != "stop"
+
+        if message["cwd"] != str(self.directory):
+            msg = f"The mrh daemon only serves {self.directory}\n"
+            send_frame(conn, b"2", msg.encode())
+            send_frame(conn, b"x", b"1")
+            return True
+
+        print(f"Running {fcode(' '.join(message['argv']))}", file=self.log)
+        threading.Thread(target=self.wait_disconnect, args=(conn,), daemon=True).start()
+        with self.lock:
+            self.client = conn
+        self.active = True
+        try:
+            returncode = self.run(message["argv"])
+        finally:
+            self.active = False
+            self.drain()
+            with self.lock:
+                self.client = None
+        self.served += 1
+        try:
+            send_frame(conn, b"x", str(returncode).encode())
+        except OSError:
+            pass
+        self.warm_up()
+        return True
+
+    def serve(self):
+        self.redirect_outputs()
+        signal.signal(signal.SIGINT, self.interrupt)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        # The workers are started by a server process without threads, this
+        # process has threads and forking it could copy a lock that is held
+        multiprocessing.set_start_method("forkserver", force=True)
+        multiprocessing.set_forkserver_preload(["_mrh.engines"])
+        try:
+            self.watcher = IndexWatcher(self.rescanned)
+        except OSError as e:
+            print(f"{e}, checking the folders every {WATCH_INTERVAL}s", file=self.log)
+        self.warm_up()
+        threading.Thread(target=self.pump, daemon=True).start()
+        if self.watcher is not None:
+            threading.Thread(target=self.watcher.run, daemon=True).start()
+        else:
+            threading.Thread(target=self.poll, daemon=True).start()
+
+        path = str(log_path(self.directory).with_suffix(".sock"))
+        if os.path.exists(path):
+            os.unlink(path)  # Left by a daemon that was killed
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        print(f"Serving {self.directory} on {path} (pid {os.getpid()})", file=self.log)
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    if not trusted_peer(conn):
+                        print("Refused a client of another user", file=self.log)
+                        continue
+                    if not self.handle(conn):
+                        break
+        finally:
+            server.close()
+            os.unlink(path)
+            stop_warm_pool()
+            print("Stopped", file=self.log)
+
+
+def serve():
+    """Entry point of the daemon process, started by `mrh daemon start`"""
+    Daemon(Path.cwd().resolve()).serve()
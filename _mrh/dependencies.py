@@ -0,0 +1,120 @@
+import tomllib
+from pathlib import Path
+
+from .fingerprints import PIPFILE_SECTIONS
+from .logger import get_logger
+from .terminal import fname
+
+__all__ = ["dependency_graph", "frontiers"]
+
+_log = get_logger(__name__)
+
+
+def repository_names(repositories: list[Path]) -> dict[str, Path]:
+    """Repositories by name and by path relative to the current directory.
+    The relative path wins when two repositories have the same name"""
+    names = {repo.name: repo for repo in repositories}
+    for repo in repositories:
+        try:
+            names[repo.relative_to(Path.cwd()).as_posix()] = repo
+        except ValueError:
+            pass
+    return names
+
+
+def git_url_name(url: str) -> str:
+    """Name of the repository of a git url, e.g. "core" for
+    "git+ssh://git@host/group/core.git@v1.0" """
+    url = url.split("#", 1)[0].rstrip("/")
+    name = url.rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+    return name.split("@", 1)[0].removesuffix(".git")
+
+
+def pipfile_dependencies(repo: Path, names: dict[str, Path]) -> set[Path]:
+    """Repositories that the Pipfile of `repo` installs from a path, e.g.
+    `core = {path = "../core"}`, or from git, e.g. `core = {git = "..."}`"""
+    try:
+        with open(repo / "Pipfile", "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError):
+        return set()
+    by_path = {path.resolve(): path for path in names.values()}
+    dependencies = set()
+    for section in ("packages", "dev-packages", *(set(data) - PIPFILE_SECTIONS)):
+        packages = data.get(section)
+        if not isinstance(packages, dict):
+            continue
+        for package in packages.values():
+            if not isinstance(package, dict):
+                continue
+            if "path" in package:
+                dependency = by_path.get((repo / package["path"]).resolve())
+            elif "git" in package:
+                dependency = names.get(git_url_name(package["git"]))
+            else:
+                continue
+            if dependency is not None:
+                dependencies.add(dependency)
+    return dependencies
+
+
+def dependency_graph(
+    repositories: list[Path], declared: dict[str, list[str]], pipfiles: bool = True
+) -> dict[Path, set[Path]]:
+    """Dependencies of each repository among `repositories`: the `declared`
+    ones, by name (e.g. {"api": ["core"]}), and with `pipfiles` the ones found
+    in the Pipfiles. Dependencies that are not selected are ignored"""
+    names = repository_names(repositories)
+    graph: dict[Path, set[Path]] = {repo: set() for repo in repositories}
+    for name, dependencies in declared.items():
+        if (repo := names.get(name)) is None:
+            _log.debug(f"{name!r} has dependencies but is not selected")
+            continue
+        for dependency in dependencies:
+            if dependency in names:
+                graph[repo].add(names[dependency])
+            else:
+                _log.debug(f"{fname(name)} depends on {dependency!r}, not selected")
+    if pipfiles:
+        for repo in repositories:
+            graph[repo] |= pipfile_dependencies(repo, names)
+    for repo, dependencies in graph.items():
+        dependencies.discard(repo)
+        if dependencies:
+            _log.debug(
+                f"{fname(repo.name)} depends on "
+                f"{', '.join(fname(d.name) for d in sorted(dependencies))}"
+            )
+    return graph
+
+
+def find_cycle(graph: dict[Path, set[Path]], repositories: set[Path]) -> list[Path]:
+    """A dependency cycle among `repositories`, which all have a dependency
+    among themselves"""
+    path: list[Path] = []
+    repo = min(repositories)
+    while repo not in path:
+        path.append(repo)
+        repo = min(graph[repo] & repositories)
+    start = path.index(repo)
+    return path[start:] + [repo]
+
+
+def frontiers(
+    graph: dict[Path, set[Path]], repositories: list[Path]
+) -> list[list[Path]]:
+    """Groups of repositories to run one after the other, each one only
+    depends on the previous ones. Within a group, the order of `repositories`
+    is kept. Raises ValueError on a dependency cycle"""
+    left = set(repositories)
+    groups = []
+    while left:
+        group = [
+            repo for repo in repositories if repo in left and not graph[repo] & left
+        ]
+        if not group:
+            cycle = " -> ".join(repo.name for repo in find_cycle(graph, left))
+            raise ValueError(f"Dependency cycle: {cycle}")
+        groups.append(group)
+        left -= set(group)
+    return groups
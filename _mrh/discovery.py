@@ -0,0 +1,180 @@
+import json
+import os
+import re
+from fnmatch import translate
+from pathlib import Path
+
+from .logger import get_logger
+
+__all__ = ["RepositoryIndex", "INDEX_FILE_NAME", "WATCHED", "get_index"]
+
+_log = get_logger(__name__)
+
+INDEX_FILE_NAME = ".mrh.index.json"
+INDEX_VERSION = 2
+
+
+def is_repository(path: Path) -> bool:
+    """A directory is a repository if it has a `.git` directory or, for
+    worktrees and submodules, a `.git` file"""
+    return os.path.lexists(path / ".git")
+
+
+def directory_state(path: Path, listed: bool) -> list:
+    """What can add or remove a repository in a scanned directory: whether it
+    is a repository and, when its entries are scanned, its sub-directories
+    (hidden ones too, like the glob of the filters). Starts with the
+    modification time of the directory, a cheap way to tell nothing changed"""
+    mtime = path.stat().st_mtime_ns
+    children = None
+    if listed:
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            _log.debug(f"Cannot scan {str(path)!r}: {e}")
+            entries = []
+        children = sorted(e.name for e in entries if e.name != ".git" and e.is_dir())
+    return [mtime, is_repository(path), children]
+
+
+def scan(directory: Path, max_depth: int) -> tuple[list[str], dict[str, list]]:
+    """Walk `directory` with `os.scandir` up to `max_depth` levels deep.
+
+    Returns the relative paths of the repositories found and the state of
+    every scanned directory (used to invalidate the index)"""
+    repos: list[str] = []
+    states: dict[str, list] = {}
+
+    def _scan(rel: str, depth: int):
+        try:
+            # Keep going to find nested groups and submodules
+            states[rel] = directory_state(directory / rel, depth < max_depth)
+        except OSError as e:
+            _log.debug(f"Cannot scan {str(directory / rel)!r}: {e}")
+            return
+        _, repository, children = states[rel]
+        if repository and depth > 0:
+            repos.append(rel)
+        for name in children or []:
+            _scan(name if depth == 0 else f"{rel}/{name}", depth + 1)
+
+    _scan(".", 0)
+    return sorted(repos), states
+
+
+def changed(directory: Path, states: dict[str, list]) -> bool:
+    """Whether a scanned directory changed since the scan in a way that can
+    add or remove a repository. Files written in a directory, e.g. the
+    history of mrh in the workspace, only change its modification time,
+    which is updated in `states`"""
+    for rel, (mtime, repository, children) in states.items():
+        path = directory / rel
+        try:
+            if path.stat().st_mtime_ns == mtime:
+                continue
+            state = directory_state(path, children is not None)
+        except OSError:
+            return True
+        if state[1:] != [repository, children]:
+            return True
+        states[rel] = state
+    return False
+
+
+class RepositoryIndex:
+    """Cached list of the repositories in a workspace.
+
+    The index is stored in `INDEX_FILE_NAME` at the root of the workspace (next
+    to `.mrh.json`) and is rebuilt when a directory or a `.git` is added to or
+    removed from one of the scanned directories"""
+
+    def __init__(self, directory: Path, max_depth: int = 1, use_cache: bool = True):
+        self.directory = directory.resolve()
+        self.max_depth = max_depth
+        self.use_cache = use_cache
+        self.path = self.directory / INDEX_FILE_NAME
+        self._repos: list[str] | None = None
+        self._states: dict[str, list] = {}
+
+    def _load(self) -> list[str] | None:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        if (
+            data.get("version") != INDEX_VERSION
+            or data.get("max_depth") != self.max_depth
+        ):
+            return None
+        states = data["dirs"]
+        mtimes = [state[0] for state in states.values()]
+        if changed(self.directory, states):
+            return None
+        if mtimes != [state[0] for state in states.values()]:
+            self._save(data["repos"], states)  # Skip the listings next time
+        self._states = states
+        return data["repos"]
+
+    def _save(self, repos: list[str], states: dict[str, list]):
+        data = dict(
+            version=INDEX_VERSION, max_depth=self.max_depth, repos=repos, dirs=states
+        )
+        try:
+            self.path.write_text(json.dumps(data))
+        except OSError as e:
+            _log.debug(f"Cannot write index {str(self.path)!r}: {e}")
+
+    @property
+    def repositories(self) -> list[str]:
+        """Relative paths of all the repositories in the workspace"""
+        if self._repos is not None:
+            return self._repos
+
+        repos = self._load() if self.use_cache else None
+        if repos is None:
+            return self.rescan()
+        self._repos = repos
+        return repos
+
+    @property
+    def directories(self) -> list[Path]:
+        """Directories scanned for repositories, a change in them can add or
+        remove a repository"""
+        self.repositories
+        return [self.directory / rel for rel in self._states]
+
+    def rescan(self) -> list[str]:
+        _log.debug(f"Scanning {str(self.directory)!r} for repositories")
+        repos, self._states = scan(self.directory, self.max_depth)
+        if self.use_cache:
+            self._save(repos, self._states)
+        self._repos = repos
+        return repos
+
+    def refresh(self) -> bool:
+        """Scan again if a directory changed since the last scan. Returns
+        whether the repositories were scanned again"""
+        if self._repos is not None and not changed(self.directory, self._states):
+            return False
+        self.rescan()
+        return True
+
+    def filter(self, filter_strs: list[str]) -> list[Path]:
+        """Repositories whose relative path matches any of the glob filters"""
+        if not filter_strs:
+            return []
+        pattern = re.compile("|".join(translate(f.rstrip("/")) for f in filter_strs))
+        return [self.directory / rel for rel in self.repositories if pattern.match(rel)]
+
+
+# Indexes kept in memory and refreshed by a long running process, see `daemon`
+WATCHED: dict[tuple[Path, int], RepositoryIndex] = {}
+
+
+def get_index(
+    directory: Path, max_depth: int = 1, use_cache: bool = True
+) -> RepositoryIndex:
+    if (index := WATCHED.get((directory.resolve(), max_depth))) is not None:
+        return index
+    return RepositoryIndex(directory, max_depth, use_cache)
@@ -0,0 +1,195 @@
+import queue
+import signal
+import sys
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+from .actions import Action, Result
+from .logger import (
+    discard_log_queue,
+    get_levels,
+    get_logger,
+    log_queue,
+    log_to_queue,
+    set_levels,
+)
+from .profiling import phase
+from .scheduler import POLL_INTERVAL, Scheduler
+
+__all__ = ["ENGINES", "get_engine", "start_warm_pool", "stop_warm_pool"]
+
+_log = get_logger(__name__)
+
+OnResult = Callable[[Path, Result], None]
+Engine = Callable[..., list[Result]]
+
+
+def _init_worker(queue=None, levels: tuple[str, dict[str, str]] | None = None):
+    # Ctrl-C is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if queue is not None:
+        # Written by the listener of the main process
+        log_to_queue(queue, levels)
+
+
+def _run_on(
+    action: Action, stream: bool, levels: tuple[str, dict[str, str]], repo: Path
+) -> tuple[Path, Result]:
+    # The workers of a warm pool have the levels of the run that started it
+    if levels != get_levels():
+        set_levels(*levels)
+    # Turn the termination of the pool into an exception while a command runs,
+    # so the command is killed as well. Idle workers keep the default action:
+    # a python handler may never run if the signal arrives right before the
+    # worker blocks waiting for its next task
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+    try:
+        return repo, action.run(repo, stream)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+# (pool, processes) kept alive between runs by the daemon
+_warm_pool: tuple = ()
+
+
+def start_warm_pool(processes: int):
+    """Keep a pool of workers to run the next actions without starting one"""
+    global _warm_pool
+    if not _warm_pool:
+        from multiprocessing import Pool
+
+        pool = Pool(
+            processes, initializer=_init_worker, initargs=(log_queue(), get_levels())
+        )
+        _warm_pool = (pool, processes)
+
+
+def stop_warm_pool():
+    global _warm_pool
+    if _warm_pool:
+        _warm_pool[0].terminate()
+        _warm_pool = ()
+
+
+def run_process_pool(
+    action: Action,
+    repositories: list[Path],
+    scheduler: Scheduler,
+    on_result: OnResult | None = None,
+    stream: bool = False,
+) -> list[Result]:
+    """Run the action in a pool of python processes, one shell per repository.
+    `on_result` is called in completion order, results are returned in the
+    same order as `repositories`"""
+    from multiprocessing import Pool
+
+    results: dict[Path, Result] = {}
+    submitted: dict[Path, float] = {}
+    done: queue.SimpleQueue = queue.SimpleQueue()
+    pending = list(reversed(repositories))
+    processes = min(scheduler.max_running, max(len(repositories), 1))
+    warm = bool(_warm_pool) and _warm_pool[1] >= processes
+    with phase("pool start"):
+        if warm:
+            p = _warm_pool[0]
+        else:
+            p = Pool(
+                processes,
+                initializer=_init_worker,
+                initargs=(log_queue(), get_levels()),
+            )
+    try:
+        while pending or scheduler.running:
+            while pending and scheduler.can_start():
+                scheduler.start()
+                repo = pending.pop()
+                submitted[repo] = time.time()
+                p.apply_async(
+                    _run_on,
+                    (action, stream, get_levels(), repo),
+                    callback=done.put,
+                    error_callback=done.put,
+                )
+            try:
+                item = done.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue  # Check the load again
+            scheduler.finish()
+            if isinstance(item, BaseException):
+                raise item
+            repo, result = item
+            result.submitted = submitted[repo]
+            results[repo] = result
+            if on_result is not None:
+                on_result(repo, result)
+    except BaseException:
+        if warm:
+            stop_warm_pool()  # kill the running commands
+        discard_log_queue()
+        raise
+    finally:
+        if not warm:
+            p.terminate()
+    return [results[repo] for repo in repositories]
+
+
+def run_async(
+    action: Action,
+    repositories: list[Path],
+    scheduler: Scheduler,
+    on_result: OnResult | None = None,
+    stream: bool = False,
+) -> list[Result]:
+    """Run the action with asyncio subprocesses from a single python process.
+    The scheduler decides how many commands run at the same time"""
+    import asyncio
+
+    async def _run_all() -> list[Result]:
+        async def _run_one(repo: Path) -> Result:
+            submitted = time.time()
+            await scheduler.acquire()
+            try:
+                result = await action.arun(repo, stream)
+            finally:
+                scheduler.finish()
+            result.submitted = submitted
+            if on_result is not None:
+                on_result(repo, result)
+            return result
+
+        return await asyncio.gather(*map(_run_one, repositories))
+
+    return asyncio.run(_run_all())
+
+
+def run_remote(
+    action: Action,
+    repositories: list[Path],
+    scheduler: Scheduler,
+    on_result: OnResult | None = None,
+    stream: bool = False,
+    workers: list[dict] | None = None,
+) -> list[Result]:
+    """Run the action on worker processes, on this host or on others. See
+    `remote`"""
+    from .remote import run_remote as _run_remote
+
+    return _run_remote(action, repositories, scheduler, on_result, stream, workers)
+
+
+ENGINES: dict[str, Engine] = {
+    "process": run_process_pool,
+    "async": run_async,
+    "remote": run_remote,
+}
+
+
+def get_engine(name: str, workers: list[dict] | None = None) -> Engine:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine {name!r}. Choose one of {list(ENGINES)}")
+    if name == "remote":
+        return partial(run_remote, workers=workers)
+    return ENGINES[name]
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .actions import Action, Result
+from .gitrefs import Refs
+from .logger import get_logger
+
+__all__ = [
+    "FINGERPRINTED",
+    "install_skip_reason",
+    "lock_skip_reason",
+    "record_fingerprints",
+    "sync_skip_reason",
+]
+
+_log = get_logger(__name__)
+
+# Actions that are skipped in up-to-date repositories unless forced
+FINGERPRINTED = {("pipenv", "lock"), ("pipenv", "sync"), ("pipenv", "install")}
+LOCKED = {("pipenv", "lock"), ("pipenv", "install")}  # write the lock
+SYNCED = {("pipenv", "sync"), ("pipenv", "install")}  # build the venv
+
+# Written in the git directory after a successful `pipenv lock/sync/install`
+MARKER_FILE_NAME = "mrh-pipenv.json"
+
+# Sections of a Pipfile that are not package categories (see `plette`)
+PIPFILE_SECTIONS = {"source", "packages", "dev-packages", "requires", "scripts"}
+PIPFILE_SECTIONS |= {"pipfile", "pipenv", "default", "develop"}
+DEFAULT_SOURCE = {"name": "pypi", "url": "https://pypi.org/simple", "verify_ssl": True}
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def canonical_names(packages: dict) -> dict:
+    return {re.sub(r"[-_.]+", "-", name).lower(): v for name, v in packages.items()}
+
+
+def pipfile_hashes(repo: Path) -> set[str]:
+    """Hashes of the Pipfile as computed by pipenv. Recent versions canonicalize
+    the package names first, older ones do not"""
+    try:
+        with open(repo / "Pipfile", "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError):
+        return set()
+    hashes = set()
+    for normalize in (dict, canonical_names):
+        content = {
+            "_meta": {
+                "sources": data.get("source", [DEFAULT_SOURCE]),
+                "requires": data.get("requires", {}),
+            },
+            "default": normalize(data.get("packages", {})),
+            "develop": normalize(data.get("dev-packages", {})),
+        }
+        for category, values in data.items():
+            if category not in PIPFILE_SECTIONS:
+                content[category] = normalize(values)
+        dumped = json.dumps(content, sort_keys=True, separators=(",", ":"))
+        hashes.add(sha256(dumped.encode()))
+    return hashes
+
+
+def file_hash(path: Path) -> str | None:
+    try:
+        return sha256(path.read_bytes())
+    except OSError:
+        return None
+
+
+def locked_pipfile_hash(repo: Path) -> str | None:
+    """Hash of the Pipfile the lock was created from"""
+    try:
+        lock = json.loads((repo / "Pipfile.lock").read_bytes())
+        return lock["_meta"]["hash"]["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def venv_fingerprint(venv: Path) -> str | None:
+    """Identifies the interpreter of a virtualenv, None if it does not exist"""
+    try:
+        cfg = (venv / "pyvenv.cfg").read_bytes()
+        python = Path(os.path.realpath(venv / "bin" / "python"))
+        st = python.stat()
+    except OSError:
+        return None
+    return sha256(cfg + f"{python}:{st.st_size}:{st.st_mtime_ns}".encode())
+
+
+def marker_path(repo: Path) -> Path:
+    return Refs(repo).git_dir / MARKER_FILE_NAME
+
+
+def read_marker(repo: Path) -> dict:
+    try:
+        return json.loads(marker_path(repo).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def lock_skip_reason(repo: Path) -> str | None:
+    """Why `pipenv lock` can be skipped, None if it has to run. The lock stores
+    the hash of the Pipfile it was created from. As the hash depends on the
+    version of pipenv, the Pipfile and lock of the last successful lock are
+    also remembered"""
+    if not (repo / "Pipfile").is_file():
+        return "no Pipfile"
+    if locked_pipfile_hash(repo) in pipfile_hashes(repo):
+        return "lock up to date"
+    marker = read_marker(repo)
+    lock = file_hash(repo / "Pipfile.lock")
+    if lock is None or marker.get("locked") != lock:
+        return None
+    return (
+        "lock up to date"
+        if marker.get("pipfile") == file_hash(repo / "Pipfile")
+        else None
+    )
+
+
+def sync_skip_reason(repo: Path) -> str | None:
+    """Why `pipenv sync` can be skipped, None if it has to run. The venv has to
+    be built from the current lock with the same interpreter"""
+    if not (repo / "Pipfile").is_file():
+        return "no Pipfile"
+    marker = read_marker(repo)
+    if not marker or marker.get("lock") != file_hash(repo / "Pipfile.lock"):
+        return None
+    fingerprint = venv_fingerprint(Path(marker.get("venv", "")))
+    if fingerprint is None or fingerprint != marker.get("interpreter"):
+        return None
+    return "venv up to date"
+
+
+def install_skip_reason(repo: Path) -> str | None:
+    """Why `pipenv install` can be skipped, None if it has to run. It would
+    lock an outdated Pipfile and then sync"""
+    if lock_skip_reason(repo) != "lock up to date":
+        return None
+    return sync_skip_reason(repo)
+
+
+def record(repo: Path, locked: bool, synced: bool):
+    """Remember the Pipfile and lock of a successful lock and, when the venv
+    was built, the lock and interpreter it was built with. A sync does not
+    check the lock, so it never marks the lock as up to date"""
+    marker = read_marker(repo)
+    if locked:
+        marker["pipfile"] = file_hash(repo / "Pipfile")
+        marker["locked"] = file_hash(repo / "Pipfile.lock")
+    if synced:
+        try:
+            proc = subprocess.run(["pipenv", "--venv"], cwd=repo, capture_output=True)
+        except OSError as e:
+            _log.debug(f"Cannot find the venv: {e}", extra={"repo": str(repo)})
+        else:
+            if proc.returncode == 0:
+                venv = Path(proc.stdout.decode().strip())
+                marker["lock"] = file_hash(repo / "Pipfile.lock")
+                marker["venv"] = str(venv)
+                marker["interpreter"] = venv_fingerprint(venv)
+    try:
+        marker_path(repo).write_text(json.dumps(marker))
+    except OSError as e:
+        _log.warning(
+            f"Could not write {marker_path(repo)}: {e}", extra={"repo": str(repo)}
+        )
+
+
+def record_fingerprints(action: Action, results: list[Result], pool_size: int):
+    """Record the fingerprints of the repositories where `pipenv
+    lock/sync/install` succeeded, so the next run can skip them"""
+    key = (action.command, action.subcommand)
+    if key not in FINGERPRINTED:
+        return
+    repos = [r.repo for r in results if r.returncode == 0]
+    with ThreadPoolExecutor(pool_size) as executor:
+        list(
+            executor.map(lambda repo: record(repo, key in LOCKED, key in SYNCED), repos)
+        )
@@ -0,0 +1,195 @@
+import re
+import struct
+import zlib
+from pathlib import Path
+
+__all__ = ["Refs"]
+
+SHA = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
+COMMIT_TYPE = 1  # Object type in the packs
+
+
+def read_text(path: Path) -> str | None:
+    try:
+        return path.read_text()
+    except OSError:
+        return None
+
+
+class Refs:
+    """Read the refs of a repository straight from its `.git` directory,
+    without running git"""
+
+    def __init__(self, repo: Path) -> None:
+        self.repo = repo
+        self.git_dir = self._git_dir(repo / ".git")
+        # Worktrees keep HEAD in their own git dir but share refs and config
+        commondir = read_text(self.git_dir / "commondir")
+        self.common_dir = (
+            (self.git_dir / commondir.strip()).resolve() if commondir else self.git_dir
+        )
+        self._packed: dict[str, str] | None = None
+
+    @staticmethod
+    def _git_dir(dot_git: Path) -> Path:
+        if dot_git.is_file():
+            # Worktrees and submodules have a `gitdir: <path>` file
+            text = dot_git.read_text().strip()
+            return (dot_git.parent / text.removeprefix("gitdir:").strip()).resolve()
+        return dot_git
+
+    @property
+    def packed_refs(self) -> dict[str, str]:
+        if self._packed is None:
+            self._packed = {}
+            for line in (read_text(self.common_dir / "packed-refs") or "").splitlines():
+                if line.startswith(("#", "^")) or " " not in line:
+                    continue
+                sha, ref = line.split(" ", 1)
+                self._packed[ref] = sha
+        return self._packed
+
+    def resolve(self, ref: str) -> str | None:
+        """Sha of a full ref name (e.g. refs/heads/main), None if not found"""
+        for base in (self.git_dir, self.common_dir):
+            text = read_text(base / ref)
+            if text is not None:
+                text = text.strip()
+                if text.startswith("ref:"):
+                    return self.resolve(text.removeprefix("ref:").strip())
+                return text
+        return self.packed_refs.get(ref)
+
+    def resolve_name(self, name: str) -> str | None:
+        """Sha of a short ref name (e.g. main, v1.0, origin/main) or of a full
+        sha, None if not found"""
+        if SHA.fullmatch(name):
+            return name
+        # Only names like HEAD or ORIG_HEAD are looked up in the git directory
+        prefixes = ("refs/", "refs/tags/", "refs/heads/", "refs/remotes/")
+        if name.isupper():
+            prefixes = ("", *prefixes)
+        for prefix in prefixes:
+            try:
+                sha = self.resolve(prefix + name)
+            except ValueError:  # Not a text file
+                continue
+            if sha is not None and SHA.fullmatch(sha):
+                return sha
+        return None
+
+    def head(self) -> tuple[str | None, str | None]:
+        """(branch, sha) of HEAD. branch is None when HEAD is detached"""
+        text = (read_text(self.git_dir / "HEAD") or "").strip()
+        if text.startswith("ref:"):
+            ref = text.removeprefix("ref:").strip()
+            return ref.removeprefix("refs/heads/"), self.resolve(ref)
+        return None, text or None
+
+    def branch_config(self, branch: str) -> dict[str, str]:
+        """Options of the `[branch "<branch>"]` section of the git config"""
+        section = f'[branch "{branch}"]'
+        options: dict[str, str] = {}
+        in_section = False
+        for line in (read_text(self.common_dir / "config") or "").splitlines():
+            line = line.strip()
+            if line.startswith("["):
+                in_section = line == section
+            elif in_section and "=" in line:
+                key, value = line.split("=", 1)
+                options[key.strip().lower()] = value.strip()
+        return options
+
+    def upstream(self, branch: str) -> tuple[str, str] | None:
+        """(remote, merge ref) that `branch` tracks, None if it has no upstream"""
+        options = self.branch_config(branch)
+        if "remote" not in options or "merge" not in options:
+            return None
+        return options["remote"], options["merge"]
+
+    def tracking_ref(self, branch: str) -> str | None:
+        """Local remote-tracking ref of the upstream of `branch`
+        (e.g. refs/remotes/origin/main)"""
+        if (upstream := self.upstream(branch)) is None:
+            return None
+        remote, merge = upstream
+        if remote == ".":
+            return merge  # Tracks a local branch
+        return f"refs/remotes/{remote}/{merge.removeprefix('refs/heads/')}"
+
+    def read_commit(self, sha: str) -> bytes | None:
+        """Start of a commit (e.g. its `tree` line), loose or in a pack. None
+        when it can not be read without git, e.g. a deltified commit"""
+        loose = self.common_dir / "objects" / sha[:2] / sha[2:]
+        try:
+            with open(loose, "rb") as f:
+                data = zlib.decompressobj().decompress(f.read(4096))
+        except (OSError, zlib.error):
+            pass
+        else:
+            header, _, body = data.partition(b"\0")
+            return body if header.startswith(b"commit ") else None
+        for idx in (self.common_dir / "objects" / "pack").glob("*.idx"):
+            if (offset := pack_offset(idx, bytes.fromhex(sha))) is None:
+                continue
+            try:
+                with open(idx.with_suffix(".pack"), "rb") as f:
+                    f.seek(offset)
+                    data = f.read(4096)
+            except OSError:
+                return None
+            if (data[0] >> 4) & 7 != COMMIT_TYPE:
+                return None
+            start = 1
+            while data[start - 1] & 0x80:  # Size, 7 bits per byte
+                start += 1
+            try:
+                return zlib.decompressobj().decompress(data[start:])
+            except zlib.error:
+                return None
+        return None
+
+    def commit_tree(self, sha: str) -> str | None:
+        """Sha of the tree of a commit, None if it can not be read"""
+        if len(sha) != 40 or (commit := self.read_commit(sha)) is None:
+            return None
+        if not commit.startswith(b"tree "):
+            return None
+        return commit[5:45].decode()
+
+
+def pack_offset(idx: Path, sha: bytes) -> int | None:
+    """Offset of an object in the pack of a version 2 pack index, None if the
+    pack does not have it. The index is mapped, not read: it can be large"""
+    import mmap
+
+    try:
+        with open(idx, "rb") as f, mmap.mmap(
+            f.fileno(), 0, prot=mmap.PROT_READ
+        ) as data:
+            return find_offset(data, sha)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def find_offset(data, sha: bytes) -> int | None:
+    if data[:8] != b"\377tOc\0\0\0\2":
+        return None
+    fanout = struct.unpack_from(">256L", data, 8)
+    count = fanout[255]
+    lo, hi = fanout[sha[0] - 1] if sha[0] else 0, fanout[sha[0]]
+    while lo < hi:  # Binary search in the sorted shas
+        mid = (lo + hi) // 2
+        start = 1032 + mid * 20
+        found = data[start : start + 20]  # noqa: E203
+        if found == sha:
+            break
+        lo, hi = (mid + 1, hi) if found < sha else (lo, mid)
+    else:
+        return None
+    offsets = 1032 + count * 24  # After the shas and their crc32
+    (offset,) = struct.unpack_from(">L", data, offsets + mid * 4)
+    if offset & 0x80000000:  # In the table of 8 byte offsets
+        large = offsets + count * 4 + (offset & 0x7FFFFFFF) * 8
+        (offset,) = struct.unpack_from(">Q", data, large)
+    return offset
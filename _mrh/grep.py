@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO
+
+from .logger import get_logger
+from .terminal import CHUNK_SIZE, cs, fname, fprefix, kill_process_group, relative_name
+
+__all__ = ["grep"]
+
+_log = get_logger(__name__)
+
+fline = cs(cs.GREEN)
+
+
+class Search:
+    """`git grep` in many repositories at once. The lines of each repository
+    are put in `matches` as soon as they are read, followed by None when it is
+    done. Once stopped, the running searches are killed and no new one starts"""
+
+    def __init__(self, args: list[str]) -> None:
+        self.args = args
+        self.matches: queue.SimpleQueue = queue.SimpleQueue()
+        self.stopped = False
+        self.failed = False  # A search failed, e.g. a bad pattern
+        self.lock = threading.Lock()  # Held to start or kill the processes
+        self.processes: dict[Path, subprocess.Popen] = {}
+
+    def run(self, repo: Path):
+        try:
+            with tempfile.TemporaryFile() as errors:
+                self.search(repo, errors)
+        finally:
+            self.matches.put((repo, None))
+
+    def search(self, repo: Path, errors: IO[bytes]):
+        with self.lock:
+            if self.stopped:
+                return
+            proc = subprocess.Popen(
+                ["git", *self.args],
+                cwd=repo,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+                start_new_session=True,  # Killed with everything it started
+            )
+            self.processes[repo] = proc
+        rest = b""
+        for chunk in iter(lambda: proc.stdout.read1(CHUNK_SIZE), b""):  # type: ignore
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()  # Not complete yet
+            self.matches.put((repo, lines))
+        returncode = proc.wait()
+        with self.lock:
+            del self.processes[repo]
+            if self.stopped:
+                return
+        if returncode > 1:  # 1: no match
+            errors.seek(0)
+            message = errors.read().decode(errors="replace").strip()
+            _log.error(f"{fname(repo.name)}: {message}", extra={"repo": str(repo)})
+            self.failed = True
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            for proc in self.processes.values():
+                kill_process_group(proc.pid)
+
+
+def format_lines(repo: Path, lines: list[bytes], format: str) -> str:
+    """`<repo>/<path>:<line>:<text>` lines, or json records. The lines of
+    `git grep -z -n` are `<path>\\0<line>\\0<text>`"""
+    name = relative_name(repo)
+    txt = ""
+    for line in lines:
+        path, number, text = line.decode(errors="replace").split("\0", 2)
+        if format == "jsonl":
+            record = dict(repo=str(repo), path=path, line=int(number), text=text)
+            txt += json.dumps(record) + "\n"
+        else:
+            txt += f"{fprefix(f'{name}/{path}')}:{fline(number)}:{text}\n"
+    return txt
+
+
+def grep(
+    repositories: list[Path],
+    pattern: str,
+    paths: list[str] | None = None,
+    pool_size: int = 10,
+    max_count: int | None = None,
+    ignore_case: bool = False,
+    word_regexp: bool = False,
+    fixed_strings: bool = False,
+    format: str = "text",
+) -> int:
+    """Search the tracked files of the repositories with `git grep` and print
+    the matching lines as soon as they are found, prefixed by the repository.
+    Stops every search after `max_count` lines in total. Returns 0 if a line
+    matched, 1 if none did and 2 if a search failed, like grep"""
+    args = ["grep", "-z", "-n", "-I", "--no-color"]
+    args += [flag for flag, on in (("-i", ignore_case), ("-w", word_regexp)) if on]
+    args += ["-F"] if fixed_strings else []
+    args += ["-e", pattern, "--", *(paths or [])]
+    search = Search(args)
+    count = 0
+    finished = 0
+    executor = ThreadPoolExecutor(pool_size)
+    try:
+        for repo in repositories:
+            executor.submit(search.run, repo)
+        while finished < len(repositories):
+            repo, lines = search.matches.get()
+            if lines is None:
+                finished += 1
+                continue
+            if max_count is not None:
+                lines = lines[: max_count - count]  # noqa: E203
+            sys.stdout.write(format_lines(repo, lines, format))
+            sys.stdout.flush()
+            count += len(lines)
+            if max_count is not None and count >= max_count:
+                _log.debug(f"{count} matching lines, stopping the search")
+                break
+    except BrokenPipeError:
+        # e.g. `mrh git grep ... | head`, nothing else can be written
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        search.stop()
+        executor.shutdown(cancel_futures=True)
+    if search.failed:
+        return 2
+    return 0 if count else 1
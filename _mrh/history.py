@@ -0,0 +1,91 @@
+import json
+import os
+from pathlib import Path
+from statistics import median
+
+from .logger import get_logger
+
+__all__ = ["History", "HISTORY_FILE_NAME"]
+
+_log = get_logger(__name__)
+
+HISTORY_FILE_NAME = ".mrh.history.json"
+# Weight of the last run in the expected duration (exponential moving average)
+ALPHA = 0.5
+# Actions kept in the file, the ones that did not run for the longest time are
+# dropped (e.g. each `cmd free` command is an action)
+MAX_ACTIONS = 100
+
+
+class History:
+    """Expected duration of an action in each repository, learned from the
+    previous runs and stored in `HISTORY_FILE_NAME` at the root of the
+    workspace"""
+
+    def __init__(self, directory: Path, key: str) -> None:
+        self.path = directory.resolve() / HISTORY_FILE_NAME
+        self.key = key
+        self.durations = self.read().get(key, {})
+        self.recorded: dict[str, float] = {}  # by this run, written by `save`
+
+    def read(self) -> dict[str, dict[str, float]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def expected(self, repo: Path) -> float | None:
+        """Expected duration in seconds, None if it never ran in the repository"""
+        return self.durations.get(str(repo))
+
+    def estimate(self, repo: Path) -> float:
+        """Expected duration, or the median of the other repositories when it
+        never ran in this one"""
+        if (expected := self.expected(repo)) is not None:
+            return expected
+        return median(self.durations.values()) if self.durations else 0.0
+
+    def longest_first(self, repositories: list[Path]) -> list[Path]:
+        """Repositories sorted so that the slowest ones start first. The ones
+        without history go first as they may be the slowest"""
+
+        def sort_key(repo: Path) -> float:
+            expected = self.expected(repo)
+            return float("inf") if expected is None else expected
+
+        return sorted(repositories, key=sort_key, reverse=True)
+
+    def eta(self, remaining: list[Path], concurrency: int) -> float | None:
+        """Rough estimate of the seconds needed to run `remaining`"""
+        if not self.durations:
+            return None
+        estimates = [self.estimate(repo) for repo in remaining]
+        # Can not go faster than the slowest repository
+        return max(sum(estimates) / max(concurrency, 1), max(estimates, default=0))
+
+    def record(self, repo: Path, duration: float):
+        previous = self.expected(repo)
+        if previous is not None:
+            duration = ALPHA * duration + (1 - ALPHA) * previous
+        self.durations[str(repo)] = self.recorded[str(repo)] = duration
+
+    def save(self):
+        """Add the recorded durations to the file. Under a lock and with a
+        rename, so that runs finishing at the same time keep each other's"""
+        import fcntl
+
+        lock_path = self.path.with_name(f"{self.path.name}.lock")
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(lock_path, "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                data = self.read()
+                durations = data.pop(self.key, {})
+                data[self.key] = {**durations, **self.recorded}  # The last run last
+                for key in list(data)[:-MAX_ACTIONS]:
+                    del data[key]
+                tmp.write_text(json.dumps(data, indent=2))
+                os.replace(tmp, self.path)
+        except OSError as e:
+            tmp.unlink(missing_ok=True)
+            _log.debug(f"Cannot write history {str(self.path)!r}: {e}")
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from .actions import Action, Result
+from .logger import get_logger
+
+__all__ = ["JOURNAL_FILE_NAME", "Journal", "pending_repositories"]
+
+_log = get_logger(__name__)
+
+JOURNAL_FILE_NAME = ".mrh.journal.jsonl"
+# Bytes, a larger journal is moved to `<name>.1` by the next run that is not a
+# resume, as it no longer needs the older runs
+MAX_SIZE = 10 * 1024 * 1024
+
+
+class Journal:
+    """Append-only record of the runs in a workspace, in `JOURNAL_FILE_NAME`:
+    the action and repositories of each run, then the exit code of each
+    repository as soon as it finishes. Each record is a json line written
+    with a single write"""
+
+    def __init__(self, directory: Path) -> None:
+        self.path = directory.resolve() / JOURNAL_FILE_NAME
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._fd: int | None = None
+
+    def write(self, record: dict):
+        if self._fd is None:
+            return
+        line = json.dumps({"run": self.run_id, "time": time.time(), **record})
+        try:
+            os.write(self._fd, (line + "\n").encode())
+        except OSError as e:
+            _log.debug(f"Cannot write journal {str(self.path)!r}: {e}")
+
+    def rotate(self):
+        try:
+            if self.path.stat().st_size > MAX_SIZE:
+                os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        except OSError:
+            pass
+
+    def start(self, action: Action, repositories: list[Path], resumed: bool = False):
+        if not resumed:
+            self.rotate()
+        try:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            self._fd = os.open(self.path, flags, 0o644)
+        except OSError as e:
+            _log.debug(f"Cannot write journal {str(self.path)!r}: {e}")
+            return
+        self.write(
+            {
+                "event": "start",
+                "action": action.key,
+                "cmd": action.cmd_str,
+                "resumed": resumed,
+                "repos": [str(repo) for repo in repositories],
+            }
+        )
+
+    def record(self, result: Result):
+        self.write(
+            {
+                "repo": str(result.repo),
+                "returncode": result.returncode,
+                "duration": round(result.duration, 3),
+            }
+        )
+
+    def finish(self, interrupted: bool = False):
+        self.write({"event": "end", "interrupted": interrupted})
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def read_journal(path: Path) -> list[dict]:
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue  # Cut short, e.g. the disk was full
+    return records
+
+
+def pending_repositories(
+    directory: Path, key: str, unfinished: bool = True, failed: bool = True
+) -> list[Path] | None:
+    """Repositories of the last full run of the action `key` that did not
+    finish and/or failed, also accounting for the runs that resumed it. None
+    if the action never ran in the workspace"""
+    repos: list[str] | None = None
+    runs: set[str] = set()  # the last full run and the ones resuming it
+    returncodes: dict[str, int] = {}  # last exit code of each repository
+    for record in read_journal(directory.resolve() / JOURNAL_FILE_NAME):
+        if record.get("event") == "start" and record.get("action") == key:
+            if not record["resumed"]:
+                repos, runs, returncodes = record["repos"], set(), {}
+            if repos is not None:
+                runs.add(record["run"])
+        elif "repo" in record and record["run"] in runs:
+            returncodes[record["repo"]] = record["returncode"]
+    if repos is None:
+        return None
+    return [
+        Path(repo)
+        for repo in repos
+        if (unfinished and repo not in returncodes)
+        or (failed and returncodes.get(repo, 0) != 0)
+    ]
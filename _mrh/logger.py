@@ -1,28 +1,392 @@
 import logging
 import os
+import re
+import time
+from pathlib import Path
 
 from .terminal import fblue, fgreen, fmagenta, fred, fyellow
 
-__all__ = ["get_logger"]
+__all__ = [
+    "discard_log_queue",
+    "flush_logging",
+    "get_levels",
+    "get_logger",
+    "log_queue",
+    "log_to_queue",
+    "start_logging",
+    "stop_logging",
+]
+
+LEVEL_FMT = dict(
+    DEBUG=fblue, INFO=fgreen, WARNING=fyellow, ERROR=fred, CRITICAL=fmagenta
+)
+ROOT = __name__.split(".")[0]  # Every mrh logger is a child of this one
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+class CustomFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        # A copy, the record is also written to the log files
+        record = logging.makeLogRecord(record.__dict__)
+        record.levelname = LEVEL_FMT[record.levelname](record.levelname)
+        return super().format(record)
+
+
+class PlainFormatter(logging.Formatter):
+    """One greppable line per record: time, level, repository and message"""
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)-8s %(repo)s%(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record = logging.makeLogRecord(record.__dict__)
+        repo = getattr(record, "repo", None)
+        record.repo = f"[{Path(repo).name}] " if repo else ""
+        return ANSI_ESCAPE.sub("", super().format(record))
+
+
+class Listener:
+    """Writes the records of a queue to its handlers from a thread, until it
+    gets None. Drops the records below the current level of their logger,
+    e.g. sent by a worker that still had the levels of an earlier run"""
+
+    def __init__(self, records, *handlers: logging.Handler) -> None:
+        self.records = records
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        import threading
+
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        import threading
+
+        while (record := self.records.get()) is not None:
+            if isinstance(record, threading.Event):
+                record.set()  # See `flush`
+            else:
+                self.handle(record)
+
+    def handle(self, record: logging.LogRecord):
+        if record.levelno >= logging.getLogger(record.name).getEffectiveLevel():
+            for handler in self.handlers:
+                handler.handle(record)
+
+    def flush(self):
+        """Wait until the records already in the queue are written"""
+        import threading
+
+        written = threading.Event()
+        self.records.put(written)
+        written.wait()
+
+    def stop(self):
+        """Write the records already in the queue and stop"""
+        self.records.put(None)
+        self._thread.join()  # type: ignore
+
+
+class RateLimitedHandler(logging.Handler):
+    """Passes at most `rate` records per second to `handler`, so that a few
+    hundred repositories do not flood a slow terminal. Warnings and errors
+    always pass, the other records over the limit are counted"""
+
+    def __init__(self, handler: logging.Handler, rate: int, hint: str = "") -> None:
+        super().__init__()
+        self.handler = handler
+        self.rate = rate
+        self.hint = hint  # where the records that were not shown are
+        self.window = 0.0
+        self.count = 0
+        self.suppressed = 0
+
+    def report_suppressed(self):
+        if self.suppressed:
+            msg = f"{self.suppressed} log messages not shown{self.hint}"
+            record = logging.makeLogRecord(
+                dict(name=ROOT, levelno=logging.INFO, levelname="INFO", msg=msg)
+            )
+            self.handler.handle(record)
+            self.suppressed = 0
+
+    def emit(self, record: logging.LogRecord):
+        now = time.monotonic()
+        if now - self.window >= 1:
+            self.report_suppressed()
+            self.window = now
+            self.count = 0
+        if record.levelno >= logging.WARNING or self.count < self.rate:
+            self.count += 1
+            self.handler.handle(record)
+        else:
+            self.suppressed += 1
+
+    def flush(self):
+        self.report_suppressed()
+        self.handler.flush()
+
+
+class RepositoryFileHandler(logging.Handler):
+    """Writes the records about a repository (with a `repo` attribute) to
+    `<directory>/<repo>.mrh.log`. The file is only open while writing, a run
+    can have more repositories than open files"""
+
+    def __init__(self, directory: Path) -> None:
+        super().__init__()
+        self.directory = directory
+        self.cwd = Path.cwd()
+        self.setFormatter(PlainFormatter())
+
+    def emit(self, record: logging.LogRecord):
+        if not (repo := getattr(record, "repo", None)):
+            return
+        try:
+            name = "__".join(Path(repo).relative_to(self.cwd).parts)
+        except ValueError:
+            name = Path(repo).name
+        try:
+            with open(self.directory / f"{name}.mrh.log", "a") as f:
+                f.write(self.format(record) + "\n")
+        except OSError:
+            self.handleError(record)
+
+
+_handler: logging.Handler | None = None
+
+
+def get_handler() -> logging.Handler:
+    """Single stream handler shared by all the mrh loggers"""
+    global _handler
+    if _handler is None:
+        fmt_str = "%(levelname)s: %(message)s"
+        # fmt_str = "%(asctime)s %(levelname)s: %(message)s"
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(CustomFormatter(fmt=fmt_str, datefmt="%H:%M:%S"))
+    return _handler
 
 
 def get_logger(name: str):
-    level_fmt = dict(
-        DEBUG=fblue, INFO=fgreen, WARNING=fyellow, ERROR=fred, CRITICAL=fmagenta
-    )
-
-    class CustomFormatter(logging.Formatter):
-        def format(self, record: logging.LogRecord) -> str:
-            record.levelname = level_fmt[record.levelname](record.levelname)
-            return super().format(record)
-
-    log_level = os.environ.get("LOGGER_LEVEL", "INFO").upper()
-    fmt_str = "%(levelname)s: %(message)s"
-    # fmt_str = "%(asctime)s %(levelname)s: %(message)s"
-    formatter = CustomFormatter(fmt=fmt_str, datefmt="%H:%M:%S")
-    _logger = logging.getLogger(name)
-    _logger.setLevel(log_level)
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    _logger.addHandler(stream_handler)
-    return _logger
+    root = logging.getLogger(ROOT)
+    if not root.handlers:
+        root.setLevel(os.environ.get("LOGGER_LEVEL", "INFO").upper())
+        root.addHandler(get_handler())
+    if name != ROOT and not name.startswith(f"{ROOT}."):
+        name = f"{ROOT}.{name}"  # e.g. __main__
+    return logging.getLogger(name)
+
+
+class PipeHandler(logging.Handler):
+    """Puts the records in a queue for the listener, e.g. from a worker to the
+    main process. The message is formatted first, so the record can be
+    pickled. The write is done right away, so nothing is left half-written
+    when an idle worker is terminated"""
+
+    def __init__(self, queue) -> None:
+        super().__init__()
+        self.queue = queue
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            msg = self.format(record)
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = record.message = msg
+            record.args = record.exc_info = record.exc_text = None
+            record.stack_info = None
+            self.queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+
+# The queues and threads are only created when they are used, `mrh --help`
+# and the daemon client don't need them
+_records = None  # queue.SimpleQueue, written by the listener. Never blocks
+_queue = None  # multiprocessing.SimpleQueue, from the workers to `_records`
+_listener: Listener | None = None
+_forwarder: "Forwarder | None" = None
+DRAIN_TIMEOUT = 0.5  # seconds to wait for the last records of the workers
+FORWARD_INTERVAL = 0.05  # seconds between checks of an empty queue
+
+
+def records():
+    """Queue of the records of the main process"""
+    global _records
+    if _records is None:
+        import queue
+
+        _records = queue.SimpleQueue()
+    return _records
+
+
+class Forwarder:
+    """Moves the records of the workers to the queue of the listener from a
+    thread. It is told to stop with an event rather than a sentinel in the
+    queue of the workers, which a killed worker can leave locked"""
+
+    def __init__(self, worker_queue, listener_queue) -> None:
+        import threading
+
+        self.worker_queue = worker_queue
+        self.listener_queue = listener_queue
+        self.stopped = threading.Event()
+        self.moved = 0
+        self.lock = threading.Lock()  # Keeps the records in order with `flush`
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def move(self) -> bool:
+        """Move the next record, False if there is none yet"""
+        with self.lock:
+            if self.worker_queue.empty():
+                return False
+            self.listener_queue.put(self.worker_queue.get())
+            self.moved += 1
+            return True
+
+    def run(self):
+        while True:
+            if self.move():
+                continue
+            if self.stopped.is_set():
+                return
+            self.stopped.wait(FORWARD_INTERVAL)
+
+    def flush(self):
+        """Move the records already in the queue right away"""
+        while self.move():
+            pass
+
+    def stop(self):
+        """Move the records already in the queue and stop. Gives up when no
+        record was moved for DRAIN_TIMEOUT, e.g. waiting for the end of a
+        record that a killed worker never finished"""
+        self.stopped.set()
+        moved = -1
+        while self._thread.is_alive() and self.moved != moved:
+            moved = self.moved
+            self._thread.join(DRAIN_TIMEOUT)
+
+
+def start_forwarding():
+    global _forwarder
+    if _queue is not None and _forwarder is None:
+        _forwarder = Forwarder(_queue, records())
+
+
+def stop_forwarding():
+    global _forwarder
+    if _forwarder is not None:
+        _forwarder.stop()
+        _forwarder = None
+
+
+def log_queue():
+    """Queue of the log records of the workers, passed to them when they
+    start. A thread moves its records to the listener"""
+    global _queue
+    if _queue is None:
+        from multiprocessing import SimpleQueue
+
+        _queue = SimpleQueue()
+        start_forwarding()
+    return _queue
+
+
+def discard_log_queue():
+    """Use a new queue for the next workers. A worker that was killed while
+    writing a record leaves the queue locked"""
+    global _queue
+    stop_forwarding()
+    _queue = None
+
+
+def flush_logging():
+    """Write the records logged so far, by this process and the workers, e.g.
+    before printing results that should come after them"""
+    if _forwarder is not None:
+        _forwarder.flush()
+    if _listener is not None:
+        _listener.flush()
+
+
+def log_to_queue(queue, levels: tuple[str, dict[str, str]] | None = None):
+    """Send the records of this worker to the listener of the main process,
+    with the `levels` of the main process (`get_levels`)"""
+    root = logging.getLogger(ROOT)
+    root.handlers = [PipeHandler(queue)]
+    if levels is not None:
+        set_levels(*levels)
+
+
+_levels: tuple[str, dict[str, str]] = ("INFO", {})  # Set by `set_levels`
+
+
+def get_levels() -> tuple[str, dict[str, str]]:
+    """Arguments of the last `set_levels`, for the workers to only send the
+    records that are written"""
+    return _levels
+
+
+def set_levels(level: str | None, levels: dict[str, str]):
+    """Level of all the loggers and of specific modules, e.g. {"engines":
+    "DEBUG"}. LOGGER_LEVEL is the default level"""
+    global _levels
+    level = (level or os.environ.get("LOGGER_LEVEL", "INFO")).upper()
+    _levels = (level, dict(levels))
+    root = logging.getLogger(ROOT)
+    root.setLevel(level)
+    for name, logger in logging.Logger.manager.loggerDict.items():
+        if name.startswith(f"{ROOT}.") and isinstance(logger, logging.Logger):
+            logger.setLevel(logging.NOTSET)
+    for name, module_level in levels.items():
+        logging.getLogger(f"{ROOT}.{name}").setLevel(module_level.upper())
+
+
+def start_logging(
+    level: str | None = None,
+    levels: dict[str, str] | None = None,
+    log_dir: Path | None = None,
+    console_rate: int | None = None,
+):
+    """Write the records of this process and of the workers from a single
+    listener thread: to the console, at most `console_rate` per second, and
+    with a `log_dir` to `mrh.log` and one `<repo>.mrh.log` per repository"""
+    global _listener
+    stop_logging()
+    get_logger(ROOT)
+    set_levels(level, levels or {})
+    handlers: list[logging.Handler] = []
+    console = get_handler()
+    hint = ""
+    if log_dir is not None:
+        log_dir.mkdir(parents=True, exist_ok=True)
+        run_log = logging.FileHandler(log_dir / "mrh.log")
+        run_log.setFormatter(PlainFormatter())
+        handlers += [run_log, RepositoryFileHandler(log_dir)]
+        hint = f", see {log_dir / 'mrh.log'}"
+    if console_rate:
+        console = RateLimitedHandler(console, console_rate, hint)
+    handlers.insert(0, console)
+    _listener = Listener(records(), *handlers)
+    _listener.start()
+    start_forwarding()  # The workers of a warm pool keep their queue
+    logging.getLogger(ROOT).handlers = [PipeHandler(records())]
+
+
+def stop_logging():
+    """Write the remaining records and log to the console again"""
+    global _listener
+    if _listener is None:
+        return
+    # The records of the workers are all in the queue of the listener once the
+    # forwarder is stopped, and all written once the listener is stopped
+    stop_forwarding()
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.flush()
+        if handler is not get_handler():
+            handler.close()
+    _listener = None
+    logging.getLogger(ROOT).handlers = [get_handler()]
@@ -1,9 +1,10 @@
 import argparse
+from functools import cache
 from pathlib import Path
 from typing import Iterable
 
 from .commands import COMMANDS
-from .configuration import DEFAULT_CONFIGURATION_READER, ConfigurationReader
+from .configuration import ConfigurationReader
 from .logger import get_logger
 
 __all__ = ["get_parser"]
@@ -14,13 +15,10 @@ _log = get_logger(__name__)
 class ExtendAndJoinStrAction(argparse.Action):
     """Action class for extending and joining string arguments"""
 
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.values = []
-
     def __call__(self, parser, namespace, values: list, option_string=None):
-        self.values.extend(values)
-        setattr(namespace, self.dest, " ".join(self.values))
+        # Kept in the namespace so the parser can be used more than once
+        previous = getattr(namespace, self.dest, None) or ""
+        setattr(namespace, self.dest, " ".join([previous, *values]).strip())
 
 
 class ConfigurationAction(argparse.Action):
@@ -29,16 +27,199 @@ class ConfigurationAction(argparse.Action):
         setattr(namespace, self.dest, ConfigurationReader(path).read())
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, not {number}")
+    return number
+
+
 def add_top_level_args(parser: argparse.ArgumentParser):
     parser.add_argument(
         "-c",
         "--cfg",
         type=str,
-        default=DEFAULT_CONFIGURATION_READER.read(),
+        default=None,  # read `DEFAULT_CONFIGURATION_READER` only when needed
         dest="config",
         action=ConfigurationAction,
         help="Config file to use",
     )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["process", "async", "remote"],
+        default=None,
+        dest="engine",
+        help="Execution engine (overrides the config file)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=None,
+        dest="stream",
+        help="Print live output and results as soon as each repository finishes",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["text", "compact", "jsonl"],
+        default=None,
+        dest="format",
+        help="text: coloured output. compact: identical outputs shown once. "
+        "jsonl: one json record per repository",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        dest="max_depth",
+        help="How many directory levels to search for repositories",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        type=str,
+        nargs="+",
+        default=None,
+        dest="filter",
+        help="Filters to gather repositories (overrides the config file)",
+        metavar="FILTER",
+    )
+    parser.add_argument(
+        "--dirty",
+        action="store_true",
+        default=None,
+        dest="dirty",
+        help="Only repositories with uncommitted changes",
+    )
+    parser.add_argument(
+        "--ahead",
+        action="store_true",
+        default=None,
+        dest="ahead",
+        help="Only repositories with commits to push to their upstream",
+    )
+    parser.add_argument(
+        "--on-branch",
+        type=str,
+        default=None,
+        dest="on_branch",
+        help="Only repositories on a branch matching this pattern, e.g. 'feat/*'",
+        metavar="BRANCH",
+    )
+    parser.add_argument(
+        "--changed-since",
+        type=str,
+        default=None,
+        dest="changed_since",
+        help="Only repositories changed since a date (2024-01-31), a time ago "
+        "(12h, 2d, 1w) or a ref (main, v1.0)",
+        metavar="DATE|REF",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=str,
+        choices=["fixed", "adaptive"],
+        default=None,
+        dest="concurrency",
+        help="fixed: pool_size at once. adaptive: depends on the command and load",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        dest="timeout",
+        help="Seconds before the command is killed in a repository",
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=None,
+        dest="retries",
+        help="Retries of git fetch/pull/push after a transient network failure",
+    )
+    parser.add_argument(
+        "--log-dir",
+        type=str,
+        default=None,
+        dest="log_dir",
+        help="Write the full output of each repository to a log file in this folder",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default=None,
+        dest="log_level",
+        help="Level of the mrh logs (overrides $LOGGER_LEVEL and the config file)",
+    )
+    parser.add_argument(
+        "--max-output",
+        type=positive_int,
+        default=None,
+        dest="max_output",
+        help="Bytes of stdout/stderr kept in memory (and shown) per repository",
+        metavar="BYTES",
+    )
+    parser.add_argument(
+        "--smart",
+        action="store_true",
+        default=None,
+        dest="smart",
+        help="Only pull/push repositories that are behind/ahead of their upstream",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        default=None,
+        dest="ordered",
+        help="Run each repository after the ones it depends on and skip the "
+        "dependents of the ones that fail",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=None,
+        dest="cache",
+        help="Reuse the result of a `cmd free` command that succeeded in a repository "
+        "with the same content",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=None,
+        dest="force",
+        help="Run pipenv lock/sync/install even in up-to-date repositories",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help="Only run in the repositories where the last run of the command did "
+        "not finish, e.g. it was interrupted",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        dest="retry_failed",
+        help="Only run in the repositories where the last run of the command failed",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        dest="startup_profile",
+        help="Print how long each startup phase takes",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        dest="trace",
+        help="Write a Chrome trace of the run and print the slowest repositories",
+        metavar="PATH",
+    )
 
 
 class subcommand:
@@ -101,10 +282,53 @@ def add_git_parser(sub_parser: argparse._SubParsersAction):
         # )
         # git_sub_parsers.add_parser("unstash", help="Apply last stash changes")
 
+        git_sub_parser.add_parser(
+            "status", help="Show branch, ahead/behind and dirty state of each repo"
+        )
+        git_grep_parser = git_sub_parser.add_parser(
+            "grep", help="Search the tracked files of every repo"
+        )
+        git_grep_parser.add_argument("pattern", help="Pattern to search for")
+        git_grep_parser.add_argument(
+            "paths",
+            nargs="*",
+            default=[],
+            help="Only search these paths, e.g. '*.py'",
+            metavar="PATHSPEC",
+        )
+        git_grep_parser.add_argument(
+            "-i",
+            "--ignore-case",
+            action="store_true",
+            dest="ignore_case",
+            help="Match whatever the case, e.g. 'foo' also matches 'Foo' and 'FOO'",
+        )
+        git_grep_parser.add_argument(
+            "-w",
+            "--word-regexp",
+            action="store_true",
+            dest="word_regexp",
+            help="Only match whole words",
+        )
+        git_grep_parser.add_argument(
+            "-F",
+            "--fixed-strings",
+            action="store_true",
+            dest="fixed_strings",
+            help="The pattern is a fixed string, not a regular expression",
+        )
+        git_grep_parser.add_argument(
+            "-m",
+            "--max-count",
+            type=positive_int,
+            default=None,
+            dest="max_count",
+            help="Stop every search after this many matching lines in total",
+            metavar="N",
+        )
         # TODO
         # git_sub_parsers.add_parser("branch", help="Show branches")
         # git_sub_parsers.add_parser("tag", help="Show tags")
-        # git_sub_parsers.add_parser("status", help="Show status")
         # Dangerous commands
         # git_sub_parsers.add_parser("clean", help="Clean repo")
         # git_sub_parsers.add_parser("reset", help="Reset repo")
@@ -137,8 +361,38 @@ def add_cmd_parser(sub_parser: argparse._SubParsersAction):
         # )
 
 
+def add_workflow_parser(sub_parser: argparse._SubParsersAction):
+    with subcommand(sub_parser, "workflow") as workflow_sub_parser:
+        workflow_run_parser = workflow_sub_parser.add_parser(
+            "run", help="Run a workflow from the config file"
+        )
+        workflow_run_parser.add_argument(
+            "workflow", help="Name of the workflow", metavar="NAME"
+        )
+        workflow_steps_parser = workflow_sub_parser.add_parser(
+            "steps", help="Run the steps one after the other in each repo"
+        )
+        workflow_steps_parser.add_argument(
+            "steps",
+            nargs="+",
+            help='Steps to run, e.g. "git fetch" "git pull"',
+            metavar='"STEP"',
+        )
+
+
+def add_daemon_parser(sub_parser: argparse._SubParsersAction):
+    with subcommand(sub_parser, "daemon") as daemon_sub_parser:
+        daemon_sub_parser.add_parser(
+            "start", help="Start a daemon that runs the commands of this folder"
+        )
+        daemon_sub_parser.add_parser("stop", help="Stop the daemon of this folder")
+        daemon_sub_parser.add_parser("status", help="Show the daemon of this folder")
+
+
+@cache  # the daemon parses every command with the same parser
 def get_parser():
     command_parser = argparse.ArgumentParser(
+        prog="mrh",  # not the name of the daemon process
         description=f"Actions for all git repos in {Path.cwd().resolve()}",
     )
     sub_parsers = command_parser.add_subparsers(dest="command", required=True)
@@ -146,6 +400,8 @@ def get_parser():
     add_git_parser(sub_parsers)
     add_pipenv_parser(sub_parsers)
     add_cmd_parser(sub_parsers)
+    add_workflow_parser(sub_parsers)
+    add_daemon_parser(sub_parsers)
 
     return command_parser
 
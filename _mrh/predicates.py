@@ -0,0 +1,131 @@
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatch
+from functools import partial
+from pathlib import Path
+
+from .gitrefs import Refs, read_text
+from .logger import get_logger
+from .status import ahead_behind, is_dirty, read_index
+
+__all__ = ["matching_repositories"]
+
+_log = get_logger(__name__)
+
+DURATION = re.compile(r"(\d+)\s*([smhdw])")
+SECONDS = dict(s=1, m=60, h=3600, d=86400, w=604800)
+
+
+def parse_since(value: str) -> float | None:
+    """Timestamp of a date (2024-01-31, 2024-01-31T12:00) or of a time ago
+    (30m, 12h, 2d, 1w). None if it is not a date, i.e. it is a ref"""
+    if match := DURATION.fullmatch(value.strip()):
+        return time.time() - int(match[1]) * SECONDS[match[2]]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def head_moved_at(refs: Refs) -> float | None:
+    """When HEAD last changed (commit, checkout, pull...), from its reflog"""
+    lines = (read_text(refs.git_dir / "logs" / "HEAD") or "").splitlines()
+    if not lines:
+        return None
+    # <old sha> <new sha> <name> <<email>> <timestamp> <tz>\t<message>
+    return float(lines[-1].split("\t", 1)[0].split()[-2])
+
+
+def files_changed_since(refs: Refs, timestamp: float) -> bool:
+    """Whether a tracked file was modified after `timestamp`"""
+    for path, _, _ in read_index(refs) or []:
+        try:
+            if path.lstat().st_mtime >= timestamp:
+                return True
+        except OSError:
+            return True  # Deleted
+    return False
+
+
+def rev_parse(refs: Refs, rev: str) -> str | None:
+    """Sha of revisions that are not a plain ref, e.g. HEAD~2 or main@{1}"""
+    proc = subprocess.run(
+        ["git", "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"],
+        cwd=refs.repo,
+        capture_output=True,
+    )
+    return proc.stdout.decode().strip() if proc.returncode == 0 else None
+
+
+def changed_since(refs: Refs, since: str) -> bool:
+    """Whether HEAD or the tracked files changed since a date or a ref"""
+    if (timestamp := parse_since(since)) is not None:
+        moved_at = head_moved_at(refs)
+        if moved_at is not None and moved_at >= timestamp:
+            return True
+        return files_changed_since(refs, timestamp)
+
+    if (sha := refs.resolve_name(since) or rev_parse(refs, since)) is None:
+        _log.debug(f"{since!r} not found", extra={"repo": str(refs.repo)})
+        return False
+    if sha == refs.head()[1] and not is_dirty(refs):
+        return False
+    proc = subprocess.run(["git", "diff", "--quiet", sha], cwd=refs.repo)
+    return proc.returncode != 0
+
+
+def matches(
+    repo: Path,
+    dirty: bool = False,
+    ahead: bool = False,
+    on_branch: str | None = None,
+    changed_since_: str | None = None,
+) -> bool:
+    """Whether the repository matches all the predicates. The cheapest ones,
+    that only read files in `.git`, are checked first"""
+    refs = Refs(repo)
+    branch, sha = refs.head()
+    if on_branch is not None and (branch is None or not fnmatch(branch, on_branch)):
+        return False
+    if ahead:
+        tracking_ref = refs.tracking_ref(branch) if branch is not None else None
+        tracking_sha = refs.resolve(tracking_ref) if tracking_ref else None
+        if sha is None or tracking_sha is None:
+            return False
+        counts = ahead_behind(refs, sha, tracking_sha)
+        if counts is None or counts[0] == 0:
+            return False  # Not known to have commits to push
+    if dirty and not is_dirty(refs):
+        return False
+    if changed_since_ is not None and not changed_since(refs, changed_since_):
+        return False
+    return True
+
+
+def matching_repositories(
+    repositories: list[Path],
+    pool_size: int,
+    dirty: bool = False,
+    ahead: bool = False,
+    on_branch: str | None = None,
+    changed_since: str | None = None,
+) -> list[Path]:
+    """Repositories that match all the given predicates"""
+    match = partial(
+        matches,
+        dirty=dirty,
+        ahead=ahead,
+        on_branch=on_branch,
+        changed_since_=changed_since,
+    )
+    with ThreadPoolExecutor(pool_size) as executor:
+        selected = [
+            repo
+            for repo, ok in zip(repositories, executor.map(match, repositories))
+            if ok
+        ]
+    _log.info(f"{len(selected)} of {len(repositories)} repositories match")
+    return selected
@@ -0,0 +1,98 @@
+import sys
+import time
+from contextlib import contextmanager
+
+__all__ = ["add_span", "phase", "print_report", "print_slowest", "write_trace"]
+
+# (name, start, end) of every recorded phase, in seconds since `STARTED`
+PHASES: list[tuple[str, float, float]] = []
+# (track, name, category, start, end, args) of the work done for each
+# repository, in seconds since `STARTED`
+SPANS: list[tuple[str, str, str, float, float, dict]] = []
+STARTED = time.perf_counter()
+STARTED_TIME = time.time()  # to place the time.time() timestamps of workers
+
+
+@contextmanager
+def phase(name: str):
+    """Record how long the code inside the context takes"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASES.append((name, start - STARTED, time.perf_counter() - STARTED))
+
+
+def add_span(track: str, name: str, category: str, start: float, end: float, **args):
+    """Record a span from time.time() timestamps, e.g. taken in a worker"""
+    SPANS.append(
+        (track, name, category, start - STARTED_TIME, end - STARTED_TIME, args)
+    )
+
+
+def print_report():
+    """Print the recorded phases to stderr"""
+    total = time.perf_counter() - STARTED
+    lines = [f"{'phase':<20} {'start (ms)':>12} {'duration (ms)':>14}"]
+    for name, start, end in PHASES:
+        lines.append(f"{name:<20} {start * 1000:>12.1f} {(end - start) * 1000:>14.1f}")
+    lines.append(f"{'total':<20} {0:>12.1f} {total * 1000:>14.1f}")
+    print("\n".join(lines), file=sys.stderr)
+
+
+def print_slowest(n: int = 10):
+    """Print the `n` slowest commands and how long they waited to start"""
+    waited = {
+        track: end - start for track, _, cat, start, end, _ in SPANS if cat == "queue"
+    }
+    commands = [span for span in SPANS if span[2] == "command"]
+    if not commands:
+        return
+    commands.sort(key=lambda span: span[3] - span[4])
+    width = max(len("repository"), *(len(span[0]) for span in commands[:n]))
+    lines = [f"Slowest {min(n, len(commands))} of {len(commands)} repositories:"]
+    lines.append(f"{'repository':<{width}} {'queued (ms)':>12} {'duration (ms)':>14}")
+    for track, _, _, start, end, _ in commands[:n]:
+        queued = waited.get(track, 0) * 1000
+        lines.append(f"{track:<{width}} {queued:>12.1f} {(end - start) * 1000:>14.1f}")
+    print("\n".join(lines), file=sys.stderr)
+
+
+def _event(name: str, category: str, tid: int, start: float, end: float, args=None):
+    return {
+        "name": name,
+        "cat": category,
+        "ph": "X",  # complete event
+        "pid": 1,
+        "tid": tid,
+        "ts": start * 1e6,  # microseconds
+        "dur": (end - start) * 1e6,
+        "args": args or {},
+    }
+
+
+def _track_name(tid: int, name: str) -> dict:
+    return {
+        "name": "thread_name",
+        "ph": "M",
+        "pid": 1,
+        "tid": tid,
+        "args": {"name": name},
+    }
+
+
+def write_trace(path: str):
+    """Write the phases and the spans of each repository in the Chrome trace
+    event format (open it in chrome://tracing or https://ui.perfetto.dev)"""
+    import json
+
+    events = [_track_name(0, "mrh")]
+    events += [_event(name, "phase", 0, start, end) for name, start, end in PHASES]
+    tracks: dict[str, int] = {}
+    for track, name, category, start, end, args in SPANS:
+        if track not in tracks:
+            tracks[track] = len(tracks) + 1
+            events.append(_track_name(tracks[track], track))
+        events.append(_event(name, category, tracks[track], start, end, args))
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
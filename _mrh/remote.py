@@ -0,0 +1,325 @@
+import base64
+import itertools
+import json
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import IO
+
+from .actions import Action, Result
+from .engines import OnResult, _init_worker, _run_on
+from .logger import get_levels, get_logger, log_queue, start_logging
+from .scheduler import Scheduler
+from .terminal import fname
+
+__all__ = ["run_remote", "serve"]
+
+_log = get_logger(__name__)
+
+# A worker is started with a command (e.g. over ssh) and speaks json lines on
+# its stdin and stdout. The client first sends {"root": ..., "slots": ...}, the
+# workspace of the worker and how many repositories it runs at once. Once the
+# worker answers {"ready": true}, the client sends {"id": ..., "repo": ...,
+# "action": ..., "stream": ...} for each repository and the worker answers
+# {"id": ..., "result": ...} (or "error") as soon as each one finishes. The
+# worker stops when its stdin is closed. Paths under the current directory are
+# sent under the root of the worker and mapped back
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+WORKER_MODULE = "_mrh.remote"
+LOST_RETURNCODE = 255  # Same as ssh when the connection is lost
+ERROR_RETURNCODE = 1  # The worker could not run the action on a repository
+START_TIMEOUT = 30  # seconds for a worker to be ready, e.g. ssh connecting
+CLOSE_TIMEOUT = 5  # seconds for a worker to stop after its stdin is closed
+
+
+def map_path(path: Path, src: Path, dst: Path) -> Path:
+    """`path` moved from under `src` to under `dst`. Other paths are kept"""
+    try:
+        return dst / path.relative_to(src)
+    except ValueError:
+        return path
+
+
+def map_action(data: dict, src: Path, dst: Path) -> dict:
+    """Action, as sent to a worker, with its log folders mapped"""
+    data = dict(data)
+    if data["log_dir"] is not None:
+        data["log_dir"] = str(map_path(Path(data["log_dir"]), src, dst))
+    if "steps" in data:
+        data["steps"] = [map_action(step, src, dst) for step in data["steps"]]
+    return data
+
+
+def encode_result(result: Result) -> dict:
+    return {
+        **result.to_dict(),
+        "args": result.args,
+        "stdout": base64.b64encode(result.stdout).decode(),
+        "stderr": base64.b64encode(result.stderr).decode(),
+    }
+
+
+def decode_result(data: dict, repo: Path, src: Path, dst: Path) -> Result:
+    process = subprocess.CompletedProcess(
+        data["args"],
+        data["returncode"],
+        base64.b64decode(data["stdout"]),
+        base64.b64decode(data["stderr"]),
+    )
+    result = Result(repo, process, data["started"], data["finished"])
+    result.stdout_size = data["stdout_size"]
+    result.stderr_size = data["stderr_size"]
+    for name in ("stdout_path", "stderr_path"):
+        if data[name] is not None:
+            setattr(result, name, map_path(Path(data[name]), src, dst))
+    return result
+
+
+def serve():
+    """Entry point of a worker, `python -m _mrh.remote`"""
+    from multiprocessing import Pool
+
+    messages = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)  # Anything else written to stdout, e.g. --stream output
+    lock = threading.Lock()
+
+    def send(message: dict):
+        with lock:
+            messages.write(json.dumps(message) + "\n")
+
+    def stop(*_):
+        sys.exit(1)
+
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+        signal.signal(signum, stop)
+
+    hello = json.loads(sys.stdin.readline() or "{}")
+    if not hello:
+        return
+    os.chdir(hello["root"])  # Log files are named relative to the workspace
+    start_logging()
+    pool = Pool(
+        hello["slots"], initializer=_init_worker, initargs=(log_queue(), get_levels())
+    )
+    send({"ready": True})
+    try:
+        for line in sys.stdin:
+            message = json.loads(line)
+            pool.apply_async(
+                _run_on,
+                (
+                    Action.from_dict(message["action"]),
+                    message["stream"],
+                    get_levels(),
+                    Path(message["repo"]),
+                ),
+                callback=lambda item, id=message["id"]: send(
+                    {"id": id, "result": encode_result(item[1])}
+                ),
+                error_callback=lambda e, id=message["id"]: send(
+                    {"id": id, "error": "".join(traceback.format_exception(e))}
+                ),
+            )
+    finally:
+        # Every result was sent, or the client is gone and the running
+        # commands are killed
+        pool.terminate()
+
+
+def worker_command(spec: dict) -> list[str]:
+    """`command` of the worker, or mrh over ssh on `host`, or a local one"""
+    if "command" in spec:
+        command = spec["command"]
+        return shlex.split(command) if isinstance(command, str) else command
+    if "host" in spec:
+        return ["ssh", spec["host"], "python3", "-m", WORKER_MODULE]
+    return [sys.executable, "-m", WORKER_MODULE]
+
+
+class Worker:
+    """Client side of a worker process. Its messages are put in `done` with
+    the worker, followed by None when the worker is gone"""
+
+    def __init__(
+        self, spec: dict, name: str, local_root: Path, slots: int, done
+    ) -> None:
+        self.name = spec.get("host", name)
+        self.local_root = local_root
+        self.root = Path(spec.get("root", local_root))
+        self.slots = spec.get("slots", slots)
+        self.running: dict[int, tuple[Path, float]] = {}  # id -> (repo, submitted)
+        self.ready = False  # Started, repositories can be sent to it
+        self.alive = True
+        # Stopped if it is not ready by then
+        self.deadline = time.monotonic() + spec.get("start_timeout", START_TIMEOUT)
+        pythonpath = os.pathsep.join(
+            filter(None, [str(PACKAGE_ROOT), os.environ.get("PYTHONPATH")])
+        )
+        self.process = subprocess.Popen(
+            worker_command(spec),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True,  # Stopped by closing its stdin
+            env={**os.environ, "PYTHONPATH": pythonpath},
+        )
+        threading.Thread(target=self.read, args=(done,), daemon=True).start()
+        self.send({"root": str(self.root), "slots": self.slots})
+
+    def read(self, done):
+        for line in self.process.stdout:  # type: ignore
+            done.put((self, json.loads(line)))
+        done.put((self, None))
+
+    def send(self, message: dict):
+        stdin: IO[bytes] = self.process.stdin  # type: ignore
+        try:
+            stdin.write((json.dumps(message) + "\n").encode())
+            stdin.flush()
+        except OSError:
+            self.alive = False  # Its repositories are lost when it is read
+
+    @property
+    def free(self) -> bool:
+        return self.ready and self.alive and len(self.running) < self.slots
+
+    @property
+    def starting(self) -> bool:
+        return self.alive and not self.ready
+
+    def submit(self, id: int, repo: Path, action: dict, stream: bool):
+        self.running[id] = (repo, time.time())
+        root = self.local_root
+        self.send(
+            {
+                "id": id,
+                "repo": str(map_path(repo, root, self.root)),
+                "action": map_action(action, root, self.root),
+                "stream": stream,
+            }
+        )
+
+    def result(self, action: Action, message: dict) -> Result:
+        repo, submitted = self.running.pop(message["id"])
+        if "error" in message:
+            _log.error(
+                f"{self.name} failed to run on {fname(repo.name)}",
+                extra={"repo": str(repo)},
+            )
+            result = failed_result(
+                action, repo, f"{self.name}: {message['error']}", ERROR_RETURNCODE
+            )
+        else:
+            result = decode_result(message["result"], repo, self.root, self.local_root)
+        result.submitted = submitted
+        return result
+
+    def kill(self):
+        self.alive = False
+        self.process.kill()  # Its reader puts None once its stdout is closed
+
+    def close(self):
+        try:
+            self.process.stdin.close()  # type: ignore
+        except OSError:
+            pass
+        try:
+            self.process.wait(CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def failed_result(
+    action: Action, repo: Path, message: str, returncode: int = LOST_RETURNCODE
+) -> Result:
+    now = time.time()
+    process = subprocess.CompletedProcess(
+        action.cmd_str, returncode, b"", f"mrh: {message}\n".encode()
+    )
+    return Result(repo, process, now, now)
+
+
+def run_remote(
+    action: Action,
+    repositories: list[Path],
+    scheduler: Scheduler,
+    on_result: OnResult | None = None,
+    stream: bool = False,
+    workers: list[dict] | None = None,
+) -> list[Result]:
+    """Run the action on the workers. Each repository goes to the next worker
+    with a free slot, so faster hosts take more of them. The repositories of
+    a worker that dies, or never starts, fail with exit code 255"""
+    if not workers:
+        raise ValueError("The remote engine needs `workers` in the config file")
+    local_root = Path.cwd().resolve()
+    done: queue.SimpleQueue = queue.SimpleQueue()
+    pool = [
+        Worker(spec, f"worker{i}", local_root, scheduler.max_running, done)
+        for i, spec in enumerate(workers)
+    ]
+    _log.debug(f"Workers: {', '.join(f'{w.name} ({w.slots})' for w in pool)}")
+    data = action.to_dict()
+    results: dict[Path, Result] = {}
+    ids = itertools.count()
+    pending = list(reversed(repositories))
+
+    def finish(repo: Path, result: Result):
+        results[repo] = result
+        if on_result is not None:
+            on_result(repo, result)
+
+    try:
+        while pending or any(w.running for w in pool):
+            for worker in pool:
+                while pending and worker.free:
+                    worker.submit(next(ids), pending.pop(), data, stream)
+            if pending and not any(w.alive or w.running for w in pool):
+                repo = pending.pop()
+                finish(repo, failed_result(action, repo, "no worker is running"))
+                continue
+            timeout = None  # Until the next worker that is starting is late
+            if starting := [w for w in pool if w.starting]:
+                deadline = min(w.deadline for w in starting)
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                worker, message = done.get(timeout=timeout)
+            except queue.Empty:
+                for worker in starting:
+                    if worker.deadline <= time.monotonic():
+                        _log.error(f"{worker.name} was not ready in time")
+                        worker.kill()
+                continue
+            if message is not None and "ready" in message:
+                worker.ready = True
+                continue
+            if message is not None:
+                result = worker.result(action, message)
+                finish(result.repo, result)
+                continue
+            if worker.starting:
+                _log.error(f"{worker.name} exited before it was ready")
+            worker.alive = False
+            for repo, _ in worker.running.values():
+                message = f"lost {worker.name} while running on {repo.name}"
+                _log.error(
+                    f"Lost {worker.name} while running on {fname(repo.name)}",
+                    extra={"repo": str(repo)},
+                )
+                finish(repo, failed_result(action, repo, message))
+            worker.running.clear()
+    finally:
+        for worker in pool:
+            worker.close()
+    return [results[repo] for repo in repositories]
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+
+from .actions import Result
+from .terminal import cs, fcode, ferror, fmute, fname, fstrike, fsuccess, funderline
+
+__all__ = ["print_compact"]
+
+MAX_NAMES = 10  # names of repositories listed per group
+# Start of the "$ command" lines written before the output by `cmd_header`
+COMMAND_PREFIX = fcode("$ ").removesuffix(cs.END)
+
+
+def normalize(repo: Path, data: bytes) -> str:
+    """Output without what is specific to the repository: the command headers
+    and its path. Progress lines overwritten with \\r only keep their end"""
+    header = fname(repo.name)
+    lines = []
+    text = data.decode(errors="replace").replace(str(repo), "<repo>")
+    for line in text.split("\n"):  # splitlines() splits at \r too
+        line = line.rstrip().rsplit("\r", 1)[-1]
+        if line == header or line.startswith(COMMAND_PREFIX):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip("\n")
+
+
+def group_results(results: list[Result]) -> list[list[Result]]:
+    """Results with the same exit code and normalized output. Successes
+    first, then failures, so these end up next to the prompt. The largest
+    groups first"""
+    groups: dict[tuple[int, str, str], list[Result]] = {}
+    for r in sorted(results, key=lambda r: r.repo):
+        key = (r.returncode, normalize(r.repo, r.stdout), normalize(r.repo, r.stderr))
+        groups.setdefault(key, []).append(r)
+    return [
+        group
+        for _, group in sorted(
+            groups.items(), key=lambda item: (item[0][0] != 0, -len(item[1]))
+        )
+    ]
+
+
+def format_group(group: list[Result]) -> str:
+    r = group[0]
+    stdout, stderr = normalize(r.repo, r.stdout), normalize(r.repo, r.stderr)
+    txt = ferror("[FAILED]") if r.returncode else fsuccess("[SUCCESS]")
+    txt += f" {len(group)} repositories" if len(group) > 1 else f" {fname(r.repo.name)}"
+    if r.returncode:
+        txt += f" (exit code {r.returncode})"
+
+    lines = [line for line in (stdout, stderr) if line]
+    if len(lines) == 1 and "\n" not in lines[0]:
+        txt += f": {lines[0]}\n"  # e.g. "287 repositories: Already up to date."
+    else:
+        txt += "\n"
+        for name, output in (("Stdout", stdout), ("Stderr", stderr)):
+            if output:
+                txt += f"{funderline(name)}:\n{output}\n"
+
+    if len(group) > 1:
+        names = ", ".join(fname(r.repo.name) for r in group[:MAX_NAMES])
+        if len(group) > MAX_NAMES:
+            names += fmute(f" and {len(group) - MAX_NAMES} more")
+        txt += f"  {names}\n"
+    elif r.returncode and r.stderr_path is not None:
+        txt += fmute(f"[full log: {r.stderr_path}]\n")
+    return txt + fstrike("=" * 100) + "\n"
+
+
+def print_compact(results: list[Result], verbose: bool):
+    """Print each group of identical results once, with a single write per
+    group. Without `verbose`, only the failures"""
+    sys.stdout.write("=" * 100 + "\n")
+    for group in group_results(results):
+        if verbose or group[0].returncode:
+            sys.stdout.write(format_group(group))
+    sys.stdout.flush()
@@ -1,38 +1,105 @@
-from multiprocessing import Pool
+import argparse
+import json
+import os
+import shlex
+import sys
+import time
+from dataclasses import fields
 from pathlib import Path
 
-from .actions import Action
-from .configuration import Configuration
-from .logger import get_logger
-from .notifications import notify
+from .actions import Action, Result, Workflow
+from .cache import ResultCache, default_cache_dir
+from .configuration import DEFAULT_CONFIGURATION_READER, Configuration
+from .discovery import get_index
+from .logger import flush_logging, get_logger, start_logging, stop_logging
 from .parser import get_parser
-from .tabcompletion import tabcomplete
-from .terminal import cs
+from .profiling import add_span, phase, print_report, print_slowest, write_trace
+from .terminal import (
+    cs,
+    fcode,
+    ferror,
+    fmute,
+    fname,
+    fstrike,
+    fsuccess,
+    funderline,
+    relative_name,
+)
 
 __all__ = ["main"]
 
 _log = get_logger(__name__)
 
-ferror = cs(cs.BOLD, cs.BLINK, cs.RED)
-fsuccess = cs(cs.BOLD, cs.GREEN)
-funderline = cs(cs.UNDERLINE)
-fstrike = cs(cs.STRIKE)
-fcode = cs(cs.ITALIC, cs.MUTE, cs.GREEN)
+fskipped = cs(cs.BOLD, cs.YELLOW)
 
 
-def filter_dirs(directory: Path, filter_str: str) -> set[Path]:
-    """Get all directories in a given directory that match a
-    filter string and are git repositories"""
-    directory = directory.resolve()
-    return set(filter(lambda p: (p / ".git").is_dir(), directory.glob(filter_str)))
+def get_filtered_dirs(
+    directory: Path, filter_strs: list[str], max_depth: int = 1, index: bool = True
+) -> list[Path]:
+    return get_index(directory, max_depth, use_cache=index).filter(filter_strs)
 
 
-def get_filtered_dirs(directory: Path, filter_strs: list[str]) -> list[Path]:
-    total_filtered: set[Path] = set()
-    for filter_str in filter_strs:
-        filtered = filter_dirs(directory, filter_str)
-        total_filtered.update(filtered)
-    return sorted(total_filtered)
+def format_output(name: str, data: bytes, size: int, path: Path | None) -> str:
+    txt = f"\n{funderline(name)}: "
+    if size > len(data):
+        txt += fmute(f"[last {len(data)} of {size} bytes]\n")
+    txt += data.decode(errors="replace")
+    if path is not None:
+        txt += fmute(f"\n[full log: {path}]")
+    return txt
+
+
+def format_result(r: Result) -> str:
+    txt = ""
+    txt += ferror("[FAILED]") if r.returncode else fsuccess("[SUCCESS]")
+    if r.cached:
+        txt += fmute(" (cached)")
+    txt += format_output("Stdout", r.stdout, r.stdout_size, r.stdout_path)
+    txt += format_output("Stderr", r.stderr, r.stderr_size, r.stderr_path) + "\n"
+    txt += fstrike("=" * 100)
+    return txt
+
+
+def format_status(repo: Path, r: Result) -> str:
+    status = ferror("[FAILED]") if r.returncode else fsuccess("[SUCCESS]")
+    txt = f"{status} {fname(repo.name)} (exit code {r.returncode})"
+    if r.cached:
+        txt += fmute(" (cached)")
+    if r.returncode and r.stderr_path is not None:
+        txt += fmute(f" [log: {r.stderr_path}]")
+    return txt
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def print_failures_summary(failures: list[tuple[Path, int]], total: int):
+    print("=" * 100)
+    if not failures:
+        print(fsuccess(f"All {total} repositories succeeded"))
+        return
+    print(ferror(f"{len(failures)}/{total} repositories failed:"))
+    for repo, returncode in failures:
+        print(f"  {fname(repo.name)} (exit code {returncode})")
+
+
+def print_record(record: dict):
+    """Write a json record on its own line, right away"""
+    print(json.dumps(record), flush=True)
+
+
+def print_skipped_summary(skipped: dict[Path, str], action: Action, format: str):
+    if format == "jsonl":
+        for repo, reason in skipped.items():
+            print_record({"repo": str(repo), "action": action.key, "skipped": reason})
+        return
+    if not skipped:
+        return
+    print(fskipped(f"Skipped {len(skipped)} repositories:"))
+    for repo, reason in skipped.items():
+        print(f"  {fname(repo.name)} ({reason})")
 
 
 def multi_action(
@@ -40,36 +107,361 @@ def multi_action(
     repositories: list[Path],
     verbose: bool,
     pool_size: int = 10,
-):
+    engine: str = "process",
+    stream: bool = False,
+    concurrency: str = "fixed",
+    concurrency_limits: dict[str, int] | None = None,
+    history: bool = True,
+    format: str = "text",
+    workers: list[dict] | None = None,
+    journal: bool = True,
+    resumed: bool = False,
+    cache: ResultCache | None = None,
+    dependencies: dict[Path, set[Path]] | None = None,
+    skipped: dict[Path, str] | None = None,
+) -> list[Result]:
+    """Run the action in the repositories. With `dependencies`, a repository
+    only runs after its dependencies succeeded, the ones that can not run are
+    added to `skipped`"""
+    from .engines import get_engine  # only import the engine that is used
+    from .history import History
+    from .journal import Journal
+    from .scheduler import Scheduler
+
     _log.info(f"Running {fcode(str(action))} in {len(repositories)} repositories...")
-    with Pool(pool_size) as p:
-        results = p.map(action, repositories)
+    run = get_engine(engine, workers)
+    scheduler = Scheduler(action, pool_size, concurrency, concurrency_limits)
+
+    durations = History(Path.cwd(), action.key) if history else None
+    runs = Journal(Path.cwd()) if journal else None
+    remaining = set(repositories)
+    if durations is not None:
+        # Start the slowest repositories first to finish as early as possible
+        repositories = durations.longest_first(repositories)
+    groups = [repositories]
+    if dependencies is not None:
+        from .dependencies import frontiers
+
+        groups = frontiers(dependencies, repositories)
+        _log.info(f"Running in {len(groups)} groups of repositories, in order")
+    if durations is not None:
+        etas = [durations.eta(group, scheduler.max_running) for group in groups]
+        if None not in etas:
+            _log.info(f"Expected to finish in about {format_duration(sum(etas))}")
+
+    failures: list[tuple[Path, int]] = []
+    jsonl = format == "jsonl"
+    if jsonl:
+        stream = False  # stdout only has the records
+
+    def on_result(repo: Path, r: Result):
+        remaining.discard(repo)
+        track = relative_name(repo)
+        add_span(track, "queued", "queue", r.submitted, r.started)
+        add_span(
+            track,
+            action.key,
+            "command",
+            r.started,
+            r.finished,
+            returncode=r.returncode,
+            stdout_size=r.stdout_size,
+            stderr_size=r.stderr_size,
+        )
+        if durations is not None and not r.cached:
+            durations.record(repo, r.duration)
+        if runs is not None:
+            runs.record(r)
+        if r.returncode:
+            failures.append((repo, r.returncode))
+        if jsonl:
+            print_record({"action": action.key, "cmd": action.cmd_str, **r.to_dict()})
+            return
+        if not stream:
+            return
+        # Print a status line for each repository as soon as it finishes, after
+        # the logs about it
+        flush_logging()
+        txt = format_status(repo, r)
+        if remaining and durations is not None:
+            eta = durations.eta(list(remaining), scheduler.max_running)
+            txt += f" ETA {format_duration(eta or 0)}"
+        print(txt, flush=True)
+
+    if runs is not None:
+        runs.start(action, repositories, resumed)
+    interrupted = True
+    by_repo: dict[Path, Result] = {}
+    blocked: dict[Path, str] = {}  # the dependents of failed repositories
+    try:
+        for group in groups:
+            for repo in group:
+                for dependency in (dependencies or {}).get(repo, ()):
+                    if dependency in blocked or by_repo[dependency].returncode:
+                        why = "was skipped" if dependency in blocked else "failed"
+                        blocked[repo] = f"depends on {dependency.name}, which {why}"
+                        remaining.discard(repo)
+                        break
+            group = [repo for repo in group if repo not in blocked]
+            cached = {}
+            if cache is not None:
+                with phase("cache"):
+                    cached = cache.lookup(action, group, pool_size)
+                for repo, r in cached.items():
+                    on_result(repo, r)
+            to_run = [repo for repo in group if repo not in cached]
+            ran = run(action, to_run, scheduler, on_result, stream) if to_run else []
+            if cache is not None:
+                cache.store(action, ran)
+            by_repo.update({**cached, **{r.repo: r for r in ran}})
+        results = [by_repo[repo] for repo in repositories if repo in by_repo]
+        interrupted = False
+    finally:
+        if durations is not None:
+            durations.save()
+        if runs is not None:
+            runs.finish(interrupted)
+    if blocked:
+        _log.warning(f"Skipped {len(blocked)} repositories after a failure")
+        if skipped is not None:
+            skipped.update(blocked)
+
+    if jsonl:
+        return results
+    flush_logging()  # The results come after the logs of the run
+    if stream:
+        print_failures_summary(failures, len(results))
+        return results
+
+    with phase("render"):
+        if format == "compact":
+            from .render import print_compact
+
+            print_compact(results, verbose)
+            return results
         print("=" * 100)
-        for r in results:
+        for r in sorted(results, key=lambda r: r.repo):
             if not verbose and r.returncode == 0:
                 continue
+            print(format_result(r))
+    return results
+
 
-            txt = ""
-            txt += ferror("[FAILED]") if r.returncode else fsuccess("[SUCCESS]")
-            txt += f"\n{funderline('Stdout')}: {r.stdout.decode()}"
-            txt += f"\n{funderline('Stderr')}: {r.stderr.decode()}\n"
-            txt += fstrike("=" * 100)
+def configure_action(action: Action, cfg: Configuration, log_dir: Path | None):
+    action.timeout = cfg.timeouts.get(action.key, cfg.timeout)
+    action.retries = cfg.retries
+    action.backoff = cfg.retry_backoff
+    action.max_output = cfg.max_output
+    action.log_dir = log_dir
+    return action
 
-            print(txt)
+
+def get_action(
+    parser: argparse.ArgumentParser,
+    argsd: dict,
+    cfg: Configuration,
+    log_dir: Path | None = None,
+) -> Action:
+    """Action for the parsed arguments. Each step of a workflow is parsed as
+    if it was given on the command line (e.g. "git commit 'my message'")"""
+    if argsd["command"] != "workflow":
+        return configure_action(Action(**argsd), cfg, log_dir)
+
+    name = ""
+    if argsd["subcommand"] == "run":
+        name = argsd["workflow"]
+        if name not in cfg.workflows:
+            parser.error(
+                f"Unknown workflow {name!r}. Choose one of {list(cfg.workflows)}"
+            )
+        steps = cfg.workflows[name]
+    else:
+        steps = argsd["steps"]
+
+    non_action_args = {
+        "config",
+        "startup_profile",
+        "resume",
+        "retry_failed",
+        "trace",
+        *(f.name for f in fields(cfg)),
+    }
+    actions = []
+    for i, step in enumerate(steps):
+        step_args = vars(parser.parse_args(shlex.split(step)))
+        if step_args["command"] == "workflow":
+            parser.error(f"Workflows can not have workflow steps: {step!r}")
+        step_kwargs = {k: v for k, v in step_args.items() if k not in non_action_args}
+        step_log_dir = log_dir / f"step{i}" if log_dir is not None else None
+        actions.append(configure_action(Action(**step_kwargs), cfg, step_log_dir))
+    return configure_action(Workflow(argsd["subcommand"], actions, name), cfg, log_dir)
 
 
 def main():
-    parser = get_parser()
-    tabcomplete(parser)  # if tabcomplete is called, it will exit the program
+    if "COMPLETION" in sys.argv[1:]:
+        from .tabcompletion import tabcomplete
 
-    args = parser.parse_args()
+        tabcomplete()  # if tabcomplete is called, it will exit the program
+
+    with phase("parser"):
+        parser = get_parser()
+        args = parser.parse_args()
     argsd = dict(args._get_kwargs())
-    cfg: Configuration = argsd.pop("config")
+    if argsd["command"] == "daemon":
+        from .daemon import control
 
-    action = Action(**argsd)
-    filtered_repositories = get_filtered_dirs(Path.cwd().resolve(), cfg.filter)
-    multi_action(action, filtered_repositories, cfg.verbose, cfg.pool_size)
+        sys.exit(control(argsd["subcommand"], Path.cwd().resolve()))
+    startup_profile: bool = argsd.pop("startup_profile")
+    trace: str | None = argsd.pop("trace")
+    resume: bool = argsd.pop("resume")
+    retry_failed: bool = argsd.pop("retry_failed")
 
-    if cfg.no_notify:
-        return
-    notify(action)
+    try:
+        with phase("config"):
+            cfg: Configuration = (
+                argsd.pop("config") or DEFAULT_CONFIGURATION_READER.read()
+            )
+            overrides = {
+                f.name: argsd.pop(f.name) for f in fields(cfg) if f.name in argsd
+            }
+            cfg = cfg.override(**overrides)
+
+        log_dir = None
+        if cfg.log_dir is not None:
+            run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            log_dir = Path(cfg.log_dir).expanduser().resolve() / run_id
+        start_logging(cfg.log_level, cfg.log_levels, log_dir, cfg.console_log_rate)
+        action = get_action(parser, argsd, cfg, log_dir)
+        with phase("discovery"):
+            filtered_repositories = get_filtered_dirs(
+                Path.cwd().resolve(), cfg.filter, cfg.max_depth, cfg.index
+            )
+        if cfg.dirty or cfg.ahead or cfg.on_branch or cfg.changed_since:
+            from .predicates import matching_repositories
+
+            with phase("predicates"):
+                filtered_repositories = matching_repositories(
+                    filtered_repositories,
+                    cfg.pool_size,
+                    cfg.dirty,
+                    cfg.ahead,
+                    cfg.on_branch,
+                    cfg.changed_since,
+                )
+        if resume or retry_failed:
+            from .journal import pending_repositories
+
+            with phase("journal"):
+                pending = pending_repositories(
+                    Path.cwd(), action.key, resume, retry_failed
+                )
+            if pending is None:
+                _log.error(f"{fcode(action.key)} never ran here, nothing to resume")
+                sys.exit(1)
+            filtered_repositories = [r for r in filtered_repositories if r in pending]
+            _log.info(
+                f"{len(filtered_repositories)} repositories left from the last "
+                f"{fcode(action.key)}"
+            )
+            if not filtered_repositories:
+                return
+        skipped: dict[Path, str] = {}
+        if not cfg.force and (cfg.smart or action.command == "pipenv"):
+            from .smart import DEFAULT_SMART, is_smart, select_repositories
+
+            key = (action.command, action.subcommand)
+            if is_smart(action) and (cfg.smart or key in DEFAULT_SMART):
+                with phase("smart"):
+                    filtered_repositories, skipped = select_repositories(
+                        action, filtered_repositories, cfg.pool_size
+                    )
+            elif cfg.smart:
+                _log.warning(f"--smart is not supported for {fcode(str(action))}")
+        cache = None
+        if cfg.cache and action.command == "cmd":
+            cache = ResultCache(
+                Path(cfg.cache_dir).expanduser()
+                if cfg.cache_dir
+                else default_cache_dir(),
+                cfg.cache_max_size,
+                cfg.cache_max_age,
+                reuse=not cfg.force,
+            )
+        with phase("run"):
+            if (action.command, action.subcommand) == ("git", "status"):
+                from .status import print_status
+
+                print_status(filtered_repositories, cfg.pool_size, cfg.format)
+                return
+            if (action.command, action.subcommand) == ("git", "grep"):
+                from .grep import grep
+
+                sys.exit(
+                    grep(
+                        filtered_repositories,
+                        argsd["pattern"],
+                        argsd["paths"],
+                        cfg.pool_size,
+                        argsd["max_count"],
+                        argsd["ignore_case"],
+                        argsd["word_regexp"],
+                        argsd["fixed_strings"],
+                        cfg.format,
+                    )
+                )
+            dependencies = None
+            if cfg.ordered:
+                from .dependencies import dependency_graph, frontiers
+
+                with phase("dependencies"):
+                    dependencies = dependency_graph(
+                        filtered_repositories,
+                        cfg.dependencies,
+                        cfg.pipfile_dependencies,
+                    )
+                try:
+                    frontiers(dependencies, filtered_repositories)
+                except ValueError as e:
+                    _log.error(e)
+                    sys.exit(1)
+            results = multi_action(
+                action,
+                filtered_repositories,
+                cfg.verbose,
+                cfg.pool_size,
+                cfg.engine,
+                cfg.stream,
+                cfg.concurrency,
+                cfg.concurrency_limits,
+                cfg.history,
+                cfg.format,
+                cfg.workers,
+                cfg.journal,
+                resume or retry_failed,
+                cache,
+                dependencies,
+                skipped,
+            )
+        if action.command == "pipenv":
+            from .fingerprints import record_fingerprints
+
+            record_fingerprints(action, results, cfg.pool_size)
+        print_skipped_summary(skipped, action, cfg.format)
+
+        if cfg.no_notify:
+            return
+        with phase("notify"):
+            from .notifications import notify
+
+            notify(action)
+    except KeyboardInterrupt:
+        _log.error("Interrupted, the running commands were killed")
+        sys.exit(130)
+    finally:
+        stop_logging()
+        if startup_profile:
+            print_report()
+        if trace is not None:
+            write_trace(trace)
+            print_slowest()
+            _log.info(f"Trace written to {trace}")
@@ -0,0 +1,131 @@
+import os
+import re
+import time
+
+from .actions import Action
+from .logger import get_logger
+
+__all__ = ["Scheduler"]
+
+_log = get_logger(__name__)
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Default budget of each concurrency class, in jobs (`-j N` counts as N jobs)
+CLASS_LIMITS = dict(
+    network=64,  # Mostly waiting on remotes
+    io=4 * CPU_COUNT,  # Local git operations
+    cpu=CPU_COUNT,  # Resolvers, installers, builds and tests
+)
+# Stop starting new jobs when the load average per cpu goes above this
+MAX_LOAD_PER_CPU = dict(network=4.0, io=2.0, cpu=1.0)
+# Stop starting new jobs when less than this fraction of the memory is available
+MIN_AVAILABLE_MEMORY = 0.1
+POLL_INTERVAL = 0.5  # seconds
+
+INNER_JOBS_RE = re.compile(r"(?:^|\s)(?:-j\s*|--jobs[=\s])(\d+)")
+
+
+def inner_jobs(cmd: str) -> int:
+    """How many jobs a single command runs, e.g. `git fetch -j4` runs 4"""
+    match = INNER_JOBS_RE.search(cmd)
+    return int(match.group(1)) if match else 1
+
+
+def available_memory() -> float | None:
+    """Fraction of the memory that is available, None if it is unknown"""
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = dict(line.split(":", 1) for line in f)
+        total = int(meminfo["MemTotal"].split()[0])
+        available = int(meminfo["MemAvailable"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+    return available / total
+
+
+class Scheduler:
+    """Decides when the next repository can start.
+
+    - fixed: at most `pool_size` commands at the same time
+    - adaptive: the limit depends on the concurrency class of the command and
+      accounts for its inner parallelism (`-j`), up to `pool_size`. No new
+      command is started while the machine is overloaded (load average or
+      memory)
+    """
+
+    def __init__(
+        self,
+        action: Action,
+        pool_size: int,
+        concurrency: str = "fixed",
+        limits: dict[str, int] | None = None,
+    ) -> None:
+        if concurrency not in ("fixed", "adaptive"):
+            raise ValueError(f"Unknown concurrency {concurrency!r}")
+        self.adaptive = concurrency == "adaptive"
+        self.running = 0
+
+        if self.adaptive:
+            self.klass = action.concurrency_class
+            budget = {**CLASS_LIMITS, **(limits or {})}[self.klass]
+            commands = budget // inner_jobs(action.cmd_str)
+            self.max_running = max(1, min(pool_size, commands))
+            _log.debug(f"{self.klass} concurrency: up to {self.max_running} at once")
+        else:
+            self.max_running = pool_size
+
+        self._overloaded_checked_at = 0.0
+        self._overloaded = False
+        self._finished = None  # asyncio.Event, only used by the async engine
+        self._loop = None  # the event loop `_finished` belongs to
+
+    def overloaded(self) -> bool:
+        """Whether the machine is too busy to start another command. Checked
+        at most once every `POLL_INTERVAL` seconds"""
+        if time.monotonic() - self._overloaded_checked_at < POLL_INTERVAL:
+            return self._overloaded
+        self._overloaded_checked_at = time.monotonic()
+
+        load = os.getloadavg()[0] / CPU_COUNT if hasattr(os, "getloadavg") else 0
+        memory = available_memory()
+        self._overloaded = load > MAX_LOAD_PER_CPU[self.klass] or (
+            memory is not None and memory < MIN_AVAILABLE_MEMORY
+        )
+        if self._overloaded:
+            _log.debug(f"Machine overloaded ({load=:.2f}, {memory=}), waiting...")
+        return self._overloaded
+
+    def can_start(self) -> bool:
+        if self.running == 0:
+            return True  # Always make progress
+        if self.running >= self.max_running:
+            return False
+        return not (self.adaptive and self.overloaded())
+
+    def start(self):
+        self.running += 1
+
+    def finish(self):
+        self.running -= 1
+        if self._finished is not None:
+            self._finished.set()
+
+    async def acquire(self):
+        """Wait until the next command can start (asyncio engine)"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._finished is None or self._loop is not loop:
+            # Each run of the async engine (e.g. each group of --ordered) has
+            # its own loop, an event can only be awaited in one of them
+            self._finished = asyncio.Event()
+            self._loop = loop
+        while not self.can_start():
+            # Wake up when a command finishes or to check the load again
+            self._finished.clear()
+            try:
+                await asyncio.wait_for(self._finished.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        self.start()
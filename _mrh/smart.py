@@ -0,0 +1,118 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+from .actions import Action
+from .fingerprints import (
+    FINGERPRINTED,
+    install_skip_reason,
+    lock_skip_reason,
+    sync_skip_reason,
+)
+from .gitrefs import Refs
+from .logger import get_logger
+
+__all__ = ["DEFAULT_SMART", "is_smart", "select_repositories"]
+
+_log = get_logger(__name__)
+
+
+def pull_skip_reason(repo: Path, timeout: float | None = None) -> str | None:
+    """Why `git pull` can be skipped, None if it has to run. Compares HEAD with
+    the upstream branch on the remote using `git ls-remote` (no objects are
+    transferred). Any failure to reach the remote runs `git pull` anyway"""
+    refs = Refs(repo)
+    branch, sha = refs.head()
+    if branch is None:
+        return "detached HEAD"
+    if (upstream := refs.upstream(branch)) is None:
+        return "no upstream"
+    remote, merge = upstream
+    if remote == ".":
+        return "up to date" if refs.resolve(merge) == sha else None
+
+    try:
+        proc = subprocess.run(
+            ["git", "ls-remote", "--", remote, merge],
+            cwd=repo,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            timeout=timeout,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+    except subprocess.TimeoutExpired:
+        _log.debug(f"git ls-remote timed out in {repo}")
+        return None
+    if proc.returncode != 0 or not proc.stdout:
+        return None  # Let `git pull` report the error
+    remote_sha = proc.stdout.split()[0].decode()
+    if remote_sha == sha:
+        return "up to date"
+    if remote_sha == refs.resolve(
+        f"refs/remotes/{remote}/{merge.removeprefix('refs/heads/')}"
+    ):
+        # Nothing new on the remote: only pull if HEAD is behind what was
+        # already fetched
+        is_ancestor = subprocess.run(
+            ["git", "merge-base", "--is-ancestor", remote_sha, sha], cwd=repo
+        )
+        if is_ancestor.returncode == 0:
+            return "ahead of upstream"
+    return None
+
+
+def push_skip_reason(repo: Path) -> str | None:
+    """Why `git push` can be skipped, None if it has to run. Compares HEAD
+    with the local remote-tracking ref, so no network access is needed"""
+    refs = Refs(repo)
+    branch, sha = refs.head()
+    if branch is None:
+        return "detached HEAD"
+    if (tracking_ref := refs.tracking_ref(branch)) is None:
+        return "no upstream"
+    return "nothing to push" if refs.resolve(tracking_ref) == sha else None
+
+
+SKIP_REASONS: dict[tuple[str, str], Callable[..., str | None]] = {
+    ("git", "pull"): pull_skip_reason,
+    ("git", "push"): push_skip_reason,
+    ("pipenv", "lock"): lock_skip_reason,
+    ("pipenv", "sync"): sync_skip_reason,
+    ("pipenv", "install"): install_skip_reason,
+}
+
+# Skip reasons that talk to the remote, bounded by the timeout of the action
+NETWORK = {("git", "pull")}
+
+# Skipped in up-to-date repositories even without --smart
+DEFAULT_SMART = FINGERPRINTED
+
+
+def is_smart(action: Action) -> bool:
+    """Whether the action supports skipping repositories with nothing to do"""
+    return (action.command, action.subcommand) in SKIP_REASONS
+
+
+def select_repositories(
+    action: Action, repositories: list[Path], pool_size: int
+) -> tuple[list[Path], dict[Path, str]]:
+    """Split the repositories into the ones where the action has something to
+    do and the skipped ones (with the reason they were skipped)"""
+    key = (action.command, action.subcommand)
+    skip_reason = SKIP_REASONS[key]
+    if key in NETWORK:
+        skip_reason = partial(skip_reason, timeout=action.timeout)
+    _log.info(f"Checking which of {len(repositories)} repositories need {action}...")
+    with ThreadPoolExecutor(pool_size) as executor:
+        reasons = list(executor.map(skip_reason, repositories))
+
+    selected = [repo for repo, reason in zip(repositories, reasons) if reason is None]
+    skipped = {
+        repo: reason
+        for repo, reason in zip(repositories, reasons)
+        if reason is not None
+    }
+    return selected, skipped
@@ -0,0 +1,205 @@
+import json
+import os
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from .gitrefs import Refs
+from .logger import get_logger
+from .terminal import cs, fmute, fname
+
+__all__ = ["RepoStatus", "ahead_behind", "get_status", "is_dirty", "print_status"]
+
+_log = get_logger(__name__)
+
+fbranch = cs(cs.BOLD, cs.CYAN)
+fahead = cs(cs.GREEN)
+fbehind = cs(cs.RED)
+fdirty = cs(cs.BOLD, cs.YELLOW)
+
+
+@dataclass
+class RepoStatus:
+    repo: Path
+    branch: str | None  # None when HEAD is detached
+    sha: str | None
+    tracking: str | None = None  # e.g. origin/main
+    # None when git could not compare HEAD with the upstream
+    ahead: int | None = 0
+    behind: int | None = 0
+    dirty: bool = False
+
+
+IndexEntry = tuple[Path, int, int]
+
+
+def read_index(refs: Refs) -> list[IndexEntry] | None:
+    """(path, mtime in ns, size) of every file in the index, as recorded when
+    it was last staged. None when the index can not be read (e.g. index v4),
+    so git has to be asked"""
+    index = read_index_file(refs)
+    return None if index is None else index[0]
+
+
+def read_index_file(refs: Refs) -> tuple[list[IndexEntry], str | None] | None:
+    """Entries of the index and the tree they make, when git recorded it (the
+    root of the cache tree extension, valid until something is staged)"""
+    try:
+        data = (refs.git_dir / "index").read_bytes()
+    except OSError:
+        return None
+    if len(data) < 12:
+        return None
+    signature, version, count = struct.unpack(">4sLL", data[:12])
+    if signature != b"DIRC" or version not in (2, 3):
+        return None
+
+    entries = []
+    offset = 12
+    for _ in range(count):
+        (_, _, mtime_s, mtime_ns, *_, size) = struct.unpack(
+            ">LLLL5LL", data[offset : offset + 40]  # noqa: E203
+        )
+        flags = struct.unpack(">H", data[offset + 60 : offset + 62])[0]  # noqa: E203
+        path_start = offset + 62 + (2 if flags & 0x4000 else 0)  # extended flags
+        path_end = data.index(b"\0", path_start)
+        path = refs.repo / os.fsdecode(data[path_start:path_end])
+        # Entries are padded with 1 to 8 NUL bytes to a multiple of 8
+        offset += (path_end - offset + 8) & ~7
+        entries.append((path, mtime_s * 10**9 + mtime_ns, size))
+
+    tree = None
+    while offset + 8 <= len(data) - 20:  # Extensions, then a checksum
+        name, size = struct.unpack(">4sL", data[offset : offset + 8])  # noqa: E203
+        if name == b"TREE" and data[offset + 8] == 0:  # The root, an empty path
+            counts_end = data.index(b"\n", offset + 9)
+            if not data[offset + 9 : counts_end].startswith(b"-1"):  # noqa: E203
+                tree = data[counts_end + 1 : counts_end + 21].hex()  # noqa: E203
+            break
+        offset += 8 + size
+    return entries, tree
+
+
+def index_is_stale(entries: list[IndexEntry]) -> bool:
+    """Compare the stat data stored in the index with the working tree files.
+
+    Returns True if any tracked file changed, False if none did"""
+    for path, mtime_ns, size in entries:
+        try:
+            st = path.lstat()
+        except OSError:
+            return True
+        if st.st_size != size or st.st_mtime_ns != mtime_ns:
+            return True
+    return False
+
+
+def has_staged_changes(refs: Refs, tree: str | None) -> bool | None:
+    """Whether the index differs from HEAD, None if it can not be told
+    without git. The tree of the index is the one of HEAD unless something
+    was staged, while a mere refresh of the stat data (e.g. by `git status`)
+    keeps it. Without it, the index can only be trusted if it did not change
+    after the last commit/checkout"""
+    _, sha = refs.head()
+    if tree is not None and sha is not None:
+        if (head_tree := refs.commit_tree(sha)) is not None:
+            return tree != head_tree
+    try:
+        index_mtime = (refs.git_dir / "index").stat().st_mtime_ns
+        head_mtime = (refs.git_dir / "logs" / "HEAD").stat().st_mtime_ns
+    except OSError:
+        return None
+    return False if index_mtime <= head_mtime else None
+
+
+def is_dirty(refs: Refs) -> bool:
+    """Whether the repository has changes to tracked files. The index is
+    compared with the working tree and with HEAD in python, git is only run
+    when that can not tell (e.g. the stat data differs, or something was
+    staged and the index may match HEAD again)"""
+    if (index := read_index_file(refs)) is not None:
+        entries, tree = index
+        if not index_is_stale(entries):
+            staged = has_staged_changes(refs, tree)
+            if staged is not None:
+                return staged
+
+    proc = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        cwd=refs.repo,
+        capture_output=True,
+    )
+    return bool(proc.stdout.strip())
+
+
+def ahead_behind(refs: Refs, sha: str, tracking_sha: str) -> tuple[int, int] | None:
+    """Commits HEAD is ahead/behind of its upstream, None if git can not tell
+    (e.g. a shallow clone without their common ancestor). git is only run
+    when they point to different commits"""
+    if sha == tracking_sha:
+        return 0, 0
+    proc = subprocess.run(
+        ["git", "rev-list", "--left-right", "--count", f"{sha}...{tracking_sha}"],
+        cwd=refs.repo,
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        _log.debug(
+            f"Cannot count the commits ahead/behind in {fname(refs.repo.name)}: "
+            f"{proc.stderr.decode(errors='replace').strip()}",
+            extra={"repo": str(refs.repo)},
+        )
+        return None
+    ahead, behind = proc.stdout.split()
+    return int(ahead), int(behind)
+
+
+def get_status(repo: Path) -> RepoStatus:
+    refs = Refs(repo)
+    branch, sha = refs.head()
+    status = RepoStatus(repo, branch, sha, dirty=is_dirty(refs))
+    if branch is None or sha is None:
+        return status
+
+    if (tracking_ref := refs.tracking_ref(branch)) is not None:
+        status.tracking = tracking_ref.removeprefix("refs/remotes/")
+        if (tracking_sha := refs.resolve(tracking_ref)) is not None:
+            counts = ahead_behind(refs, sha, tracking_sha)
+            status.ahead, status.behind = counts if counts is not None else (None, None)
+    return status
+
+
+def format_status(status: RepoStatus, name_width: int) -> str:
+    branch = status.branch or f"({(status.sha or '')[:8]})"
+    txt = f"{fname(status.repo.name)}{' ' * (name_width - len(status.repo.name))} "
+    txt += fbranch(branch)
+    if status.tracking is None:
+        txt += fmute(" (no upstream)")
+    else:
+        txt += fmute(f" -> {status.tracking}")
+        if status.ahead is None:
+            txt += fbehind(" ↑?↓? (could not compare)")
+        if status.ahead:
+            txt += fahead(f" ↑{status.ahead}")
+        if status.behind:
+            txt += fbehind(f" ↓{status.behind}")
+    if status.dirty:
+        txt += fdirty(" *dirty*")
+    return txt
+
+
+def print_status(repositories: list[Path], pool_size: int, format: str = "text"):
+    """Print one line per repository with its branch, how far ahead/behind of
+    its upstream it is and whether it has uncommitted changes"""
+    with ThreadPoolExecutor(pool_size) as executor:
+        statuses = list(executor.map(get_status, repositories))
+
+    if format == "jsonl":
+        for status in statuses:
+            print(json.dumps({**asdict(status), "repo": str(status.repo)}))
+        return
+
+    name_width = max((len(r.name) for r in repositories), default=0)
+    print("\n".join(format_status(status, name_width) for status in statuses))
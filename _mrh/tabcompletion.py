@@ -1,100 +1,149 @@
 import argparse
 import sys
 
-__all__ = ["tabcomplete"]
+from .commands import COMMANDS
 
+__all__ = ["tabcomplete", "completion_script"]
 
-def tabcomplete(parser: argparse.ArgumentParser):
+
+def get_subparsers(parser: argparse.ArgumentParser) -> dict:
+    """{name: parser} of the subcommands of `parser`"""
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            return action.choices
+    return {}
+
+
+def get_options(parser: argparse.ArgumentParser) -> list[str]:
+    """Option strings accepted by `parser`"""
+    return [s for action in parser._actions for s in action.option_strings]
+
+
+def completion_table() -> dict[str, dict[str, list[str]]]:
+    """{command: {subcommand: [options]}}, read from the parser so that the
+    options of each subcommand (e.g. `git grep -i`) are offered"""
+    from .parser import get_parser
+
+    return {
+        command: {
+            subcommand: get_options(subcommand_parser)
+            for subcommand, subcommand_parser in get_subparsers(parser).items()
+        }
+        for command, parser in get_subparsers(get_parser()).items()
+    }
+
+
+def tabcomplete():
     """Bash autocomplete for subcommands and actions.
     This function is called when the script is run when:
     - mrh COMPLETION INIT
     - mrh COMPLETION COMMANDS
     - mrh COMPLETION SUBCOMMANDS {command}
     - mrh COMPLETION ARGS {command} {subcommand}
-    """
-
-    def parser_choices(parser: argparse.ArgumentParser) -> dict:
-        return parser._subparsers._actions[1].choices  # type: ignore
-
-    def subparser_choices(subparser: argparse.ArgumentParser) -> dict:
-        return subparser._optionals._actions[1].choices  # type: ignore
-
-    def __get_commands() -> list[str]:
-        return list(parser_choices(parser).keys())
-
-    def __get_subcommands(command: str) -> list[str]:
-        subparser = parser_choices(parser)[command]
-        return list(subparser_choices(subparser).keys())
-
-    def __get_args(command: str, subcommand: str) -> list[str]:
-        subparser = parser_choices(parser)[command]
-        subcommand_parser = subparser_choices(subparser)[subcommand]
-        return list(subcommand_parser._option_string_actions.keys())
 
+    The script printed by `mrh COMPLETION INIT` embeds all the commands,
+    subcommands and options so it never needs to call mrh again. The other
+    forms are kept for completion scripts installed by older versions
+    """
     argv = sys.argv[1:]
 
-    def __raise_invalid_args():
-        raise ValueError(f"Invalid tab completion arguments: {' '.join(argv)}")
-
     if "COMPLETION" in argv:
         if "INIT" in argv and len(argv) == 2:
             # mrh COMPLETION INIT
-            __mrh_complete()
+            print(completion_script())
         elif "COMMANDS" in argv and len(argv) == 2:
             # mrh COMPLETION COMMANDS
-            print(" ".join(__get_commands()))
+            print(" ".join(COMMANDS))
         elif "SUBCOMMANDS" in argv and len(argv) == 3:
             # mrh COMPLETION SUBCOMMANDS {command}
-            print(" ".join(__get_subcommands(argv[2])))
+            print(" ".join(COMMANDS.get(argv[2], {})))
         elif "ARGS" in argv and len(argv) >= 4:
             # mrh COMPLETION ARGS {command} {subcommand}
-            print(" ".join(__get_args(argv[2], argv[3])))
-        # else:
-        #     __raise_invalid_args()
+            print(" ".join(completion_table().get(argv[2], {}).get(argv[3], [])))
         exit(0)
 
 
-def __mrh_complete():
-    print(
-        """
+def completion_script() -> str:
+    """Bash tab completion script with a static table of commands, subcommands
+    and options. Repository names are read from the workspace index (or the
+    `*/.git` entries) and branch names from the `.git` refs of every repository,
+    so pressing TAB never starts a python process"""
+    table = completion_table()
 
+    subcommand_cases = "\n".join(
+        f'        {command}) words="{" ".join(subcommands)}" ;;'
+        for command, subcommands in table.items()
+    )
+    options_cases = "\n".join(
+        f'        {command}:{subcommand}) words="{" ".join(options)}" ;;'
+        for command, subcommands in table.items()
+        for subcommand, options in subcommands.items()
+    )
+
+    return f"""
 # MRH
 # START: Bash tab completion for multi_repo_helper
-# Do not edit the following line; it is used by multi_repo_helper
-_mrh_complete() {
-    local cur first second
-    cur=${COMP_WORDS[COMP_CWORD]}
-    [[ len_words=${#COMP_WORDS[@]} -gt 0 ]] && first=${COMP_WORDS[1]} || first=""
-    [[ len_words=${#COMP_WORDS[@]} -gt 1 ]] && second=${COMP_WORDS[2]} || second=""
-
-    case ${COMP_CWORD} in
+# Do not edit the following lines; they are generated by multi_repo_helper
+_mrh_repos() {{
+    local index=".mrh.index.json" repos d
+    if [[ -f ${{index}} && "$(<${{index}})" =~ \\"repos\\":\\ \\[([^]]*)\\] ]]; then
+        repos=${{BASH_REMATCH[1]//[\\",]/}}
+        echo ${{repos}}
+    else
+        for d in */.git; do [[ -e ${{d}} ]] && echo ${{d%/.git}}; done
+    fi
+}}
+_mrh_branches() {{
+    local repo f ref hash
+    for repo in $(_mrh_repos); do
+        [[ -d ${{repo}}/.git ]] || continue
+        # Nested names too, e.g. refs/heads/feature/x
+        while read -r f; do
+            ref=${{f#${{repo}}/.git/}}
+            [[ ${{ref}} == refs/heads/* ]] && echo ${{ref#refs/heads/}}
+            [[ ${{ref}} == refs/remotes/*/* ]] && echo ${{ref#refs/remotes/*/}}
+        done < <(find ${{repo}}/.git/refs/heads ${{repo}}/.git/refs/remotes -type f 2>/dev/null)
+        f=${{repo}}/.git/packed-refs
+        [[ -f ${{f}} ]] || continue
+        while read -r hash ref; do
+            [[ ${{ref}} == refs/heads/* ]] && echo ${{ref#refs/heads/}}
+            [[ ${{ref}} == refs/remotes/*/* ]] && echo ${{ref#refs/remotes/*/}}
+        done <${{f}}
+    done
+}}
+_mrh_complete() {{
+    local cur prev first second words
+    cur=${{COMP_WORDS[COMP_CWORD]}}
+    prev=${{COMP_WORDS[COMP_CWORD-1]}}
+    first=${{COMP_WORDS[1]}}
+    second=${{COMP_WORDS[2]}}
+
+    case ${{COMP_CWORD}} in
     1)
-        COMPREPLY=($(compgen -W "$(mrh COMPLETION COMMANDS)" -- ${cur}))
+        words="{" ".join(table)}"
         ;; # Gives commands
     2)
-        case ${first} in
-        git | pipenv | cmd)
-            COMPREPLY=($(compgen -W "$(mrh COMPLETION SUBCOMMANDS ${first})" -- ${cur}))
-            ;; # Gives subcommands for a command
-        *)
-            COMPREPLY=()
-            ;;
+        case ${{first}} in
+{subcommand_cases}
         esac
-        ;;
+        ;; # Gives subcommands for a command
     *)
-        case ${cur} in
-        -*)
-            COMPREPLY=($(compgen -W "$(mrh COMPLETION ARGS ${first} ${second})" -- ${cur}))
-            ;; # Gives args for subcommands of a command
-        *)
-            COMPREPLY=($(compgen -f -- ${cur})) # If no matches complete with files
-            ;;
-        esac
+        if [[ ${{cur}} == -* ]]; then
+            case ${{first}}:${{second}} in
+{options_cases}
+            esac # Gives args for subcommands of a command
+        elif [[ ${{prev}} == -f || ${{prev}} == --filter ]]; then
+            words="$(_mrh_repos)" # Gives repository names
+        elif [[ ${{first}}:${{second}} == git:checkout ]]; then
+            words="$(_mrh_branches | sort -u)" # Gives branch names
+        else
+            COMPREPLY=($(compgen -f -- ${{cur}})) # If no matches complete with files
+            return
+        fi
         ;;
     esac
-}
+    COMPREPLY=($(compgen -W "${{words}}" -- ${{cur}}))
+}}
 complete -F _mrh_complete mrh
 # END: Bash tab completion for multi_repo_helper
-
 """  # noqa: E501
-    )
@@ -3,8 +3,14 @@ __all__ = ["cs"]
 
 # Console pretty printing
 import os
+import re
+import shlex
+import signal
 import subprocess
+import sys
+from collections import deque
 from pathlib import Path
+from typing import IO
 
 
 class cs:
@@ -73,25 +79,252 @@ fgreen = cs(cs.GREEN, cs.MUTE)
 #
 fname = cs(cs.BOLD, cs.UNDERLINE, cs.MUTE, cs.BBLUE)
 fcode = cs(cs.ITALIC, cs.MUTE, cs.GREEN)
+fprefix = cs(cs.BOLD, cs.CYAN)
+# Results
+ferror = cs(cs.BOLD, cs.BLINK, cs.RED)
+fsuccess = cs(cs.BOLD, cs.GREEN)
+funderline = cs(cs.UNDERLINE)
+fstrike = cs(cs.STRIKE)
+fmute = cs(cs.MUTE)
 
 
-class cd:
-    """Context manager for changing the current working directory"""
+SHELL_CHARS = set("|&;<>()$`\\*?[]#~{}!\n")
+# Builtins and keywords that only exist in a shell, e.g. `cd`, `export`
+SHELL_WORDS = {
+    *("cd", "source", ".", "export", "unset", "set", "alias", "unalias", "eval"),
+    *("exec", "exit", "return", "shift", "trap", "ulimit", "umask", "wait"),
+    *("read", "readonly", "local", "type", "hash", "command", "builtin", "times"),
+    *("getopts", "jobs", "fg", "bg", ":", "if", "for", "while", "until", "case"),
+    *("function", "select", "time", "[["),
+}
+ASSIGNMENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*=")  # e.g. `FOO=1 make test`
 
-    def __init__(self, path: str | Path):
-        self.path = Path(path).resolve()
-        assert self.path.is_dir()
-        self.cwd = Path.cwd()
 
-    def __enter__(self):
-        os.chdir(self.path)
+def split_cmd(cmd: str) -> list[str]:
+    """Split a command into arguments. Commands that need a shell (pipes,
+    redirections, globs, variables, assignments, builtins...) are wrapped with
+    `sh -c`"""
+    if SHELL_CHARS.intersection(cmd):
+        return ["/bin/sh", "-c", cmd]
+    try:
+        args = shlex.split(cmd)
+    except ValueError:  # e.g. an unclosed quote, reported by the shell
+        return ["/bin/sh", "-c", cmd]
+    if not args or args[0] in SHELL_WORDS or ASSIGNMENT.match(args[0]):
+        return ["/bin/sh", "-c", cmd]
+    return args
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        os.chdir(self.cwd)
 
+def cmd_header(repository: Path, cmd: str) -> str:
+    return f"{fname(repository.name)}\n{fcode('$ '+cmd)}\n"
 
-def run_cmd(repository: Path, cmd: str):
-    print_str = f"{fname(repository.name)}\n{fcode('$ '+cmd)}\n"
-    cmd_str = f'printf "{print_str}" && {cmd}'
-    with cd(repository):
-        return subprocess.run(cmd_str, capture_output=True, shell=True)
+
+def repo_prefix(repository: Path) -> str:
+    return fprefix(f"[{repository.name}]") + " "
+
+
+def relative_name(repo: Path) -> str:
+    """Path of the repository relative to the current directory, or its name
+    when it is not under it"""
+    try:
+        return repo.relative_to(Path.cwd()).as_posix()
+    except ValueError:
+        return repo.name
+
+
+def print_prefixed(prefix: str, line: bytes):
+    """Write a single line of live output prefixed by the repository name"""
+    text = line.decode(errors="replace")
+    if not text.endswith("\n"):
+        text += "\n"
+    sys.stdout.write(prefix + text)
+    sys.stdout.flush()
+
+
+TIMEOUT_RETURNCODE = 124  # Same as coreutils `timeout`
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputSink:
+    """Collects the output of a command. Only the last `max_size` bytes are
+    kept in memory and, if `path` is given, everything is written to that
+    log file"""
+
+    def __init__(self, max_size: int | None = None, path: Path | None = None):
+        self.max_size = max_size
+        self.path = path
+        self.size = 0  # Total bytes written
+        self._chunks: deque[bytes] = deque()
+        self._kept = 0
+        self._file = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+        self._chunks.append(data)
+        self._kept += len(data)
+        if self.max_size is not None:
+            # Drop the oldest chunks that are not needed for the tail
+            while (
+                len(self._chunks) > 1
+                and self._kept - len(self._chunks[0]) >= self.max_size
+            ):
+                self._kept -= len(self._chunks.popleft())
+
+    def getvalue(self) -> bytes:
+        data = b"".join(self._chunks)
+        if self.max_size is not None and len(data) > self.max_size:
+            return data[len(data) - self.max_size :]  # noqa: E203
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def kill_process_group(pid: int):
+    """Kill a command started in its own session and all of its children"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def completed(
+    args, returncode: int, stdout: OutputSink, stderr: OutputSink
+) -> subprocess.CompletedProcess:
+    stdout.close()
+    stderr.close()
+    return subprocess.CompletedProcess(
+        args, returncode, stdout.getvalue(), stderr.getvalue()
+    )
+
+
+def run_cmd(
+    repository: Path,
+    cmd: str,
+    timeout: float | None = None,
+    stdout: OutputSink | None = None,
+    stderr: OutputSink | None = None,
+    stream: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a command in the repository. The command runs in its own session
+    so that it (and everything it started) is killed when it times out or mrh
+    is interrupted. The output is collected in `stdout`/`stderr` (in memory by
+    default) and, with `stream`, printed as soon as each line is written,
+    prefixed by the repository name"""
+    import threading
+
+    stdout = OutputSink() if stdout is None else stdout
+    stderr = OutputSink() if stderr is None else stderr
+    stdout.write(cmd_header(repository, cmd).encode())
+    args = split_cmd(cmd)
+    try:
+        proc = subprocess.Popen(
+            args,
+            cwd=repository,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+    except FileNotFoundError as e:
+        stderr.write(str(e).encode())
+        return completed(args, 127, stdout, stderr)
+
+    prefix = repo_prefix(repository)
+
+    def pump(pipe: IO[bytes], sink: OutputSink):
+        if stream:
+            for line in iter(pipe.readline, b""):
+                sink.write(line)
+                print_prefixed(prefix, line)
+        else:
+            for chunk in iter(lambda: pipe.read1(CHUNK_SIZE), b""):  # type: ignore
+                sink.write(chunk)
+
+    threads = [
+        threading.Thread(target=pump, args=(proc.stdout, stdout)),
+        threading.Thread(target=pump, args=(proc.stderr, stderr)),
+    ]
+    for t in threads:
+        t.start()
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(proc.pid)
+        proc.wait()
+        stderr.write(f"mrh: timed out after {timeout}s\n".encode())
+        returncode = TIMEOUT_RETURNCODE
+    except BaseException:
+        kill_process_group(proc.pid)
+        proc.wait()
+        raise
+    finally:
+        for t in threads:
+            t.join()
+        proc.stdout.close()  # type: ignore
+        proc.stderr.close()  # type: ignore
+    return completed(args, returncode, stdout, stderr)
+
+
+async def async_run_cmd(
+    repository: Path,
+    cmd: str,
+    stream: bool = False,
+    timeout: float | None = None,
+    stdout: OutputSink | None = None,
+    stderr: OutputSink | None = None,
+) -> subprocess.CompletedProcess:
+    """Asyncio counterpart of `run_cmd`"""
+    import asyncio  # imported here as it is only needed by the async engine
+
+    stdout = OutputSink() if stdout is None else stdout
+    stderr = OutputSink() if stderr is None else stderr
+    stdout.write(cmd_header(repository, cmd).encode())
+    args = split_cmd(cmd)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=repository,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+    except FileNotFoundError as e:
+        stderr.write(str(e).encode())
+        return completed(args, 127, stdout, stderr)
+
+    prefix = repo_prefix(repository)
+
+    async def pump(pipe: "asyncio.StreamReader", sink: OutputSink):
+        if stream:
+            while line := await pipe.readline():
+                sink.write(line)
+                print_prefixed(prefix, line)
+        else:
+            while chunk := await pipe.read(CHUNK_SIZE):
+                sink.write(chunk)
+
+    async def communicate() -> int:
+        await asyncio.gather(
+            pump(proc.stdout, stdout), pump(proc.stderr, stderr)  # type: ignore
+        )
+        return await proc.wait()
+
+    try:
+        returncode = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(proc.pid)
+        await proc.wait()
+        stderr.write(f"mrh: timed out after {timeout}s\n".encode())
+        returncode = TIMEOUT_RETURNCODE
+    except BaseException:
+        # Cancelled (e.g. Ctrl-C), do not leave the command running
+        kill_process_group(proc.pid)
+        await proc.wait()
+        raise
+    return completed(args, returncode, stdout, stderr)
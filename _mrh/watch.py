@@ -0,0 +1,108 @@
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Callable
+
+from .discovery import RepositoryIndex
+from .logger import get_logger
+
+__all__ = ["IndexWatcher"]
+
+_log = get_logger(__name__)
+
+# From <sys/inotify.h>
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of the name
+READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Events of the directories watched with the inotify api of Linux, called
+    through the C library. Raises OSError where it is not available"""
+
+    def __init__(self) -> None:
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            self._add = libc.inotify_add_watch
+            self._rm = libc.inotify_rm_watch
+            self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        except AttributeError as e:
+            raise OSError(f"No inotify: {e}") from None
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add(self, path: Path) -> int | None:
+        wd = self._add(self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        return wd if wd >= 0 else None
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """(watch, mask, name) of the next events, waits for at least one"""
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + size].rstrip(b"\0")  # noqa: E203
+            offset += size
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+
+def adds_or_removes_repositories(mask: int, name: str) -> bool:
+    """Whether an event in a scanned directory can change the repositories:
+    a directory or a `.git` file that is created, removed or renamed, or the
+    directory itself that is removed or renamed"""
+    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_Q_OVERFLOW):
+        return True
+    return name == ".git" or bool(mask & IN_ISDIR)
+
+
+class IndexWatcher:
+    """Scans the workspace of an index again as soon as one of its scanned
+    directories changes, without polling"""
+
+    def __init__(self, on_rescan: Callable[[RepositoryIndex], None]) -> None:
+        self.inotify = Inotify()
+        self.on_rescan = on_rescan
+        self.lock = threading.Lock()  # `add` is called from other threads
+        self.watches: dict[int, RepositoryIndex] = {}
+
+    def add(self, index: RepositoryIndex):
+        with self.lock:
+            for directory in index.directories:
+                if (wd := self.inotify.add(directory)) is not None:
+                    self.watches[wd] = index
+
+    def run(self):
+        while True:
+            stale: set[RepositoryIndex] = set()
+            for wd, mask, name in self.inotify.read():
+                with self.lock:
+                    if mask & IN_Q_OVERFLOW:  # Events were lost
+                        stale.update(self.watches.values())
+                    index = self.watches.get(wd)
+                    if mask & IN_IGNORED:  # The directory is gone
+                        self.watches.pop(wd, None)
+                if index is not None and adds_or_removes_repositories(mask, name):
+                    stale.add(index)
+            for index in stale:
+                index.rescan()
+                self.add(index)  # e.g. a new group of repositories
+                self.on_rescan(index)
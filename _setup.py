@@ -3,6 +3,7 @@ import shutil
 from pathlib import Path
 
 from _mrh.logger import get_logger
+from _mrh.tabcompletion import completion_script
 
 _log = get_logger(__name__)
 
@@ -55,13 +56,16 @@ def setup_executable():
             SHELLRC_FILE.write_text(text + f"\nexport PATH={HOME_BIN_DIR}:$PATH\n")
 
     def add_completion():
-        # Create tabcompletion
+        # Create tabcompletion. The completion script is generated now from
+        # COMMANDS so that pressing TAB never has to run mrh
+        HEADER = "# Auto generated for mrh. Please do not edit"
+        START, END = "# >>> START tabcompletion", "# <<< END tabcompletion"
         COMPLETION_TEXT = f"""
-# Auto generated for mrh. Please do not edit
-# >>> START tabcompletion
-[ -f {path_from_home(MRH_BIN_EXECUTABLE_FILE)} ] && source /dev/stdin <<<"$(mrh COMPLETION INIT)"
-# <<< END tabcompletion
-"""  # noqa
+{HEADER}
+{START}
+{completion_script().strip()}
+{END}
+"""
         assert ADD_COMPLETION
         assert COMPLETION_FILE
         HOME_COMPLETION_FILE = path_from_home(COMPLETION_FILE)
@@ -70,13 +74,21 @@ def setup_executable():
             _log.info(f"creating {HOME_COMPLETION_FILE}")
             COMPLETION_FILE.touch(mode=0o644)  # rw-r--r--
             COMPLETION_FILE.write_text(COMPLETION_TEXT)
-        elif COMPLETION_FILE.read_text().find(COMPLETION_TEXT) == -1:
+        elif (text := COMPLETION_FILE.read_text()).find(COMPLETION_TEXT) != -1:
+            _log.warning(f"mrh tabcompletion already exists in {HOME_COMPLETION_FILE}")
+        elif START in text and END in text:
+            # Replace the tabcompletion generated by a previous install
+            _log.info(f"updating mrh tabcompletion in {HOME_COMPLETION_FILE}")
+            before, _, rest = text.partition(START)
+            _, _, after = rest.partition(END)
+            before = before.rstrip("\n").removesuffix(HEADER).rstrip("\n")
+            COMPLETION_FILE.write_text(
+                before + "\n" + after.lstrip("\n") + COMPLETION_TEXT
+            )
+        else:
             # If file exists but doesn't have the tabcomplete text, add it
             _log.info(f"adding mrh tabcompletion to {HOME_COMPLETION_FILE}")
-            text = COMPLETION_FILE.read_text()
             COMPLETION_FILE.write_text(text + COMPLETION_TEXT)
-        else:
-            _log.warning(f"mrh tabcompletion already exists in {HOME_COMPLETION_FILE}")
 
         # Add tabcomplete to shellrc
         SHELLRC_TEXT = f"[ -f {HOME_COMPLETION_FILE} ] && source {HOME_COMPLETION_FILE}"
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Offline benchmarks of mrh on a synthetic workspace.
+
+Creates N git repositories, each with a local bare "remote", and times
+repository discovery, `git fetch`, `git pull`, `git push` and a free command
+for every combination of engine and pool size. Results are written to a json
+file that can be compared with the results of another run:
+
+    python benchmarks/bench.py --repos 50 --pool-sizes 5 10 20
+    python benchmarks/bench.py --compare benchmarks/results/<old>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+# Reproducible git, independent of the config of the user
+os.environ.update(
+    GIT_CONFIG_NOSYSTEM="1",
+    GIT_CONFIG_GLOBAL=os.devnull,
+    GIT_AUTHOR_NAME="mrh",
+    GIT_AUTHOR_EMAIL="mrh@example.com",
+    GIT_COMMITTER_NAME="mrh",
+    GIT_COMMITTER_EMAIL="mrh@example.com",
+    LOGGER_LEVEL="WARNING",
+)
+sys.path.insert(0, str(ROOT))
+
+from _mrh.actions import Action  # noqa: E402
+from _mrh.runner import get_filtered_dirs, multi_action  # noqa: E402
+
+FREE_COMMAND = "git log --oneline"
+
+
+def git(*args: str, cwd: Path, stdin: bytes | None = None):
+    subprocess.run(
+        ["git", *args], cwd=cwd, input=stdin, check=True, capture_output=True
+    )
+
+
+def history_stream(commits: int) -> bytes:
+    """`git fast-import` input with `commits` commits on main"""
+    lines = []
+    for i in range(commits):
+        data = f"line {i}\n" * (i + 1)
+        lines += [
+            "commit refs/heads/main",
+            f"committer mrh <mrh@example.com> {1700000000 + i} +0000",
+            f"data {len(f'commit {i}')}",
+            f"commit {i}",
+        ]
+        lines += [f"M 644 inline history.txt\ndata {len(data)}\n{data}"]
+        lines += (
+            [f"M 644 inline dirty.txt\ndata {len('clean')}\nclean"] if i == 0 else []
+        )
+    return ("\n".join(lines) + "\n").encode()
+
+
+def create_workspace(directory: Path, repos: int, commits: int, dirty: float) -> Path:
+    """Create `repos` repositories with `commits` commits each, pushed to a
+    local bare remote. The first `dirty` fraction of them has local changes"""
+    workspace, remotes = directory / "workspace", directory / "remotes"
+    workspace.mkdir()
+    remotes.mkdir()
+    (workspace / ".mrh.json").write_text(json.dumps({"no_notify": True}))
+    stream = history_stream(commits)
+    for i in range(repos):
+        repo, remote = workspace / f"repo{i:04d}", remotes / f"repo{i:04d}.git"
+        git("init", "-q", "-b", "main", str(repo), cwd=directory)
+        git("fast-import", "--quiet", cwd=repo, stdin=stream)
+        git("checkout", "-q", "-f", "main", cwd=repo)
+        git("init", "-q", "--bare", "-b", "main", str(remote), cwd=directory)
+        git("remote", "add", "origin", str(remote), cwd=repo)
+        git("push", "-q", "-u", "origin", "main", cwd=repo)
+        if i < repos * dirty:
+            (repo / "dirty.txt").write_text("dirty")
+    return workspace
+
+
+def prepare_pull(repositories: list[Path]):
+    # One commit behind the remote, keeping the local changes
+    for repo in repositories:
+        git("reset", "-q", "--keep", "HEAD~1", cwd=repo)
+
+
+def prepare_push(repositories: list[Path]):
+    # One commit ahead of the remote
+    for repo in repositories:
+        git("commit", "-q", "--allow-empty", "-m", "bench", cwd=repo)
+
+
+CASES = {
+    "git fetch": (Action("git", "fetch"), None),
+    "git pull": (Action("git", "pull"), prepare_pull),
+    "git push": (Action("git", "push"), prepare_push),
+    f"cmd free {FREE_COMMAND}": (
+        Action("cmd", "free", free_command=FREE_COMMAND),
+        None,
+    ),
+}
+
+
+def timed(fn, *args, **kwargs) -> tuple[float, str]:
+    """Duration and output of `fn`"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        fn(*args, **kwargs)
+    return time.perf_counter() - start, out.getvalue()
+
+
+def count_failures(jsonl: str) -> int:
+    return sum(json.loads(line)["returncode"] != 0 for line in jsonl.splitlines())
+
+
+def summary(
+    case: str, engine: str, pool_size: int, runs: list[float], failures: int = 0
+) -> dict:
+    return {
+        "case": case,
+        "engine": engine,
+        "pool_size": pool_size,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "runs": runs,
+        "failures": failures,
+    }
+
+
+def run_benchmarks(workspace: Path, args: argparse.Namespace) -> list[dict]:
+    results = []
+    repositories = get_filtered_dirs(workspace, ["*"], index=False)
+    for index in (False, True):
+        runs = [
+            timed(get_filtered_dirs, workspace, ["*"], index=index)[0]
+            for _ in range(args.repeat)
+        ]
+        results.append(summary(f"discovery (index={index})", "-", 0, runs))
+        print_result(results[-1])
+
+    for engine in args.engines:
+        for pool_size in args.pool_sizes:
+            for case, (action, prepare) in CASES.items():
+                runs, failures = [], 0
+                for _ in range(args.repeat):
+                    if prepare is not None:
+                        prepare(repositories)
+                    duration, records = timed(
+                        multi_action,
+                        action,
+                        repositories,
+                        verbose=False,
+                        pool_size=pool_size,
+                        engine=engine,
+                        history=False,
+                        format="jsonl",
+                    )
+                    runs.append(duration)
+                    failures += count_failures(records)
+                results.append(summary(case, engine, pool_size, runs, failures))
+                print_result(results[-1])
+    return results
+
+
+def print_result(result: dict):
+    print(
+        f"{result['case']:<28} {result['engine']:<8} {result['pool_size']:>4} "
+        f"{result['min'] * 1000:>10.1f} {result['median'] * 1000:>10.1f}"
+        + (f" ({result['failures']} failed)" if result["failures"] else ""),
+        flush=True,
+    )
+
+
+def compare(results: list[dict], baseline_path: Path, threshold: float):
+    """Print the change of the median of each benchmark against a baseline"""
+    baseline = {
+        (r["case"], r["engine"], r["pool_size"]): r
+        for r in json.loads(baseline_path.read_text())["results"]
+    }
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["case"], r["engine"], r["pool_size"]))
+        if old is None:
+            continue
+        ratio = r["median"] / old["median"]
+        flag = " SLOWER" if ratio > 1 + threshold else ""
+        flag = " FASTER" if ratio < 1 - threshold else flag
+        print(
+            f"{r['case']:<28} {r['engine']:<8} {r['pool_size']:>4} "
+            f"{old['median'] * 1000:>10.1f} -> {r['median'] * 1000:>10.1f} ms "
+            f"({ratio:.2f}x){flag}"
+        )
+
+
+def metadata(args: argparse.Namespace) -> dict:
+    revision = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True
+    )
+    git_version = subprocess.run(["git", "--version"], capture_output=True)
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision.stdout.decode().strip() or "unknown",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git": git_version.stdout.decode().strip(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of mrh")
+    parser.add_argument("--repos", type=int, default=20, help="Repositories")
+    parser.add_argument(
+        "--commits", type=int, default=50, help="Commits in each repository"
+    )
+    parser.add_argument(
+        "--dirty",
+        type=float,
+        default=0.25,
+        help="Fraction of the repositories with local changes",
+    )
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[4, 10, 20])
+    parser.add_argument("--engines", nargs="+", default=["process", "async"])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each case")
+    parser.add_argument(
+        "--output", type=Path, default=None, help="Where to write the results"
+    )
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="Results of a previous run"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change of the median reported as slower/faster",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    meta = metadata(args)
+    with tempfile.TemporaryDirectory(prefix="mrh-bench-") as tmp:
+        print(f"Creating {args.repos} repositories with {args.commits} commits...")
+        workspace = create_workspace(Path(tmp), args.repos, args.commits, args.dirty)
+        cwd = Path.cwd()
+        os.chdir(workspace)  # mrh runs in the current directory
+        try:
+            header = f"{'case':<28} {'engine':<8} {'pool':>4}"
+            print(f"{header} {'min (ms)':>10} {'med (ms)':>10}")
+            results = run_benchmarks(workspace, args)
+        finally:
+            os.chdir(cwd)
+
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+    print(f"Results written to {output}")
+    if args.compare is not None:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
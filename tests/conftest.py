@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+MRH = Path(__file__).resolve().parent.parent / "mrh.py"
+
+
+def git(repo: Path, *args: str):
+    subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def mrh(workspace: Path, *args: str) -> subprocess.CompletedProcess:
+    """Run mrh in `workspace`, without the daemon and the notification"""
+    config = workspace / ".mrh.json"
+    if not config.exists():
+        config.write_text(json.dumps({"no_notify": True}))
+    return subprocess.run(
+        [sys.executable, str(MRH), *args, "-c", str(config)],
+        cwd=workspace,
+        env={**os.environ, "MRH_NO_DAEMON": "1"},
+        capture_output=True,
+        check=True,
+    )
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    """Repository with a committed `file`"""
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    (repo / "file").write_text("first\n")
+    git(repo, "add", "file")
+    git(repo, "commit", "-q", "-m", "first")
+    return repo
+
+
+@pytest.fixture
+def clone(tmp_path: Path) -> Path:
+    """Clone of an upstream with a single commit"""
+    upstream = tmp_path / "upstream"
+    upstream.mkdir()
+    git(upstream, "init", "-q", "-b", "main")
+    git(upstream, "commit", "-q", "--allow-empty", "-m", "first")
+    git(tmp_path, "clone", "-q", str(upstream), "clone")
+    return tmp_path / "clone"
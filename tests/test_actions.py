@@ -0,0 +1,86 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from _mrh.actions import Action, Workflow
+from _mrh.engines import run_async, run_process_pool
+from _mrh.scheduler import Scheduler
+
+TRANSIENT = "fatal: unable to access 'https://example.com/': Could not resolve host"
+
+
+@pytest.fixture
+def fake_git(tmp_path: Path, monkeypatch):
+    """`git` that fails with `message` and counts its runs in `runs`"""
+
+    def install(message: str) -> Path:
+        runs = tmp_path / "runs"
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "git").write_text(
+            f'#!/bin/sh\necho run >> {runs}\necho "{message}" >&2\nexit 128\n'
+        )
+        (bin_dir / "git").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}:{Path(sys.executable).parent}:/bin")
+        return runs
+
+    return install
+
+
+def run(action: Action, repo: Path, retries: int = 2):
+    action.retries = retries
+    action.backoff = 0.01
+    return action.run(repo)
+
+
+def test_transient_network_failure_is_retried(tmp_path, fake_git):
+    runs = fake_git(TRANSIENT)
+    result = run(Action("git", "fetch"), tmp_path)
+    assert result.returncode == 128
+    assert len(runs.read_text().splitlines()) == 3
+
+
+def test_other_failure_is_not_retried(tmp_path, fake_git):
+    runs = fake_git("fatal: not a git repository")
+    run(Action("git", "fetch"), tmp_path)
+    assert len(runs.read_text().splitlines()) == 1
+
+
+def test_failure_of_a_command_that_is_not_network_is_not_retried(tmp_path, fake_git):
+    runs = fake_git(TRANSIENT)
+    run(Action("cmd", "free", free_command="git fetch"), tmp_path)
+    assert len(runs.read_text().splitlines()) == 1
+
+
+def workflow() -> Workflow:
+    steps = [
+        Action("cmd", "free", free_command="test -f ok"),
+        Action("cmd", "free", free_command="touch done"),
+    ]
+    return Workflow("release", steps, "release")
+
+
+@pytest.mark.parametrize("engine", [run_process_pool, run_async])
+def test_failing_step_stops_only_its_repository(tmp_path, engine):
+    repos = [tmp_path / "fails", tmp_path / "succeeds"]
+    for repo in repos:
+        repo.mkdir()
+    (tmp_path / "succeeds" / "ok").write_text("")
+    action = workflow()
+    results = engine(action, repos, Scheduler(action, 2))
+    assert [r.returncode for r in results] == [1, 0]
+    assert not (tmp_path / "fails" / "done").exists()
+    assert (tmp_path / "succeeds" / "done").exists()
+
+
+def test_workflow_round_trip():
+    action = workflow()
+    action.timeout = 30
+    action.steps[0].retries = 2
+    data = json.loads(json.dumps(action.to_dict()))
+    copy = Action.from_dict(data)
+    assert isinstance(copy, Workflow)
+    assert copy.to_dict() == action.to_dict()
+    assert (copy.key, copy.cmd_str) == ("workflow release", action.cmd_str)
@@ -0,0 +1,74 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+from conftest import git
+
+from _mrh.actions import Action
+from _mrh.cache import ResultCache
+
+
+def cache(tmp_path: Path, max_size: int = 10**6, max_age: float = 1) -> ResultCache:
+    return ResultCache(tmp_path / "cache", max_size, max_age)
+
+
+def run_cached(cache: ResultCache, action: Action, repo: Path):
+    """Result of `action` from the cache, or None after running and storing it"""
+    if (result := cache.get(action, repo)) is not None:
+        return result
+    cache.store(action, [action.run(repo)])
+    return None
+
+
+def entries(results: ResultCache) -> dict[str, Path]:
+    return {path.stem: path for path in results.directory.glob("*/*.json")}
+
+
+def test_clean_repeat_is_a_hit(tmp_path, repo):
+    action = Action("cmd", "free", free_command="echo built")
+    assert run_cached(cache(tmp_path), action, repo) is None
+    (entry,) = entries(cache(tmp_path)).values()
+    os.utime(entry, (0, time.time() - 3600))
+    result = cache(tmp_path).get(action, repo)
+    assert result is not None and result.cached
+    assert result.returncode == 0 and b"built" in result.stdout
+    assert entry.stat().st_mtime > time.time() - 60  # Recently used
+    # Another command is another entry
+    other = Action("cmd", "free", free_command="echo other")
+    assert cache(tmp_path).get(other, repo) is None
+
+
+@pytest.mark.parametrize("change", ["modified", "staged", "untracked"])
+def test_dirty_working_tree_is_a_miss(tmp_path, repo, change):
+    action = Action("cmd", "free", free_command="echo built")
+    run_cached(cache(tmp_path), action, repo)
+    if change == "untracked":
+        (repo / "new").write_text("new\n")
+    else:
+        (repo / "file").write_text("second\n")
+    if change == "staged":
+        git(repo, "add", "file")
+    assert cache(tmp_path).get(action, repo) is None
+    # The dirty content is an entry of its own
+    run_cached(cache(tmp_path), action, repo)
+    assert cache(tmp_path).get(action, repo) is not None
+
+
+def test_failures_are_not_stored(tmp_path, repo):
+    action = Action("cmd", "free", free_command="false")
+    run_cached(cache(tmp_path), action, repo)
+    assert cache(tmp_path).get(action, repo) is None
+
+
+def test_eviction_by_age_then_least_recently_used(tmp_path):
+    results = cache(tmp_path, max_size=250, max_age=1)
+    now = time.time()
+    for name, age in (("aaold", 2), ("bbused", 0.3), ("ccnew", 0.1), ("ddlru", 0.5)):
+        path = results.directory / name[:2] / f"{name}.json"
+        path.parent.mkdir(parents=True)
+        path.write_text("x" * 100)
+        os.utime(path, (now - age * 86400, now - age * 86400))
+    results.prune()
+    # Older than max_age, then the least recently used until under max_size
+    assert sorted(entries(results)) == ["bbused", "ccnew"]
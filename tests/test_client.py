@@ -0,0 +1,56 @@
+import os
+import socket
+
+import pytest
+
+from _mrh.client import connect, socket_dir, socket_path, trusted_peer
+
+
+@pytest.fixture
+def runtime_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    return tmp_path
+
+
+def serve(path: str) -> socket.socket:
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+    return server
+
+
+def test_socket_dir_is_private(runtime_dir):
+    folder = socket_dir()
+    assert folder == str(runtime_dir / "mrh")
+    assert os.stat(folder).st_mode & 0o777 == 0o700
+
+
+def test_socket_dir_usable_by_others_is_not_trusted(runtime_dir):
+    (runtime_dir / "mrh").mkdir(mode=0o777)
+    os.chmod(runtime_dir / "mrh", 0o777)
+    assert socket_dir() is None
+    assert socket_path("/workspace") is None
+    assert connect("/workspace") is None
+
+
+def test_connect_to_a_daemon_of_this_user(runtime_dir):
+    with serve(socket_path("/workspace")):
+        sock = connect("/workspace")
+        assert sock is not None
+        sock.close()
+
+
+def test_socket_of_another_user_is_not_trusted(runtime_dir):
+    if os.getuid() != 0:
+        pytest.skip("needs root to give the socket to another user")
+    path = socket_path("/workspace")
+    with serve(path):
+        os.chown(path, 65534, 65534)
+        assert connect("/workspace") is None
+
+
+def test_peer_of_this_user_is_trusted():
+    a, b = socket.socketpair(socket.AF_UNIX)
+    with a, b:
+        assert trusted_peer(a)
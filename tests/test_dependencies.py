@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import pytest
+
+from _mrh.actions import Action
+from _mrh.dependencies import dependency_graph, frontiers
+from _mrh.runner import multi_action
+
+# Appends the name of the repository to a file shared by all of them
+RECORD = 'sh -c "echo $(basename $PWD) >> ../order.txt"'
+
+
+@pytest.fixture
+def workspace(tmp_path: Path, monkeypatch) -> list[Path]:
+    repositories = []
+    for name in ("a", "b", "c", "d", "e"):
+        (tmp_path / name).mkdir()
+        repositories.append(tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    return repositories
+
+
+def run(repositories: list[Path], declared: dict, cmd: str, engine: str, skipped):
+    graph = dependency_graph(repositories, declared, pipfiles=False)
+    return multi_action(
+        Action("cmd", "free", free_command=cmd),
+        repositories,
+        verbose=False,
+        pool_size=1,  # the async engine waits for a free slot in every group
+        engine=engine,
+        history=False,
+        journal=False,
+        dependencies=graph,
+        skipped=skipped,
+    )
+
+
+@pytest.mark.parametrize("engine", ["process", "async"])
+def test_ordered_runs_each_group_after_its_dependencies(workspace, engine):
+    a, b, c, d, e = workspace
+    # a, b -> c, d -> e
+    declared = {"c": ["a", "b"], "d": ["a", "b"], "e": ["c", "d"]}
+    assert frontiers(dependency_graph(workspace, declared), workspace) == [
+        [a, b],
+        [c, d],
+        [e],
+    ]
+
+    results = run(workspace, declared, RECORD, engine, {})
+
+    assert [r.returncode for r in results] == [0] * 5
+    order = (workspace[0].parent / "order.txt").read_text().split()
+    assert sorted(order[:2]) == ["a", "b"]
+    assert sorted(order[2:4]) == ["c", "d"]
+    assert order[4] == "e"
+
+
+@pytest.mark.parametrize("engine", ["process", "async"])
+def test_ordered_skips_the_dependents_of_a_failure(workspace, engine):
+    a, b, c, d, e = workspace
+    declared = {"c": ["a"], "d": ["b"], "e": ["c"]}
+    skipped: dict[Path, str] = {}
+
+    results = run(
+        workspace, declared, 'sh -c "test $(basename $PWD) != a"', engine, skipped
+    )
+
+    assert {r.repo: r.returncode for r in results} == {a: 1, b: 0, d: 0}
+    assert skipped == {
+        c: "depends on a, which failed",
+        e: "depends on c, which was skipped",
+    }
+
+
+def test_dependency_cycle(workspace):
+    graph = dependency_graph(workspace, {"a": ["b"], "b": ["c"], "c": ["a"]})
+    with pytest.raises(ValueError, match="a -> b -> c -> a"):
+        frontiers(graph, workspace)
+
+
+def test_pipfile_dependencies(workspace):
+    a, b, c, _, _ = workspace
+    (c / "Pipfile").write_text(
+        '[packages]\na = {path = "../a", editable = true}\nrequests = "*"\n'
+        '[dev-packages]\nb = {git = "git+ssh://git@host/group/b.git", ref = "v1"}\n'
+    )
+    assert dependency_graph(workspace, {})[c] == {a, b}
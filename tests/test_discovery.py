@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from _mrh.discovery import INDEX_FILE_NAME, RepositoryIndex
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Path:
+    for name in ("a", "b", ".hidden", "group/c", "group/.d"):
+        (tmp_path / name / ".git").mkdir(parents=True)
+    (tmp_path / "not-a-repo").mkdir()
+    return tmp_path
+
+
+def names(repositories: list[Path], root: Path) -> list[str]:
+    return [repo.relative_to(root).as_posix() for repo in repositories]
+
+
+@pytest.mark.parametrize(
+    "filters, max_depth, selected",
+    [
+        (["*"], 1, [".hidden", "a", "b"]),
+        (["*"], 2, [".hidden", "a", "b", "group/.d", "group/c"]),
+        (["group/*"], 2, ["group/.d", "group/c"]),
+        (["a", "b*"], 1, ["a", "b"]),
+        ([], 2, []),
+    ],
+)
+def test_filter(workspace, filters, max_depth, selected):
+    index = RepositoryIndex(workspace, max_depth)
+    assert names(index.filter(filters), workspace) == selected
+
+
+def scans(index: RepositoryIndex, monkeypatch) -> bool:
+    """Whether loading the index scans the workspace"""
+    scanned = []
+    monkeypatch.setattr(index, "rescan", lambda: scanned.append(1) or [])
+    index.repositories
+    return bool(scanned)
+
+
+def test_files_written_in_the_workspace_keep_the_index(workspace, monkeypatch):
+    RepositoryIndex(workspace, 2).repositories
+    for name in (".mrh.history.json", ".mrh.journal.jsonl", "a/build.log"):
+        (workspace / name).write_text("")
+    assert not scans(RepositoryIndex(workspace, 2), monkeypatch)
+    # The new modification times are saved, the next run does not list them
+    states = json.loads((workspace / INDEX_FILE_NAME).read_text())["dirs"]
+    assert states["."][0] == workspace.stat().st_mtime_ns
+
+
+@pytest.mark.parametrize("new", ["e/.git", "group/.f/.git", "not-a-repo/.git"])
+def test_new_repositories_rebuild_the_index(workspace, monkeypatch, new):
+    RepositoryIndex(workspace, 2).repositories
+    (workspace / new).mkdir(parents=True)
+    assert scans(RepositoryIndex(workspace, 2), monkeypatch)
+    repositories = RepositoryIndex(workspace, 2).repositories
+    assert str(Path(new).parent) in repositories
@@ -0,0 +1,49 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from _mrh.actions import Action
+from _mrh.engines import run_async, run_process_pool
+from _mrh.scheduler import Scheduler
+
+ENGINES = [run_process_pool, run_async]
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def repositories(root: Path, delays: list[float]) -> list[Path]:
+    """Repositories where `sleep $(cat delay)` sleeps for each delay"""
+    repos = []
+    for i, delay in enumerate(delays):
+        repo = root / f"repo{i}"
+        repo.mkdir()
+        (repo / "delay").write_text(str(delay))
+        repos.append(repo)
+    return repos
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_results_in_input_order_callbacks_in_completion_order(tmp_path, engine):
+    repos = repositories(tmp_path, [0.6, 0.3, 0])
+    action = Action("cmd", "free", free_command="sleep $(cat delay); echo done")
+    completed = []
+    results = engine(
+        action,
+        repos,
+        Scheduler(action, len(repos)),
+        on_result=lambda repo, result: completed.append(repo),
+    )
+    assert [r.repo for r in results] == repos
+    assert all(r.returncode == 0 and b"done" in r.stdout for r in results)
+    assert completed == list(reversed(repos))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_streamed_lines_are_prefixed(tmp_path, engine, capfd):
+    repos = repositories(tmp_path, [0, 0])
+    action = Action("cmd", "free", free_command="echo one; echo two >&2")
+    engine(action, repos, Scheduler(action, 2), stream=True)
+    lines = ANSI_RE.sub("", capfd.readouterr().out).splitlines()
+    for repo in repos:
+        assert f"[{repo.name}] one" in lines
+        assert f"[{repo.name}] two" in lines
@@ -0,0 +1,70 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from _mrh.actions import Action, Result
+from _mrh.fingerprints import (
+    lock_skip_reason,
+    pipfile_hashes,
+    record_fingerprints,
+    sync_skip_reason,
+)
+
+PIPFILE = '[packages]\nrequests = "*"\n\n[requires]\npython_version = "3.11"\n'
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q"], cwd=repo, check=True)
+    (repo / "Pipfile").write_text(PIPFILE)
+    # `pipenv --venv` of a venv made of the current interpreter
+    venv = tmp_path / "venv"
+    (venv / "bin").mkdir(parents=True)
+    (venv / "pyvenv.cfg").write_text("home = /usr\n")
+    (venv / "bin" / "python").symlink_to(sys.executable)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "pipenv").write_text(f"#!/bin/sh\necho {venv}\n")
+    (bin_dir / "pipenv").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{Path(sys.executable).parent}:/usr/bin:/bin")
+    return repo
+
+
+def write_lock(repo: Path, pipfile_hash: str):
+    lock = {"_meta": {"hash": {"sha256": pipfile_hash}}, "default": {}}
+    (repo / "Pipfile.lock").write_text(json.dumps(lock))
+
+
+def succeeded(subcommand: str, repo: Path):
+    process = subprocess.CompletedProcess(subcommand, 0, b"", b"")
+    record_fingerprints(Action("pipenv", subcommand), [Result(repo, process, 0, 0)], 1)
+
+
+def test_lock_up_to_date(repo):
+    write_lock(repo, next(iter(pipfile_hashes(repo))))
+    assert lock_skip_reason(repo) == "lock up to date"
+
+
+def test_sync_does_not_mark_a_stale_lock_up_to_date(repo):
+    write_lock(repo, "stale")
+    assert lock_skip_reason(repo) is None
+
+    succeeded("sync", repo)
+
+    assert lock_skip_reason(repo) is None  # still has to be locked
+    assert sync_skip_reason(repo) == "venv up to date"
+
+
+def test_lock_marks_the_lock_up_to_date(repo):
+    write_lock(repo, "written by another pipenv version")
+    succeeded("lock", repo)
+    assert lock_skip_reason(repo) == "lock up to date"
+    assert sync_skip_reason(repo) is None  # the venv was not built
+
+    (repo / "Pipfile").write_text(PIPFILE + '\n[dev-packages]\npytest = "*"\n')
+    assert lock_skip_reason(repo) is None
@@ -0,0 +1,41 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from conftest import git
+
+from _mrh.grep import grep
+
+
+@pytest.fixture
+def repositories(tmp_path: Path) -> list[Path]:
+    """Repositories with 10 tracked lines matching `needle` each"""
+    repos = []
+    for name in ("a", "b", "c"):
+        repo = tmp_path / name
+        repo.mkdir()
+        git(repo, "init", "-q")
+        (repo / "file").write_text("".join(f"needle {i}\n" for i in range(10)))
+        git(repo, "add", "file")
+        repos.append(repo)
+    return repos
+
+
+def test_grep_does_not_import_the_runner():
+    # The runner imports grep when it runs `mrh git grep`
+    code = "import sys, _mrh.grep; assert '_mrh.runner' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_max_count_stops_every_search(repositories, capsys):
+    assert grep(repositories, "needle", max_count=15) == 0
+    assert len(capsys.readouterr().out.splitlines()) == 15
+
+
+@pytest.mark.parametrize(
+    "pattern, fixed_strings, returncode",
+    [("needle", False, 0), ("haystack", False, 1), ("[", False, 2), ("[", True, 1)],
+)
+def test_exit_code_like_grep(repositories, pattern, fixed_strings, returncode):
+    assert grep(repositories, pattern, fixed_strings=fixed_strings) == returncode
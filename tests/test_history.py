@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+from _mrh import history
+from _mrh.history import ALPHA, HISTORY_FILE_NAME, History
+
+
+def saved(workspace: Path) -> dict:
+    return json.loads((workspace / HISTORY_FILE_NAME).read_text())
+
+
+def test_expected_duration_is_a_moving_average(tmp_path):
+    repo = tmp_path / "a"
+    durations = History(tmp_path, "git fetch")
+    durations.record(repo, 10)
+    durations.save()
+    durations = History(tmp_path, "git fetch")
+    assert durations.expected(repo) == 10
+    durations.record(repo, 20)
+    durations.save()
+    assert (
+        History(tmp_path, "git fetch").expected(repo) == ALPHA * 20 + (1 - ALPHA) * 10
+    )
+
+
+def test_longest_first(tmp_path):
+    a, b, c = (tmp_path / name for name in "abc")
+    durations = History(tmp_path, "git fetch")
+    durations.record(a, 1)
+    durations.record(b, 3)
+    # Without history first, it may be the slowest
+    assert durations.longest_first([a, b, c]) == [c, b, a]
+
+
+def test_runs_finishing_together_keep_each_others_durations(tmp_path):
+    fetch, pull = History(tmp_path, "git fetch"), History(tmp_path, "git pull")
+    fetch.record(tmp_path / "a", 1)
+    pull.record(tmp_path / "b", 2)
+    fetch.save()
+    pull.save()
+    assert saved(tmp_path) == {
+        "git fetch": {str(tmp_path / "a"): 1},
+        "git pull": {str(tmp_path / "b"): 2},
+    }
+    assert [p.name for p in tmp_path.glob("*.tmp")] == []
+
+
+def test_actions_that_did_not_run_for_the_longest_time_are_dropped(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(history, "MAX_ACTIONS", 2)
+    for key in ("make", "make test", "make", "make lint"):
+        durations = History(tmp_path, key)
+        durations.record(tmp_path / "a", 1)
+        durations.save()
+    assert list(saved(tmp_path)) == ["make", "make lint"]
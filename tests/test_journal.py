@@ -0,0 +1,67 @@
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+from conftest import mrh
+
+from _mrh.actions import Action, Result
+from _mrh.journal import JOURNAL_FILE_NAME, MAX_SIZE, Journal, pending_repositories
+
+COMMAND = "test -f ok"
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Path:
+    """Repositories a, b and c, where `COMMAND` only succeeds in b"""
+    for name in ("a", "b", "c"):
+        (tmp_path / name / ".git").mkdir(parents=True)
+    (tmp_path / "b" / "ok").write_text("")
+    return tmp_path
+
+
+def ran_in(workspace: Path, *options: str) -> list[str]:
+    """Names of the repositories `COMMAND` ran in"""
+    proc = mrh(workspace, "cmd", "free", COMMAND, "--format", "jsonl", *options)
+    lines = proc.stdout.decode().splitlines()
+    return sorted(Path(json.loads(line)["repo"]).name for line in lines)
+
+
+def test_retry_failed_runs_only_the_failed_repositories(workspace):
+    assert ran_in(workspace) == ["a", "b", "c"]
+    (workspace / "a" / "ok").write_text("")
+    assert ran_in(workspace, "--retry-failed") == ["a", "c"]
+    # a now succeeded, c still fails
+    assert ran_in(workspace, "--retry-failed") == ["c"]
+
+
+def test_resume_skips_the_finished_repositories(workspace):
+    # A run interrupted after a (failed) and b finished
+    journal = Journal(workspace)
+    journal.start(
+        Action("cmd", "free", free_command=COMMAND),
+        [workspace / name for name in ("a", "b", "c")],
+    )
+    for name, returncode in (("a", 1), ("b", 0)):
+        process = subprocess.CompletedProcess(COMMAND, returncode, b"", b"")
+        journal.record(Result(workspace / name, process, 0.0, 0.1))
+    journal.finish(interrupted=True)
+    assert ran_in(workspace, "--resume") == ["c"]
+    assert ran_in(workspace, "--resume") == []
+
+
+def test_large_journal_is_rotated_by_a_new_run(workspace):
+    path = workspace / JOURNAL_FILE_NAME
+    action = Action("cmd", "free", free_command=COMMAND)
+    with open(path, "w") as f:
+        f.truncate(MAX_SIZE + 1)
+    journal = Journal(workspace)
+    journal.start(action, [workspace / "a"], resumed=True)
+    journal.finish()
+    assert not path.with_name(f"{JOURNAL_FILE_NAME}.1").exists()
+
+    journal = Journal(workspace)
+    journal.start(action, [workspace / "a"])
+    journal.finish()
+    assert path.with_name(f"{JOURNAL_FILE_NAME}.1").stat().st_size > MAX_SIZE
+    assert pending_repositories(workspace, action.key) == [workspace / "a"]
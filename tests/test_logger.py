@@ -0,0 +1,92 @@
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+
+from _mrh import logger
+from _mrh.actions import Action
+from _mrh.engines import run_process_pool, start_warm_pool, stop_warm_pool
+from _mrh.logger import (
+    discard_log_queue,
+    flush_logging,
+    log_queue,
+    start_logging,
+    stop_logging,
+)
+from _mrh.scheduler import Scheduler
+
+RECORDS = 2000
+
+
+@pytest.fixture(autouse=True)
+def stopped():
+    yield
+    stop_logging()
+    discard_log_queue()
+
+
+def worker_record(i: int) -> logging.LogRecord:
+    return logging.makeLogRecord(
+        dict(
+            name="_mrh.worker",
+            levelno=logging.INFO,
+            levelname="INFO",
+            msg=f"record {i}",
+        )
+    )
+
+
+def test_records_of_the_workers_are_written_before_stopping(tmp_path):
+    start_logging(log_dir=tmp_path)
+    queue = log_queue()
+    for i in range(RECORDS):
+        queue.put(worker_record(i))
+    stop_logging()
+    lines = (tmp_path / "mrh.log").read_text().splitlines()
+    written = [line.split()[-1] for line in lines if " record " in line]
+    assert written == list(map(str, range(RECORDS)))
+
+
+def test_discarded_queues_leave_no_thread():
+    threads = threading.active_count()
+    for _ in range(5):
+        log_queue()
+        discard_log_queue()
+    assert threading.active_count() == threads
+
+
+def run_in(tmp_path: Path, names: list[str]):
+    """`true` in new repositories, which logs `Running on <repo>` in each"""
+    repos = [tmp_path / name for name in names]
+    for repo in repos:
+        repo.mkdir()
+    action = Action("cmd", "free", free_command="true")
+    run_process_pool(action, repos, Scheduler(action, len(repos)))
+
+
+def test_workers_only_send_the_records_that_are_written(tmp_path):
+    start_logging("WARNING")
+    run_in(tmp_path, ["a", "b"])
+    flush_logging()
+    assert logger._forwarder.moved == 0
+
+
+def test_warm_workers_use_the_levels_of_the_current_run(tmp_path):
+    start_logging("WARNING")
+    start_warm_pool(2)
+    try:
+        start_logging("INFO", log_dir=tmp_path / "logs")
+        run_in(tmp_path, ["a", "b"])
+    finally:
+        stop_warm_pool()
+    stop_logging()
+    assert "Running on" in (tmp_path / "logs" / "a.mrh.log").read_text()
+
+
+def test_flush_writes_the_records_of_the_workers(tmp_path):
+    start_logging("INFO", log_dir=tmp_path / "logs")
+    run_in(tmp_path, ["a", "b", "c"])
+    flush_logging()
+    lines = (tmp_path / "logs" / "mrh.log").read_text().splitlines()
+    assert len([line for line in lines if "Running on" in line]) == 3
@@ -0,0 +1,17 @@
+import pytest
+
+from _mrh.parser import get_parser
+
+
+def test_usage_names_mrh(capsys):
+    # Not the name of the daemon process that may run the parser
+    with pytest.raises(SystemExit):
+        get_parser().parse_args(["git", "--bogus"])
+    assert capsys.readouterr().err.startswith("usage: mrh ")
+
+
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_max_count_must_be_positive(capsys, value):
+    with pytest.raises(SystemExit):
+        get_parser().parse_args(["git", "grep", "x", "--max-count", value])
+    assert "must be greater than 0" in capsys.readouterr().err
@@ -0,0 +1,41 @@
+import os
+
+from conftest import git
+
+from _mrh.predicates import matches
+
+
+def test_dirty(repo):
+    assert not matches(repo, dirty=True)
+    (repo / "untracked").write_text("")
+    assert not matches(repo, dirty=True)
+    (repo / "file").write_text("second\n")
+    assert matches(repo, dirty=True)
+
+
+def test_on_branch(repo):
+    assert matches(repo, on_branch="ma*")
+    assert not matches(repo, on_branch="feat/*")
+    git(repo, "checkout", "-q", "-b", "feat/x")
+    assert matches(repo, on_branch="feat/*")
+    git(repo, "checkout", "-q", "--detach")
+    assert not matches(repo, on_branch="*")
+
+
+def test_changed_since_a_date(repo):
+    assert matches(repo, changed_since_="2000-01-01")
+    assert matches(repo, changed_since_="1h")
+    assert not matches(repo, changed_since_="2400-01-01")
+    os.utime(repo / "file", (0, 14200000000))  # Modified in 2419
+    assert matches(repo, changed_since_="2400-01-01")
+
+
+def test_changed_since_a_ref(repo):
+    git(repo, "tag", "v1")
+    git(repo, "commit", "-q", "--allow-empty", "-m", "no change")
+    assert not matches(repo, changed_since_="v1")
+    assert not matches(repo, changed_since_="HEAD~1")
+    (repo / "file").write_text("second\n")
+    assert matches(repo, changed_since_="v1")
+    assert matches(repo, changed_since_="HEAD")
+    assert not matches(repo, changed_since_="no-such-ref")
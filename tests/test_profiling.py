@@ -0,0 +1,21 @@
+import json
+
+from conftest import mrh
+
+
+def test_trace_has_valid_events(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name / ".git").mkdir(parents=True)
+    trace = tmp_path / "trace.json"
+    mrh(tmp_path, "cmd", "free", "true", "--trace", str(trace))
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert {event["ph"] for event in events} == {"X", "M"}
+    for event in events:
+        assert isinstance(event["tid"], int)
+        if event["ph"] == "X":  # Complete events, in microseconds
+            assert event["ts"] >= 0 and event["dur"] >= 0
+    tracks = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert set(tracks.values()) == {"mrh", "a", "b"}
+    spans = {(tracks[e["tid"]], e["cat"]) for e in events if e["ph"] == "X"}
+    assert {("mrh", "phase"), ("a", "queue"), ("a", "command")} <= spans
+    assert ("b", "command") in spans
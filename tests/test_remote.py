@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from _mrh.actions import Action
+from _mrh.remote import ERROR_RETURNCODE, LOST_RETURNCODE, run_remote
+from _mrh.scheduler import Scheduler
+
+LOCAL = {"slots": 2}  # A worker started with the current interpreter
+NEVER_READY = {
+    "command": [sys.executable, "-c", "import time; time.sleep(60)"],
+    "start_timeout": 0.5,
+}
+
+
+@pytest.fixture
+def repositories(tmp_path: Path, monkeypatch) -> list[Path]:
+    monkeypatch.chdir(tmp_path)
+    repositories = [tmp_path / name for name in ("a", "b", "c")]
+    for repo in repositories:
+        repo.mkdir()
+    return repositories
+
+
+def run(repositories: list[Path], workers: list[dict], log_dir: Path | None = None):
+    action = Action("cmd", "free", free_command="pwd")
+    action.log_dir = log_dir
+    return run_remote(action, repositories, Scheduler(action, 2), workers=workers)
+
+
+def test_results_of_local_workers(repositories):
+    results = run(repositories, [LOCAL, LOCAL])
+    assert [r.returncode for r in results] == [0, 0, 0]
+    for repo, result in zip(repositories, results):
+        assert result.stdout.endswith(f"{repo}\n".encode())
+
+
+def test_error_of_a_repository_fails_only_that_repository(repositories, tmp_path):
+    # The worker can't write the output of `a` to its log file
+    (tmp_path / "logs" / "a.stdout.log").mkdir(parents=True)
+    results = run(repositories, [LOCAL], tmp_path / "logs")
+    assert [r.returncode for r in results] == [ERROR_RETURNCODE, 0, 0]
+    assert b"IsADirectoryError" in results[0].stderr
+
+
+def test_other_workers_run_the_repositories_of_a_worker_not_ready(repositories):
+    results = run(repositories, [NEVER_READY, LOCAL])
+    assert [r.returncode for r in results] == [0, 0, 0]
+
+
+def test_repositories_fail_when_no_worker_is_ready(repositories):
+    start = time.monotonic()
+    results = run(repositories, [NEVER_READY])
+    assert [r.returncode for r in results] == [LOST_RETURNCODE] * 3
+    assert time.monotonic() - start < 10
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from _mrh.actions import Action
+from _mrh.render import group_results, normalize
+
+# Prints its repository and a progress line, fails where there is a `fail` file
+COMMAND = "pwd; printf 'progress 50%%\\rprogress 100%%\\n'; test ! -f fail"
+
+
+def run(root: Path, failing: list[str], succeeding: list[str]):
+    action = Action("cmd", "free", free_command=COMMAND)
+    results = []
+    for name in failing + succeeding:
+        (root / name).mkdir()
+        if name in failing:
+            (root / name / "fail").write_text("")
+        results.append(action.run(root / name))
+    return results
+
+
+def test_normalize_removes_what_is_specific_to_the_repository(tmp_path):
+    (result,) = run(tmp_path, [], ["a"])
+    assert normalize(result.repo, result.stdout) == "<repo>\nprogress 100%"
+
+
+def test_identical_results_are_grouped_successes_first(tmp_path):
+    results = run(tmp_path, ["a", "b", "c"], ["d"])
+    groups = group_results(results)
+    assert [[r.repo.name for r in group] for group in groups] == [
+        ["d"],
+        ["a", "b", "c"],
+    ]
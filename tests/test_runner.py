@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+import pytest
+from conftest import git, mrh
+
+# Fields of a record of `--format jsonl`, as documented in the README
+RESULT_FIELDS = {
+    "action": str,
+    "cmd": str,
+    "repo": str,
+    "returncode": int,
+    "started": float,
+    "finished": float,
+    "duration": float,
+    "cached": bool,
+    "stdout_size": int,
+    "stderr_size": int,
+    "stdout_path": (str, type(None)),
+    "stderr_path": (str, type(None)),
+}
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Path:
+    for name in ("a", "b"):
+        git(tmp_path, "init", "-q", name)
+    return tmp_path
+
+
+def jsonl(workspace: Path, *args: str) -> list[dict]:
+    """Records written by mrh, each line has to be a json object"""
+    proc = mrh(workspace, *args, "--format", "jsonl")
+    return [json.loads(line) for line in proc.stdout.decode().splitlines()]
+
+
+def test_jsonl_record_of_each_repository(workspace):
+    records = jsonl(workspace, "cmd", "free", "test -f ok", "--log-dir", "logs")
+    assert sorted(Path(r["repo"]).name for r in records) == ["a", "b"]
+    for record in records:
+        assert set(record) == set(RESULT_FIELDS)
+        for field, types in RESULT_FIELDS.items():
+            assert isinstance(record[field], types), field
+        assert (record["action"], record["cmd"]) == ("test -f ok", "test -f ok")
+        assert record["returncode"] == 1
+        assert record["started"] <= record["finished"]
+        assert Path(record["stderr_path"]).exists()
+
+
+def test_jsonl_status_of_each_repository(workspace):
+    records = jsonl(workspace, "git", "status")
+    assert sorted(Path(r["repo"]).name for r in records) == ["a", "b"]
+    for record in records:
+        assert {"repo", "branch", "sha", "ahead", "behind", "dirty"} <= set(record)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+
+from _mrh import scheduler as scheduler_module
+from _mrh.actions import Action
+from _mrh.scheduler import CLASS_LIMITS, CPU_COUNT, Scheduler, inner_jobs
+
+FETCH = Action("git", "fetch")  # git fetch -j4 --all
+
+
+@pytest.mark.parametrize(
+    "cmd, jobs",
+    [
+        ("git fetch -j4 --all", 4),
+        ("make -j 8 test", 8),
+        ("make --jobs=3", 3),
+        ("make --jobs 2", 2),
+        ("echo build-j5", 1),
+        ("git fetch --all", 1),
+    ],
+)
+def test_inner_jobs(cmd, jobs):
+    assert inner_jobs(cmd) == jobs
+
+
+@pytest.mark.parametrize(
+    "action, pool_size, limits, max_running",
+    [
+        (FETCH, 1000, None, CLASS_LIMITS["network"] // 4),
+        (FETCH, 1000, {"network": 8}, 2),
+        (FETCH, 1000, {"network": 2}, 1),  # Always at least one
+        (FETCH, 3, None, 3),  # Up to pool_size
+        (Action("cmd", "free", free_command="make"), 1000, None, CPU_COUNT),
+    ],
+)
+def test_adaptive_limits(action, pool_size, limits, max_running):
+    scheduler = Scheduler(action, pool_size, "adaptive", limits)
+    assert scheduler.max_running == max_running
+
+
+def test_fixed_limit_is_the_pool_size():
+    assert Scheduler(FETCH, 3).max_running == 3
+
+
+@pytest.fixture
+def load(monkeypatch):
+    """Set the load average per cpu seen by the scheduler"""
+    monkeypatch.setattr(scheduler_module, "available_memory", lambda: 0.5)
+
+    def set_load(per_cpu: float):
+        monkeypatch.setattr(
+            scheduler_module.os, "getloadavg", lambda: (per_cpu * CPU_COUNT, 0, 0)
+        )
+
+    set_load(0)
+    return set_load
+
+
+def test_can_start_up_to_max_running(load):
+    scheduler = Scheduler(FETCH, 2)
+    for _ in range(2):
+        assert scheduler.can_start()
+        scheduler.start()
+    assert not scheduler.can_start()
+    scheduler.finish()
+    assert scheduler.can_start()
+
+
+def test_overloaded_machine_only_runs_one_command(load, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "POLL_INTERVAL", 0)
+    scheduler = Scheduler(FETCH, 10, "adaptive")
+    load(100)
+    assert scheduler.can_start()  # Always make progress
+    scheduler.start()
+    assert not scheduler.can_start()
+    load(0)
+    assert scheduler.can_start()
+
+
+def test_load_is_checked_once_per_poll_interval(load):
+    scheduler = Scheduler(FETCH, 10, "adaptive")
+    scheduler.start()
+    assert scheduler.can_start()
+    load(100)
+    assert scheduler.can_start()  # Until POLL_INTERVAL elapsed
+
+
+def test_acquire_waits_for_a_command_to_finish(load):
+    scheduler = Scheduler(FETCH, 1)
+
+    async def acquire_after_finish() -> float:
+        await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        finished = time.monotonic()
+        scheduler.finish()
+        await waiting
+        return time.monotonic() - finished
+
+    # Woken up by `finish`, not by polling
+    assert asyncio.run(acquire_after_finish()) < scheduler_module.POLL_INTERVAL
+    assert scheduler.running == 1
+
+
+def test_acquire_waits_while_overloaded(load, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "POLL_INTERVAL", 0.01)
+    scheduler = Scheduler(FETCH, 10, "adaptive")
+    load(100)
+
+    async def acquire_two():
+        await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        load(0)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(acquire_two())
+    assert scheduler.running == 2
@@ -0,0 +1,21 @@
+import time
+
+from conftest import git
+
+from _mrh.smart import pull_skip_reason
+
+
+def test_up_to_date(clone):
+    assert pull_skip_reason(clone) == "up to date"
+
+
+def test_unreachable_remote_pulls(clone):
+    git(clone, "remote", "set-url", "origin", str(clone.parent / "missing"))
+    assert pull_skip_reason(clone) is None
+
+
+def test_slow_remote_pulls_after_the_timeout(clone):
+    git(clone, "config", "remote.origin.uploadpack", "sleep 5; git-upload-pack")
+    start = time.monotonic()
+    assert pull_skip_reason(clone, timeout=0.5) is None
+    assert time.monotonic() - start < 4
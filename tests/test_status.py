@@ -0,0 +1,86 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+from conftest import git
+
+from _mrh import status as status_module
+from _mrh.gitrefs import Refs
+from _mrh.predicates import matches
+from _mrh.status import format_status, get_status, is_dirty
+
+
+@pytest.fixture
+def ahead(clone: Path) -> Path:
+    git(clone, "commit", "-q", "--allow-empty", "-m", "second")
+    return clone
+
+
+def test_ahead_of_upstream(ahead):
+    status = get_status(ahead)
+    assert (status.ahead, status.behind) == (1, 0)
+    assert matches(ahead, ahead=True)
+
+
+def test_upstream_that_can_not_be_compared(ahead):
+    # e.g. a shallow clone without the commits of the upstream
+    (ahead / ".git" / "refs" / "remotes" / "origin" / "main").write_text("1" * 40)
+    status = get_status(ahead)
+    assert (status.ahead, status.behind) == (None, None)
+    assert "could not compare" in format_status(status, 5)
+    assert not matches(ahead, ahead=True)
+
+
+@pytest.fixture
+def git_status_runs(monkeypatch) -> list:
+    """The `git status` run by `is_dirty`"""
+    runs = []
+    run = subprocess.run
+
+    def recording_run(args, *rest, **kwargs):
+        if args[:2] == ["git", "status"]:
+            runs.append(args)
+        return run(args, *rest, **kwargs)
+
+    monkeypatch.setattr(status_module.subprocess, "run", recording_run)
+    return runs
+
+
+@pytest.fixture
+def committed(clone: Path) -> Path:
+    (clone / "file").write_text("first\n")
+    git(clone, "add", "file")
+    git(clone, "commit", "-q", "-m", "file")
+    return clone
+
+
+@pytest.mark.parametrize("gc", [False, True])
+def test_refreshed_index_is_clean_without_git(committed, git_status_runs, gc):
+    if gc:
+        git(committed, "gc", "-q")  # HEAD is read from a pack
+    os.utime(committed / "file", (0, 0))
+    git(committed, "status")  # Writes the refreshed stat data to the index
+    git_status_runs.clear()
+    assert not is_dirty(Refs(committed))
+    assert git_status_runs == []
+
+
+def test_staged_changes_are_dirty(committed):
+    (committed / "file").write_text("second\n")
+    git(committed, "add", "file")
+    assert is_dirty(Refs(committed))
+    # Staged back to the content of HEAD
+    (committed / "file").write_text("first\n")
+    git(committed, "add", "file")
+    assert not is_dirty(Refs(committed))
+
+
+def test_index_of_another_tree_is_dirty_without_git(committed, git_status_runs):
+    # e.g. what `git cherry-pick -n` leaves, the index has the tree it stages
+    git(committed, "read-tree", "HEAD~1")
+    git(committed, "checkout-index", "-a", "-f")
+    git(committed, "status")
+    git_status_runs.clear()
+    assert is_dirty(Refs(committed))
+    assert git_status_runs == []
@@ -0,0 +1,52 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from _mrh.tabcompletion import completion_script, completion_table
+
+pytestmark = pytest.mark.skipif(not shutil.which("bash"), reason="needs bash")
+
+
+def complete(workspace: Path, line: str) -> set[str]:
+    """Words offered by the completion script for the last word of `line`"""
+    words = line.split(" ")
+    (workspace / "completion.sh").write_text(completion_script())
+    script = f"""
+        source completion.sh
+        COMP_WORDS=({" ".join(f"'{w}'" for w in words)})
+        COMP_CWORD={len(words) - 1}
+        _mrh_complete
+        printf '%s\\n' "${{COMPREPLY[@]}}"
+    """
+    proc = subprocess.run(
+        ["bash", "-c", script], cwd=workspace, capture_output=True, check=True
+    )
+    return set(proc.stdout.decode().split())
+
+
+def test_options_of_each_subcommand():
+    table = completion_table()
+    assert {"-i", "-w", "-F", "-m"} <= set(table["git"]["grep"])
+    assert "-i" not in table["git"]["fetch"]
+    assert "--filter" in table["git"]["fetch"]
+
+
+def test_subcommand_options_are_completed(tmp_path):
+    assert {"-i", "--ignore-case"} <= complete(tmp_path, "mrh git grep -")
+    assert "-i" not in complete(tmp_path, "mrh git fetch -")
+
+
+def test_nested_branch_names_are_completed(tmp_path):
+    git = tmp_path / "repo" / ".git"
+    for ref in ("heads/main", "heads/feature/x", "remotes/origin/fix/y"):
+        (git / "refs" / ref).parent.mkdir(parents=True, exist_ok=True)
+        (git / "refs" / ref).write_text("0" * 40)
+    (git / "packed-refs").write_text(f"{'1' * 40} refs/heads/release/1.0\n")
+    assert complete(tmp_path, "mrh git checkout ") == {
+        "main",
+        "feature/x",
+        "fix/y",
+        "release/1.0",
+    }
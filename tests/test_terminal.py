@@ -0,0 +1,152 @@
+import asyncio
+import signal
+import time
+from pathlib import Path
+
+import pytest
+
+from _mrh.terminal import (
+    TIMEOUT_RETURNCODE,
+    OutputSink,
+    async_run_cmd,
+    run_cmd,
+    split_cmd,
+)
+
+SHELL = ["/bin/sh", "-c"]
+
+
+@pytest.mark.parametrize(
+    "cmd, args",
+    [
+        ("git fetch -j4 --all", ["git", "fetch", "-j4", "--all"]),
+        ('git commit -m "a message"', ["git", "commit", "-m", "a message"]),
+        ("make test", ["make", "test"]),
+    ],
+)
+def test_split_cmd_without_shell_syntax(cmd, args):
+    assert split_cmd(cmd) == args
+
+
+@pytest.mark.parametrize(
+    "cmd",
+    [
+        "FOO=1 make test",
+        "cd sub",
+        "cd sub && make",
+        "source .env",
+        ". .env",
+        "export FOO=1",
+        "echo $HOME",
+        "ls *.py",
+        "make test | tail",
+        "if true; then echo yes; fi",
+        "echo 'unclosed",
+    ],
+)
+def test_split_cmd_with_shell_syntax(cmd):
+    assert split_cmd(cmd) == [*SHELL, cmd]
+
+
+@pytest.mark.parametrize(
+    "cmd, stdout",
+    [
+        ("FOO=1 printenv FOO", b"1\n"),
+        ("cd sub", b""),
+        ("cd sub && pwd", b"/sub\n"),
+        ("export FOO=2 && printenv FOO", b"2\n"),
+    ],
+)
+def test_run_cmd_runs_shell_commands(tmp_path: Path, cmd, stdout):
+    (tmp_path / "sub").mkdir()
+    process = run_cmd(tmp_path, cmd)
+    assert process.returncode == 0
+    assert process.stdout.endswith(stdout)
+
+
+@pytest.mark.parametrize(
+    "max_size, tail",
+    [(0, b""), (1, b"h"), (5, b"defgh"), (None, b"abcdefgh")],
+)
+def test_output_sink_keeps_the_tail(max_size, tail):
+    sink = OutputSink(max_size)
+    for chunk in (b"abc", b"defg", b"h"):
+        sink.write(chunk)
+    assert sink.size == 8
+    assert sink.getvalue() == tail
+
+
+# Starts a child in the background, like a build tool would, then waits
+BACKGROUND = "sleep 30 & echo $! > child.pid; sleep 30"
+
+
+def running(pid: int) -> bool:
+    """Whether the process exists and is not a zombie waiting to be reaped"""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return False
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+def stopped(pid: int) -> bool:
+    deadline = time.monotonic() + 5
+    while running(pid):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def child_pid(directory: Path) -> int:
+    deadline = time.monotonic() + 5
+    while not (path := directory / "child.pid").exists() or not path.read_text():
+        assert time.monotonic() < deadline, "the command did not start"
+        time.sleep(0.01)
+    return int(path.read_text())
+
+
+def test_run_cmd_timeout_kills_the_group(tmp_path: Path):
+    process = run_cmd(tmp_path, BACKGROUND, timeout=0.5)
+    assert process.returncode == TIMEOUT_RETURNCODE == 124
+    assert b"timed out after 0.5s" in process.stderr
+    assert stopped(child_pid(tmp_path))
+
+
+def test_async_run_cmd_timeout_kills_the_group(tmp_path: Path):
+    process = asyncio.run(async_run_cmd(tmp_path, BACKGROUND, timeout=0.5))
+    assert process.returncode == TIMEOUT_RETURNCODE
+    assert b"timed out after 0.5s" in process.stderr
+    assert stopped(child_pid(tmp_path))
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_interrupted_run_cmd_kills_the_group(tmp_path: Path):
+    def interrupt(*_):
+        raise Interrupted
+
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, 0.5)
+    try:
+        with pytest.raises(Interrupted):
+            run_cmd(tmp_path, BACKGROUND)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+    assert stopped(child_pid(tmp_path))
+
+
+def test_cancelled_async_run_cmd_kills_the_group(tmp_path: Path):
+    async def cancel() -> int:
+        task = asyncio.create_task(async_run_cmd(tmp_path, BACKGROUND))
+        while not (tmp_path / "child.pid").exists():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return child_pid(tmp_path)
+
+    assert stopped(asyncio.run(cancel()))
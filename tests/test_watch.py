@@ -0,0 +1,45 @@
+import os
+import queue
+import threading
+
+import pytest
+
+from _mrh.discovery import RepositoryIndex
+
+watch = pytest.importorskip("_mrh.watch")
+
+TIMEOUT = 5  # seconds to wait for an event
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    try:
+        rescans: queue.SimpleQueue = queue.SimpleQueue()
+        watcher = watch.IndexWatcher(rescans.put)
+    except OSError as e:
+        pytest.skip(str(e))
+    index = RepositoryIndex(tmp_path, max_depth=2, use_cache=False)
+    watcher.add(index)
+    threading.Thread(target=watcher.run, daemon=True).start()
+    return index, rescans
+
+
+def test_new_and_removed_repositories_are_found_right_away(tmp_path, watcher):
+    index, rescans = watcher
+    assert index.repositories == []
+
+    (tmp_path / "group" / "repo" / ".git").mkdir(parents=True)
+    while index.repositories != ["group/repo"]:
+        rescans.get(timeout=TIMEOUT)
+
+    os.rename(tmp_path / "group" / "repo", tmp_path / "group" / "renamed")
+    while index.repositories != ["group/renamed"]:
+        rescans.get(timeout=TIMEOUT)
+
+
+def test_files_do_not_rescan(tmp_path, watcher):
+    index, rescans = watcher
+    (tmp_path / ".mrh.history.json").write_text("{}")
+    (tmp_path / "notes.txt").write_text("")
+    with pytest.raises(queue.Empty):
+        rescans.get(timeout=0.2)